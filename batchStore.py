@@ -0,0 +1,348 @@
+# coding: UTF-8
+
+"""
+batchStore
+Persistent records of batch runs of pyImgProc (without wxPython).
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import json, csv
+from os import path, stat, replace, fsync
+from time import time
+from datetime import datetime
+
+DEBUG = False
+INDEX_FN = ".pyImgProc_index.json" # result index file in each output folder
+JOURNAL_FILE = "journal_pyImgProc.jsonl" # journal of the last batch run
+# fields of a record in the log of batch runs
+LOG_FIELDS = ['timestamp', 'status', 'source', 'output', 'processes',
+              'seconds', 'outBytes', 'error']
+
+#-----------------------------------------------------------------------
+
+def fileSig(fp):
+    """ Signature of a file's content, as its size and modification time.
+
+    Args:
+        fp (str): File path.
+
+    Returns:
+        (list): Size and modification time (ns) of the file.
+          None if the file doesn't exist.
+
+    Examples:
+        >>> fileSig('img1.jpg')
+        [52311, 1571734800000000000]
+    """
+    try: st = stat(fp)
+    except OSError: return None
+    return [st.st_size, st.st_mtime_ns]
+
+#-----------------------------------------------------------------------
+
+def readJournal(fp, sig):
+    """ Read source files, which were processed successfully 
+    with the given pipeline, from a journal file.
+
+    Args:
+        fp (str): File path of journal.
+        sig (str): Pipeline signature.
+
+    Returns:
+        done (set): Source file paths.
+
+    Examples:
+        >>> done = readJournal(JOURNAL_FILE, sig)
+    """
+    if DEBUG: print("batchStore.readJournal()")
+
+    done = set()
+    if not path.isfile(fp): return done
+    currSig = None # pipeline signature of the current session
+    with open(fp, 'r') as f:
+        for line in f:
+            try: rec = json.loads(line)
+            except ValueError: continue # line cut by a crash
+            if "sig" in rec: currSig = rec["sig"] # session header
+            elif currSig == sig and rec.get("err") == "": done.add(rec["src"])
+    return done
+
+#-----------------------------------------------------------------------
+
+def lastLineCut(fp):
+    """ Whether the last line of a file is not ended with a newline,
+    e.g.: a line of journal cut by a crash.
+
+    Args:
+        fp (str): File path.
+
+    Returns:
+        (bool)
+    """
+    try:
+        with open(fp, 'rb') as f:
+            f.seek(0, 2)
+            if f.tell() == 0: return False
+            f.seek(-1, 2)
+            return f.read(1) != b"\n"
+    except OSError:
+        return False
+
+#=======================================================================
+
+class BatchJournal:
+    """ Journal of a batch run, recording each processed file in a line
+    of JSON. Lines are flushed and fsynced in batches, 
+      so that a run, interrupted by a crash, can be resumed.
+
+    Args:
+        fp (str): File path of journal.
+        sig (str): Pipeline signature of this run.
+        flagResume (bool): Whether to resume the run recorded in the
+          journal. If False, the journal is started anew.
+        syncEvery (int): Number of records to write before fsync.
+        syncSec (float): Max. seconds between fsyncs.
+
+    Attributes:
+        done (set): When resuming, source files already processed
+          with the same pipeline signature.
+    """
+    def __init__(self, fp, sig, flagResume=False, syncEvery=64, syncSec=1.0):
+        if DEBUG: print("BatchJournal.__init__()")
+
+        if flagResume: self.done = readJournal(fp, sig)
+        else: self.done = set()
+        flagCut = flagResume and lastLineCut(fp)
+        self.f = open(fp, 'a' if flagResume else 'w')
+        if flagCut: self.f.write("\n") # end the line cut by a crash
+        self.syncEvery = syncEvery
+        self.syncSec = syncSec
+        self.nPending = 0 # number of records after the last fsync
+        self.lastSync = time()
+        ts = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+        self.f.write(json.dumps(dict(sig=sig, start=ts)) + "\n")
+        self.sync()
+
+    #-------------------------------------------------------------------
+
+    def record(self, fp, oFP, err=''):
+        """ Record a processed file.
+
+        Args:
+            fp (str): Source file path.
+            oFP (str): Output file path (None if failed).
+            err (str): Error message.
+
+        Returns:
+            None
+        """
+        self.f.write(json.dumps(dict(src=fp, out=oFP, err=err)) + "\n")
+        self.nPending += 1
+        if self.nPending >= self.syncEvery or \
+          time() - self.lastSync >= self.syncSec:
+            self.sync()
+
+    #-------------------------------------------------------------------
+
+    def sync(self):
+        """ Flush records to the disk.
+
+        Args: None
+
+        Returns: None
+        """
+        self.f.flush()
+        fsync(self.f.fileno())
+        self.nPending = 0
+        self.lastSync = time()
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Flush records and close the journal.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("BatchJournal.close()")
+
+        self.sync()
+        self.f.close()
+
+#=======================================================================
+
+class LogSink:
+    """ Log of batch runs, streaming one record per processed file
+    to a CSV file, or a JSON-lines file if its extension is '.jsonl'.
+    The file is opened once and written through a buffer of 
+      a limited size, so that records are not kept in memory.
+
+    Args:
+        fp (str): File path of log file. Records are appended.
+        bufSz (int): Size of write buffer in bytes.
+    """
+    def __init__(self, fp, bufSz=65536):
+        if DEBUG: print("LogSink.__init__()")
+
+        self.flagJSON = fp.lower().endswith(".jsonl")
+        flagNew = not path.isfile(fp) or path.getsize(fp) == 0
+        self.f = open(fp, 'a', newline='', buffering=bufSz)
+        if not self.flagJSON:
+            self.writer = csv.writer(self.f)
+            if flagNew: self.writer.writerow(LOG_FIELDS) # header
+
+    #-------------------------------------------------------------------
+
+    def write(self, rec):
+        """ Write a record.
+
+        Args:
+            rec (dict): Value of each field in LOG_FIELDS.
+
+        Returns:
+            None
+        """
+        if self.flagJSON: self.f.write(json.dumps(rec) + "\n")
+        else: self.writer.writerow([rec[k] for k in LOG_FIELDS])
+
+    #-------------------------------------------------------------------
+
+    def flush(self):
+        """ Write the buffered records.
+
+        Args: None
+
+        Returns: None
+        """
+        self.f.flush()
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Write the buffered records and close the file.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("LogSink.close()")
+
+        self.f.close()
+
+#=======================================================================
+
+class ResultCache:
+    """ Index of produced files, stored in INDEX_FN of each output folder.
+    For each source file, it records the source signature, the pipeline
+      signature (steps, parameters and output format) and the output file
+      with its signature. A file whose record still matches can be
+      skipped in the next run.
+    """
+    def __init__(self):
+        if DEBUG: print("ResultCache.__init__()")
+
+        self.indices = {} # index of each folder; key: folder path
+        self.dirty = set() # folders with unsaved changes
+
+    #-------------------------------------------------------------------
+
+    def getIndex(self, dp):
+        """ Get index of a folder, loading it from its file at first.
+
+        Args:
+            dp (str): Folder path.
+
+        Returns:
+            (dict): Record of each source and output (see recKey).
+        """
+        if dp not in self.indices:
+            try:
+                with open(path.join(dp, INDEX_FN), 'r') as f:
+                    self.indices[dp] = json.load(f)
+            except (OSError, ValueError):
+                self.indices[dp] = {} # no (or broken) index
+        return self.indices[dp]
+
+    #-------------------------------------------------------------------
+
+    def recKey(self, fp, oFP):
+        """ Key of the record of a source and its output in the index.
+
+        Args:
+            fp (str): Source file path.
+            oFP (str): Output file path.
+
+        Returns:
+            (str): File names of source and output, joined with '>'.
+        """
+        return "%s>%s"%(path.basename(fp), path.basename(oFP))
+
+    #-------------------------------------------------------------------
+
+    def isDone(self, fp, oFP, sig):
+        """ Whether the output of 'fp' is up to date.
+
+        Args:
+            fp (str): Source file path.
+            oFP (str): Output file path.
+            sig (str): Pipeline signature.
+
+        Returns:
+            (bool)
+        """
+        rec = self.getIndex(path.dirname(oFP)).get(self.recKey(fp, oFP))
+        if rec is None or rec["sig"] != sig: return False
+        oSig = fileSig(oFP)
+        if oSig is None or oSig != rec["outSig"]: return False
+        srcSig = fileSig(fp)
+        if srcSig == rec["srcSig"]: return True
+        # the source was replaced by its output
+        if fp == oFP and srcSig == rec["outSig"]: return True
+        return False
+
+    #-------------------------------------------------------------------
+
+    def record(self, fp, oFP, sig, srcSig):
+        """ Record a produced file.
+
+        Args:
+            fp (str): Source file path.
+            oFP (str): Output file path.
+            sig (str): Pipeline signature.
+            srcSig (list): Signature of the source before processing.
+
+        Returns:
+            None
+        """
+        dp = path.dirname(oFP)
+        self.getIndex(dp)[self.recKey(fp, oFP)] = dict(
+                                                    sig = sig,
+                                                    srcSig = srcSig,
+                                                    outSig = fileSig(oFP),
+                                                      )
+        self.dirty.add(dp)
+
+    #-------------------------------------------------------------------
+
+    def save(self):
+        """ Write changed indices to their files.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ResultCache.save()")
+
+        for dp in self.dirty:
+            fp = path.join(dp, INDEX_FN)
+            with open(fp + ".tmp", 'w') as f: json.dump(self.indices[dp], f)
+            replace(fp + ".tmp", fp) # replace the index at once
+        self.dirty = set()
+
+#=======================================================================
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,380 @@
+# coding: UTF-8
+
+"""
+benchmark
+Benchmark of pyImgProc (without wxPython).
+It generates synthetic images and measures decoding/ encoding
+  in each file format, each process alone, typical chains of processes
+  and throughput of batch processing with different numbers of workers.
+Results are written as JSON, and can be compared with results of
+  an earlier version to find regressions.
+
+Usage:
+    python benchmark.py [-o bench.json] [--sizes 640x480 1920x1080]
+                        [--compare old_bench.json]
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import sys, json, argparse, platform, tempfile, shutil
+from os import path, cpu_count
+from time import perf_counter
+from datetime import datetime
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from imgProcEngine import IMG_PROC_OPTIONS, EXT_LIST, MASK_FP
+from imgProcEngine import compilePlan, runBatch
+
+DEBUG = False
+BENCH_FILE = "bench_pyImgProc.json"
+# image sizes (width, height) from VGA to 8K
+BENCH_SIZES = [(640, 480), (1920, 1080), (3840, 2160), (7680, 4320)]
+BENCH_MODES = ['RGB', 'RGBA', 'L']
+# parameters of each process, representative of real use
+#   (defaults in IP_PARAM_VAL are mostly no-op)
+BENCH_PARAMS = dict(
+                    greyscale = [1],
+                    crop = [10, 10, 320, 240],
+                    crop_ratio = [0.1, 0.1, 0.5, 0.5],
+                    masking = ['#000000'],
+                    resize = [640, 480],
+                    resize_ratio = [0.5, 0.5],
+                    rotate = [30, 1],
+                    flip = [1],
+                    brighten = [20],
+                    darken = [20],
+                    levels = [20, 235, 1.2, 0, 255],
+                    gamma = [1.8],
+                    contrast = [1.5],
+                    invert = [],
+                    threshold = [128],
+                    text = ['pyImgProc', 0.1, 0.1, 24, '#ff0000'],
+                   )
+# typical chains of processes
+BENCH_CHAINS = dict(
+    thumbnail = [('resize_ratio', [0.25, 0.25]), ('greyscale', [0])],
+    crop_flip_text = [('crop_ratio', [0.1, 0.1, 0.8, 0.8]), ('flip', [1]),
+                      ('text', ['pyImgProc', 0.1, 0.1, 24, '#ff0000'])],
+    mask_brighten = [('masking', ['#000000']), ('brighten', [30])],
+    rotate_resize = [('rotate', [15, 0]), ('resize', [1280, 720])],
+    point = [('brighten', [20]), ('darken', [10]), ('gamma', [1.5]),
+             ('contrast', [1.2])],
+                   )
+REGRESSION_RATIO = 1.2 # slower than this ratio is reported as regression
+MIN_DIFF_SEC = 0.001 # smaller differences are ignored as noise
+
+#-----------------------------------------------------------------------
+
+def makeImg(w, h, mode, seed=0):
+    """ Make a synthetic image with gradients, shapes and noise,
+    so that it compresses like a photo rather than a flat image.
+
+    Args:
+        w (int): Width.
+        h (int): Height.
+        mode (str): 'RGB', 'RGBA' or 'L'.
+        seed (int): Seed of random noise.
+
+    Returns:
+        (np.ndarray): Image array.
+
+    Examples:
+        >>> arr = makeImg(640, 480, 'RGB')
+    """
+    rs = np.random.RandomState(seed)
+    y, x = np.mgrid[0:h, 0:w].astype(np.float32)
+    chs = [
+            x / w * 255,
+            y / h * 255,
+            (np.sin(x/37.0) * np.cos(y/23.0) + 1) * 127.5,
+            ((x-w/2)**2 + (y-h/2)**2 < (min(w, h)/3)**2) * 200.0 + 55,
+          ] # R, G, B, A
+    nCh = dict(RGB=3, RGBA=4, L=1)[mode]
+    arr = np.stack(chs[:nCh], axis=2)
+    arr += rs.normal(0, 12, arr.shape).astype(np.float32)
+    arr = np.clip(arr, 0, 255).astype(np.uint8)
+    if nCh == 1: arr = arr[:,:,0]
+    return arr
+
+#-----------------------------------------------------------------------
+
+def timeIt(func, repeat, setup=None):
+    """ Run a function repeatedly and measure its time.
+
+    Args:
+        func (function): Function without arguments, or with the 
+          returned value of 'setup' as its argument.
+        repeat (int): Number of runs.
+        setup (function, optional): Called before each run, outside
+          the measured time (e.g.: to copy the input).
+
+    Returns:
+        (dict): Minimum and median seconds ('min', 'median').
+    """
+    secs = []
+    for i in range(repeat):
+        if setup is None:
+            t0 = perf_counter()
+            func()
+        else:
+            arg = setup()
+            t0 = perf_counter()
+            func(arg)
+        secs.append(perf_counter() - t0)
+    return dict(min=min(secs), median=float(np.median(secs)))
+
+#-----------------------------------------------------------------------
+
+def benchCodecs(sizes, modes, extList, tmpDir, repeat):
+    """ Measure encoding and decoding of images in each file format.
+
+    Args:
+        sizes (list): Image sizes (width, height).
+        modes (list): Image modes.
+        extList (list): File extensions.
+        tmpDir (str): Folder to write files.
+        repeat (int): Number of runs of each measurement.
+
+    Returns:
+        rslts (list): Result dictionaries.
+    """
+    if DEBUG: print("benchmark.benchCodecs()")
+
+    rslts = []
+    for w, h in sizes:
+        for mode in modes:
+            img = Image.fromarray(makeImg(w, h, mode))
+            for ext in extList:
+                fp = path.join(tmpDir, "codec.%s"%(ext))
+                base = dict(size="%ix%i"%(w, h), mode=mode, fmt=ext)
+                try:
+                    enc = timeIt(lambda: img.save(fp), repeat)
+                    dec = timeIt(lambda: Image.open(fp).load(), repeat)
+                except Exception as e:
+                    # e.g.: RGBA in JPEG
+                    rslts.append(dict(base, group="codec", name=ext,
+                                      error=str(e)))
+                    continue
+                rslts.append(dict(base, group="encode", name=ext, **enc))
+                rslts.append(dict(base, group="decode", name=ext, **dec,
+                                  fileBytes=path.getsize(fp)))
+    return rslts
+
+#-----------------------------------------------------------------------
+
+def benchSteps(group, name, steps, sizes, modes, maskFP, repeat):
+    """ Measure processing of images in memory with given steps.
+
+    Args:
+        group (str): Group name of the result ('op' or 'chain').
+        name (str): Name of the result.
+        steps (list): List of (process name, parameter list) tuples.
+        sizes (list): Image sizes (width, height).
+        modes (list): Image modes.
+        maskFP (str): File path of masking image.
+        repeat (int): Number of runs of each measurement.
+
+    Returns:
+        rslts (list): Result dictionaries.
+    """
+    if DEBUG: print("benchmark.benchSteps()")
+
+    rslts = []
+    plan = compilePlan(steps, maskFP)
+    for w, h in sizes:
+        for mode in modes:
+            arr = makeImg(w, h, mode)
+            base = dict(group=group, name=name, size="%ix%i"%(w, h),
+                        mode=mode)
+            try:
+                plan.run(arr.copy()) # warm up (font, mask, etc.)
+                # a copy for each run, as the plan can modify it in place;
+                #   copied before the measured time
+                r = timeIt(plan.run, repeat, arr.copy)
+            except Exception as e:
+                rslts.append(dict(base, error=str(e)))
+                continue
+            rslts.append(dict(base, **r))
+    return rslts
+
+#-----------------------------------------------------------------------
+
+def benchBatch(nFiles, size, ext, workerList, tmpDir, maskFP):
+    """ Measure throughput of batch processing of files.
+
+    Args:
+        nFiles (int): Number of files.
+        size (tuple): Image size (width, height).
+        ext (str): File extension of input files.
+        workerList (list): Numbers of workers to measure.
+        tmpDir (str): Folder to write files.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        rslts (list): Result dictionaries.
+    """
+    if DEBUG: print("benchmark.benchBatch()")
+
+    fileList = []
+    for i in range(nFiles):
+        fp = path.join(tmpDir, "batch%04i.%s"%(i, ext))
+        Image.fromarray(makeImg(size[0], size[1], 'RGB', i)).save(fp)
+        fileList.append(fp)
+    nBytes = sum([path.getsize(fp) for fp in fileList])
+    rslts = []
+    for chainName, steps in sorted(BENCH_CHAINS.items()):
+        for nWorkers in workerList:
+            summary = runBatch(fileList, steps, '.png', logFile='',
+                               maskFP=maskFP, nWorkers=nWorkers)
+            sec = summary["sec"]
+            rslts.append(dict(
+                                group = "batch",
+                                name = chainName,
+                                size = "%ix%i"%size,
+                                fmt = ext,
+                                workers = nWorkers,
+                                nFiles = nFiles,
+                                nErr = summary["nErr"],
+                                sec = sec,
+                                imgPerSec = nFiles / sec,
+                                mbPerSec = nBytes / 1e6 / sec,
+                             ))
+    return rslts
+
+#-----------------------------------------------------------------------
+
+def resultKey(r):
+    """ Key to match a result with the same measurement in another run.
+
+    Args:
+        r (dict): Result dictionary.
+
+    Returns:
+        (str): Key.
+    """
+    ks = ['group', 'name', 'size', 'mode', 'fmt', 'workers']
+    return "/".join([str(r[k]) for k in ks if k in r])
+
+#-----------------------------------------------------------------------
+
+def compareResults(rslts, oldRslts, ratio=REGRESSION_RATIO):
+    """ Compare results with results of an earlier run.
+
+    Args:
+        rslts (list): Result dictionaries.
+        oldRslts (list): Result dictionaries of an earlier run.
+        ratio (float): Time ratio (new/old) to report as regression.
+
+    Returns:
+        regs (list): (key, old seconds, new seconds) tuples
+          of regressions.
+    """
+    old = {}
+    for r in oldRslts: old[resultKey(r)] = r
+    regs = []
+    for r in rslts:
+        o = old.get(resultKey(r))
+        if o is None or "error" in r or "error" in o: continue
+        k = "sec" if r["group"] == "batch" else "min"
+        if r[k] - o[k] < MIN_DIFF_SEC: continue
+        if r[k] > o[k] * ratio: regs.append((resultKey(r), o[k], r[k]))
+    return regs
+
+#-----------------------------------------------------------------------
+
+def runBenchmark(argv):
+    """ Run benchmark from the command line.
+
+    Args:
+        argv (list): Command line arguments (without program name).
+
+    Returns:
+        (int): Exit status; 1, if there's a regression.
+
+    Examples:
+        >>> runBenchmark(['--sizes', '640x480', '-o', 'bench.json'])
+    """
+    if DEBUG: print("benchmark.runBenchmark()")
+
+    parser = argparse.ArgumentParser(
+                    prog="benchmark",
+                    description="Benchmark processes of pyImgProc.",
+                                    )
+    parser.add_argument("-o", "--output", default=BENCH_FILE,
+                        help="JSON file of results (default: %s)"%(
+                                                            BENCH_FILE))
+    parser.add_argument("--sizes", nargs="+",
+                        default=["%ix%i"%s for s in BENCH_SIZES],
+                        help="image sizes, e.g.: 640x480 1920x1080")
+    parser.add_argument("--modes", nargs="+", default=BENCH_MODES,
+                        help="image modes (default: RGB RGBA L)")
+    parser.add_argument("--formats", nargs="+", default=EXT_LIST,
+                        help="file formats (default: %s)"%(
+                                                    " ".join(EXT_LIST)))
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="number of runs of each measurement")
+    parser.add_argument("--batch-files", type=int, default=32,
+                        help="number of files for batch throughput")
+    parser.add_argument("--workers", type=int, nargs="+",
+                        default=sorted(set([1, 2, 4, cpu_count()])),
+                        help="numbers of workers for batch throughput")
+    parser.add_argument("--compare", default="",
+                        help="JSON file of an earlier run to compare")
+    args = parser.parse_args(argv)
+
+    sizes = [tuple([int(v) for v in s.lower().split("x")])
+             for s in args.sizes]
+    maskFP = path.join(path.dirname(path.abspath(__file__)), MASK_FP)
+    tmpDir = tempfile.mkdtemp(prefix="pyImgProc_bench_")
+    rslts = []
+    try:
+        print("Encoding & decoding...")
+        rslts += benchCodecs(sizes, args.modes, args.formats, tmpDir,
+                             args.repeat)
+        for pn in IMG_PROC_OPTIONS:
+            print("Process: %s..."%(pn))
+            rslts += benchSteps("op", pn, [(pn, BENCH_PARAMS[pn])], sizes,
+                                args.modes, maskFP, args.repeat)
+        for name, steps in sorted(BENCH_CHAINS.items()):
+            print("Chain: %s..."%(name))
+            rslts += benchSteps("chain", name, steps, sizes, args.modes,
+                                maskFP, args.repeat)
+        print("Batch...")
+        batchSz = (1920, 1080) if (1920, 1080) in sizes else sizes[0]
+        rslts += benchBatch(args.batch_files, batchSz, 'jpg', args.workers,
+                            tmpDir, maskFP)
+    finally:
+        shutil.rmtree(tmpDir, ignore_errors=True)
+
+    meta = dict(
+                timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
+                python = platform.python_version(),
+                numpy = np.__version__,
+                pillow = PIL.__version__,
+                platform = platform.platform(),
+                cpuCount = cpu_count(),
+                repeat = args.repeat,
+               )
+    with open(args.output, 'w') as f:
+        json.dump(dict(meta=meta, results=rslts), f, indent=1)
+    nErr = len([r for r in rslts if "error" in r])
+    print("%i results (%i not supported) are saved in %s"%(len(rslts),
+                                                          nErr, args.output))
+    if args.compare != "":
+        with open(args.compare, 'r') as f: oldRslts = json.load(f)["results"]
+        regs = compareResults(rslts, oldRslts)
+        for k, o, n in regs:
+            print("[REGRESSION] %s: %.4f -> %.4f sec."%(k, o, n))
+        print("%i regressions (slower than x%.1f)."%(len(regs),
+                                                     REGRESSION_RATIO))
+        if len(regs) > 0: return 1
+    return 0
+
+#=======================================================================
+
+if __name__ == '__main__':
+    sys.exit(runBenchmark(sys.argv[1:]))
@@ -0,0 +1,594 @@
+# coding: UTF-8
+
+"""
+fileIndex
+Finding image files in folders for pyImgProc (without wxPython).
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import re
+from os import scandir, stat, path
+from fnmatch import translate
+from array import array
+from bisect import bisect_right
+from time import mktime, strptime, time_ns
+from threading import Lock
+
+DEBUG = False
+SIZE_UNITS = dict(k=1024, m=1024**2, g=1024**3) # units of size filter
+MTIME_TICK_NS = 2 * 10**9 # coarsest tick of modification time of folders
+  # (e.g.: FAT, some network folders)
+
+#-----------------------------------------------------------------------
+
+def walkImgFiles(folders, pattern="*", extList=[], recursive=False,
+                 isCancelled=None, batchSz=1000):
+    """ Find files, matching with the file name pattern and extensions,
+    in the given folders with os.scandir.
+    Found files are yielded in batches, so that a caller can show them
+      while the search continues.
+
+    Args:
+        folders (list): Folder paths to search.
+        pattern (str): File filter (see parseFileFilter); e.g.: file 
+          name pattern with wildcard characters. As with glob, names 
+          starting with '.' only match a pattern starting with '.'.
+        extList (list): File extensions (case-insensitive) to accept.
+          Empty list means accepting all extensions.
+        recursive (bool): Whether to search sub-folders 
+          (except hidden ones).
+        isCancelled (function, optional): Checked between batches.
+          When it returns True, the search stops.
+        batchSz (int): Max. number of files in a batch.
+
+    Yields:
+        batch (list): File paths found.
+
+    Examples:
+        >>> for batch in walkImgFiles(['./imgs'], '*.*', ['jpg', 'png']):
+        ...     print(len(batch))
+    """
+    if DEBUG: print("fileIndex.walkImgFiles()")
+
+    extSet = set([ext.lower() for ext in extList])
+    ff = parseFileFilter(pattern)
+    batch = []
+    dirs = list(reversed(folders)) # folders to search; used as a stack
+    while len(dirs) > 0:
+        if isCancelled is not None and isCancelled(): return
+        dp = dirs.pop()
+        try:
+            with scandir(dp) as it: entries = sorted(it, key=_entryName)
+        except OSError:
+            continue # not accessible
+        subDirs = []
+        for e in entries:
+            # type is known from the directory entry, mostly without stat
+            try: flagDir = e.is_dir()
+            except OSError: continue # removed while scanning
+            if flagDir:
+                # hidden folders are skipped as with glob
+                if recursive and not e.name.startswith("."):
+                    subDirs.append(e.path)
+                continue
+            if len(extSet) > 0:
+                if e.name.rpartition(".")[2].lower() not in extSet: continue
+            if not ff.matchName(e.name): continue
+            if ff.flagStat: # size or date filter
+                try: st = e.stat()
+                except OSError: continue
+                if not ff.matchStat(st.st_size, st.st_mtime): continue
+            batch.append(e.path)
+            if len(batch) >= batchSz:
+                yield batch
+                batch = []
+                if isCancelled is not None and isCancelled(): return
+        dirs += reversed(subDirs) # search sub-folders in sorted order
+    if len(batch) > 0: yield batch
+
+#-----------------------------------------------------------------------
+
+def _entryName(entry):
+    """ Key function to sort directory entries by name. """
+    return entry.name
+
+#-----------------------------------------------------------------------
+
+def listImgFiles(folders, pattern="*", extList=[], recursive=False):
+    """ Find files as walkImgFiles, returning them in a list.
+
+    Args:
+        folders (list): Folder paths to search.
+        pattern (str): File name pattern with wildcard characters.
+        extList (list): File extensions (case-insensitive) to accept.
+        recursive (bool): Whether to search sub-folders.
+
+    Returns:
+        fileList (list): File paths found.
+
+    Examples:
+        >>> listImgFiles(['./imgs'], '*.*', ['jpg', 'png'], True)
+    """
+    if DEBUG: print("fileIndex.listImgFiles()")
+
+    fileList = []
+    for batch in walkImgFiles(folders, pattern, extList, recursive):
+        fileList += batch
+    return fileList
+
+#-----------------------------------------------------------------------
+
+def parseFileFilter(txt):
+    """ Compile a file filter from text.
+    The text has one or more items separated by ';'. 
+    An item is one of
+      - file name pattern with wildcard characters (e.g.: 'img_*.jpg'),
+      - regular expression after 're:', searched in file names
+        (e.g.: 're:_[0-9]{4}\\.'),
+      - size filter with optional unit k, M or G (e.g.: 'size>100k'),
+      - modification date filter (e.g.: 'date>=2019-10-01').
+    A file is accepted when its name matches any of the patterns and
+      regular expressions (all names, if there's none), and it passes
+      all size and date filters.
+
+    Args:
+        txt (str): Filter text.
+
+    Returns:
+        (FileFilter): Compiled filter.
+
+    Examples:
+        >>> ff = parseFileFilter("*.jpg; re:^scan; size>1M")
+        >>> ff.match("scan01.png", 2000000, 1571734800.0)
+        True
+    """
+    if DEBUG: print("fileIndex.parseFileFilter()")
+
+    ff = FileFilter()
+    wildcards = [] 
+    regexes = []
+    for item in txt.split(";"):
+        item = item.strip()
+        if item == "": continue
+        m = re.match(r"(size|date)\s*(<=|>=|<|>)\s*(.+)$", item, re.I)
+        if item.startswith("re:"):
+            regexes.append(item[3:])
+        elif m is not None:
+            key, op, val = m.group(1).lower(), m.group(2), m.group(3).strip()
+            if key == 'size':
+                unit = SIZE_UNITS.get(val[-1].lower(), 1)
+                if unit > 1: val = val[:-1]
+                val = float(val) * unit
+            else:
+                fmt = "%Y-%m-%d %H:%M" if ":" in val else "%Y-%m-%d"
+                val = mktime(strptime(val, fmt))
+            ff.limits.append((key, op, val))
+        else:
+            wildcards.append(item)
+    if len(wildcards) == 0 and len(regexes) == 0: wildcards.append("*")
+    if len(wildcards) > 0:
+        res = []
+        for pat in wildcards:
+            pat = path.normcase(pat)
+            # as with glob, hidden files only match a pattern with '.'
+            if pat.startswith("."): res.append(translate(pat))
+            else: res.append(r"(?!\.)" + translate(pat))
+        ff.wildcardRE = re.compile("|".join(res))
+    if len(regexes) > 0:
+        ff.regexRE = re.compile("|".join(["(?:%s)"%(r) for r in regexes]))
+    ff.flagStat = len(ff.limits) > 0
+    return ff
+
+#=======================================================================
+
+class PathIndex:
+    """ Compact list of file paths.
+    Instead of a Python string per path, each folder path is stored once
+      and file names are packed in one byte buffer with 4-byte offsets.
+      Folders are stored per run of consecutive files in the same
+      folder (as files are found folder by folder), not per file.
+      A path takes its encoded file name and about 4 bytes, instead of
+      about 100 bytes of a string in a list.
+    File names, in total, can be up to 4 GiB.
+    It supports len(), indexing and iteration like a list.
+
+    Args:
+        fileList (list, optional): Initial file paths.
+    """
+    def __init__(self, fileList=[]):
+        if DEBUG: print("PathIndex.__init__()")
+
+        self.clear()
+        self.extend(fileList)
+
+    #-------------------------------------------------------------------
+
+    def clear(self):
+        """ Remove all paths.
+
+        Args: None
+
+        Returns: None
+        """
+        self.dirs = [] # folder paths
+        self.dirIdx = {} # index of each folder path in self.dirs
+        self.names = bytearray() # encoded file names
+        self.offsets = array('I', [0]) # start offset of each file name
+          # in self.names (and the end offset of the last name)
+        self.runStarts = array('I') # index of the first file of each run
+          # of files in the same folder
+        self.runDirs = array('I') # folder index of each run
+
+    #-------------------------------------------------------------------
+
+    def append(self, fp):
+        """ Append a file path.
+
+        Args:
+            fp (str): File path.
+
+        Returns: None
+        """
+        dp, fn = path.split(fp)
+        di = self.dirIdx.get(dp)
+        if di is None:
+            di = len(self.dirs)
+            self.dirIdx[dp] = di
+            self.dirs.append(dp)
+        if len(self.runDirs) == 0 or self.runDirs[-1] != di:
+            self.runStarts.append(len(self))
+            self.runDirs.append(di)
+        self.names += fn.encode("utf-8", "surrogateescape")
+        self.offsets.append(len(self.names))
+
+    #-------------------------------------------------------------------
+
+    def extend(self, fileList):
+        """ Append file paths.
+
+        Args:
+            fileList (list): File paths.
+
+        Returns: None
+        """
+        for fp in fileList: self.append(fp)
+
+    #-------------------------------------------------------------------
+
+    def copy(self):
+        """ Return a copy.
+
+        Args: None
+
+        Returns:
+            (PathIndex)
+        """
+        pi = PathIndex()
+        pi.dirs = list(self.dirs)
+        pi.dirIdx = dict(self.dirIdx)
+        pi.names = bytearray(self.names)
+        pi.offsets = array('I', self.offsets)
+        pi.runStarts = array('I', self.runStarts)
+        pi.runDirs = array('I', self.runDirs)
+        return pi
+
+    #-------------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0: i += len(self)
+        if i < 0 or i >= len(self): raise IndexError("index out of range")
+        fn = self.names[self.offsets[i]:self.offsets[i+1]]
+        fn = fn.decode("utf-8", "surrogateescape")
+        di = self.runDirs[bisect_right(self.runStarts, i) - 1]
+        return path.join(self.dirs[di], fn)
+
+    def __iter__(self):
+        for i in range(len(self)): yield self[i]
+
+#=======================================================================
+
+class FileFilter:
+    """ Compiled file filter, made by parseFileFilter.
+
+    Attributes:
+        wildcardRE (re.Pattern): Wildcard patterns, joined.
+        regexRE (re.Pattern): Regular expressions, joined.
+        limits (list): (key, operator, value) tuples of size (bytes)
+          and date (seconds since epoch) filters.
+        flagStat (bool): Whether size and modification time of files
+          are needed.
+    """
+    def __init__(self):
+        self.wildcardRE = None
+        self.regexRE = None
+        self.limits = []
+        self.flagStat = False
+
+    #-------------------------------------------------------------------
+
+    def matchName(self, fn):
+        """ Whether a file name matches.
+
+        Args:
+            fn (str): File name.
+
+        Returns:
+            (bool)
+        """
+        if self.wildcardRE is not None and \
+          self.wildcardRE.match(path.normcase(fn)) is not None:
+            return True
+        if self.regexRE is not None and self.regexRE.search(fn) is not None:
+            return True
+        return False
+
+    #-------------------------------------------------------------------
+
+    def matchStat(self, size, mtime):
+        """ Whether size and modification time of a file pass the filters.
+
+        Args:
+            size (int): File size in bytes.
+            mtime (float): Modification time in seconds since epoch.
+
+        Returns:
+            (bool)
+        """
+        for key, op, val in self.limits:
+            v = size if key == 'size' else mtime
+            if op == '<' and not v < val: return False
+            if op == '>' and not v > val: return False
+            if op == '<=' and not v <= val: return False
+            if op == '>=' and not v >= val: return False
+        return True
+
+    #-------------------------------------------------------------------
+
+    def match(self, fn, size=0, mtime=0.0):
+        """ Whether a file passes the filter.
+
+        Args:
+            fn (str): File name.
+            size (int): File size in bytes.
+            mtime (float): Modification time in seconds since epoch.
+
+        Returns:
+            (bool)
+        """
+        return self.matchName(fn) and self.matchStat(size, mtime)
+
+#=======================================================================
+
+class DirIndex:
+    """ In-memory index of folder contents; names of files with 
+    the given extensions, and sub-folders of each scanned folder.
+      Sizes and modification times of files are read (stat) only when
+      they are needed (e.g.: a size or date filter), and then kept
+      with the record of the folder.
+    Once folders are scanned, a changed filter is answered from the
+      index, without touching the disk. Folders are scanned again
+      only when they are invalidated (explicit refresh) or, 
+      with 'flagCheck', when their modification time changed 
+      (a file was added, removed or renamed), or when it was within
+      MTIME_TICK_NS of the scan (a following change in the same tick
+      of a coarse clock doesn't change it again).
+    Modification time of a folder doesn't change, when an existing file
+      is rewritten in place, so such a change is noticed only after
+      an explicit refresh.
+    Records of folders are replaced as a whole, so that a search in 
+      a thread doesn't see a half-updated folder, and the records are
+      guarded with a lock, as they are replaced by searching threads
+      and invalidated by others.
+
+    Args:
+        extList (list): File extensions (case-insensitive) to index.
+          Empty list means all extensions.
+
+    Examples:
+        >>> di = DirIndex(['jpg', 'png'])
+        >>> for batch in di.find(['./imgs'], '*.jpg; size>1M', True):
+        ...     print(len(batch))
+    """
+    def __init__(self, extList=[]):
+        if DEBUG: print("DirIndex.__init__()")
+
+        self.extSet = set([ext.lower() for ext in extList])
+        self.lock = Lock()
+        self.recs = {} # record of each folder; key: folder path
+          # value: (folder mtime (ns), file names (tuple), 
+          #         sizes (array), mtimes (array), sub-folders (tuple),
+          #         time of scan (ns))
+          # sizes and mtimes are None, until they are read (statRec)
+
+    #-------------------------------------------------------------------
+
+    def scanDir(self, dp):
+        """ Scan a folder and (re)place its record.
+        Files are not stat-ed (see statRec).
+
+        Args:
+            dp (str): Folder path.
+
+        Returns:
+            rec (tuple): Record of the folder. None if not accessible.
+        """
+        try:
+            scanNS = time_ns()
+            dMTime = stat(dp).st_mtime_ns
+            with scandir(dp) as it: entries = sorted(it, key=_entryName)
+        except OSError:
+            with self.lock: self.recs.pop(dp, None)
+            return None
+        names = []
+        subDirs = []
+        for e in entries:
+            # type is known from the directory entry, mostly without stat
+            try: flagDir = e.is_dir()
+            except OSError: continue # removed while scanning
+            if flagDir:
+                # hidden folders are skipped as with glob
+                if not e.name.startswith("."): subDirs.append(e.path)
+                continue
+            if len(self.extSet) > 0 and \
+              e.name.rpartition(".")[2].lower() not in self.extSet:
+                continue
+            names.append(e.name)
+        rec = (dMTime, tuple(names), None, None, tuple(subDirs), scanNS)
+        with self.lock: self.recs[dp] = rec
+        return rec
+
+    #-------------------------------------------------------------------
+
+    def statRec(self, dp, rec):
+        """ Read sizes and modification times of files in a record,
+        if they are not read yet, and keep them in the record.
+        Files, which were removed since the scan, are left out.
+
+        Args:
+            dp (str): Folder path.
+            rec (tuple): Record of the folder.
+
+        Returns:
+            rec (tuple): Record with sizes and modification times.
+        """
+        if rec[2] is not None: return rec
+        names = []
+        sizes = array('Q')
+        mtimes = array('d')
+        for fn in rec[1]:
+            try: st = stat(path.join(dp, fn))
+            except OSError: continue # removed
+            names.append(fn)
+            sizes.append(st.st_size)
+            mtimes.append(st.st_mtime)
+        sRec = (rec[0], tuple(names), sizes, mtimes) + rec[4:]
+        with self.lock:
+            # keep it, unless the folder was scanned again meanwhile
+            if self.recs.get(dp) is rec: self.recs[dp] = sRec
+        return sRec
+
+    #-------------------------------------------------------------------
+
+    def getRec(self, dp, flagCheck=False):
+        """ Get record of a folder, scanning it if not indexed yet.
+
+        Args:
+            dp (str): Folder path.
+            flagCheck (bool): Whether to scan again, if modification
+              time of the folder changed (or was close to the scan).
+
+        Returns:
+            (tuple): Record of the folder. None if not accessible.
+        """
+        with self.lock: rec = self.recs.get(dp)
+        if rec is None: return self.scanDir(dp)
+        if flagCheck:
+            try: dMTime = stat(dp).st_mtime_ns
+            except OSError: dMTime = None
+            if dMTime != rec[0] or dMTime >= rec[5] - MTIME_TICK_NS:
+                return self.scanDir(dp)
+        return rec
+
+    #-------------------------------------------------------------------
+
+    def invalidate(self, folders=None, recursive=True):
+        """ Drop records of folders (and their sub-folders), so that 
+        they are scanned again when searched.
+
+        Args:
+            folders (list, optional): Folder paths. None means all.
+            recursive (bool): Whether to drop sub-folders too.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("DirIndex.invalidate()")
+
+        with self.lock:
+            if folders is None:
+                self.recs = {}
+                return
+            if not recursive:
+                for dp in folders: self.recs.pop(dp, None)
+                return
+            for dp in list(self.recs.keys()):
+                for fdp in folders:
+                    if dp == fdp or dp.startswith(path.join(fdp, "")):
+                        del self.recs[dp]
+                        break
+
+    #-------------------------------------------------------------------
+
+    def find(self, folders, pattern="*", recursive=False, isCancelled=None,
+             batchSz=1000, flagCheck=False):
+        """ Find files matching with a filter, in the same order 
+        as walkImgFiles, yielding them in batches.
+
+        Args:
+            folders (list): Folder paths to search.
+            pattern (str/ FileFilter): File filter (see parseFileFilter).
+            recursive (bool): Whether to search sub-folders.
+            isCancelled (function, optional): Checked between folders.
+              When it returns True, the search stops.
+            batchSz (int): Max. number of files in a batch.
+            flagCheck (bool): Whether to scan folders again, 
+              which were changed since they were indexed.
+
+        Yields:
+            batch (list): File paths found.
+        """
+        if DEBUG: print("DirIndex.find()")
+
+        if isinstance(pattern, FileFilter): ff = pattern
+        else: ff = parseFileFilter(pattern)
+        batch = []
+        for dp, rec in self.walk(folders, recursive, isCancelled, flagCheck):
+            if ff.flagStat: rec = self.statRec(dp, rec)
+            names, sizes, mtimes = rec[1:4]
+            for i, fn in enumerate(names):
+                if not ff.matchName(fn): continue
+                if ff.flagStat and not ff.matchStat(sizes[i], mtimes[i]):
+                    continue
+                batch.append(path.join(dp, fn))
+                if len(batch) >= batchSz:
+                    yield batch
+                    batch = []
+        if len(batch) > 0: yield batch
+
+    #-------------------------------------------------------------------
+
+    def walk(self, folders, recursive=False, isCancelled=None, 
+             flagCheck=False):
+        """ Go through records of folders (and sub-folders) in the same
+        order as walkImgFiles, scanning folders not indexed yet.
+
+        Args:
+            folders (list): Folder paths.
+            recursive (bool): Whether to include sub-folders.
+            isCancelled (function, optional): Checked between folders.
+              When it returns True, the walk stops.
+            flagCheck (bool): Whether to scan folders again, 
+              which were changed since they were indexed.
+
+        Yields:
+            dp (str): Folder path.
+            rec (tuple): Record of the folder (see DirIndex.recs).
+        """
+        dirs = list(reversed(folders)) # folders to go; used as a stack
+        while len(dirs) > 0:
+            if isCancelled is not None and isCancelled(): return
+            dp = dirs.pop()
+            rec = self.getRec(dp, flagCheck)
+            if rec is None: continue
+            yield dp, rec
+            if recursive: dirs += reversed(rec[4]) # sub-folders
+
+#=======================================================================
+
+if __name__ == '__main__':
+    pass
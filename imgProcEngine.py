@@ -0,0 +1,2028 @@
+# coding: UTF-8
+
+"""
+imgProcEngine
+GUI-free image processing engine of pyImgProc.
+This module does not import wxPython, so a batch can be run
+  on a machine without display, using the command line interface.
+
+Usage:
+    python imgProcEngine.py pipeline.json [options] folder_or_file ...
+    (or 'python pyImgProc.py -b pipeline.json ...')
+
+    'pipeline.json' is a list of process steps, each with its parameters.
+      e.g.: [["crop_ratio", [0.0, 0.0, 0.5, 0.5]], ["flip", [1]]]
+      Parameters, which are omitted, get the default values
+      in IP_PARAM_VAL.
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+
+Dependency:
+    NumPy (1.15)
+    Pillow (7.0)
+"""
+
+import sys, json, argparse
+from os import path, stat, cpu_count
+from time import perf_counter, thread_time
+from io import BytesIO
+from collections import OrderedDict
+from threading import Thread, Lock, Condition, Event, Semaphore
+from queue import Queue, Empty, Full
+from functools import partial, lru_cache
+from multiprocessing import Pool
+from copy import deepcopy
+from datetime import datetime
+from hashlib import sha1
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+from PIL import ImageFont
+from PIL import ImageDraw
+from PIL import ImageColor
+
+from fileIndex import listImgFiles
+from batchStore import ResultCache, BatchJournal, LogSink, fileSig
+from batchStore import JOURNAL_FILE, LOG_FIELDS
+from procProfiler import ProcProfiler, profileTable, stopMemTrace
+from tiledProc import isTileable, isLargeImg, procFileTiled
+from watchFolder import watchFolders, WATCH_SETTLE_SEC
+
+DEBUG = False
+
+# image processing options
+IMG_PROC_OPTIONS = [
+                    'greyscale',
+                    'crop',
+                    'crop_ratio',
+                    'masking',
+                    'resize',
+                    'resize_ratio',
+                    'rotate',
+                    'flip',
+                    'brighten',
+                    'darken',
+                    'levels',
+                    'gamma',
+                    'contrast',
+                    'invert',
+                    'threshold',
+                    'text',
+                   ]
+# parameters for each image processing
+IP_PARAMS = dict(
+                    greyscale = ['single-channel'],
+                    crop = ['x', 'y', 'w', 'h'],
+                    crop_ratio = ['x', 'y', 'w', 'h'],
+                    masking = ['fill-color'],
+                    resize = ['w', 'h'],
+                    resize_ratio = ['w', 'h'],
+                    rotate = ['deg', 'expand'],
+                    flip = ['direction'],
+                    brighten = ['value'],
+                    darken = ['value'],
+                    levels = ['in-black', 'in-white', 'gamma', 
+                              'out-black', 'out-white'],
+                    gamma = ['gamma'],
+                    contrast = ['factor'],
+                    invert = [],
+                    threshold = ['value'],
+                    text = ['text', 'x', 'y', 'font-size', 'color'],
+                )
+# default value of each parameter
+IP_PARAM_VAL = dict(
+                    greyscale = [0],
+                    crop = [0, 0, 1, 1],
+                    crop_ratio = [0.0, 0.0, 0.5, 0.5],
+                    masking = ['#000000'],
+                    resize = [1, 1],
+                    resize_ratio = [0.1, 0.1],
+                    rotate = [0, 0],
+                    flip = [0],
+                    brighten = [20],
+                    darken = [20],
+                    levels = [0, 255, 1.0, 0, 255],
+                    gamma = [1.0],
+                    contrast = [1.0],
+                    invert = [],
+                    threshold = [128],
+                    text = ['', 0.0, 0.0, 12, '#000000'],
+                   )
+# extension list to recognize as an image file for processing
+EXT_LIST = ['bmp', 'png', 'jpg', 'gif', 'pcx', 'tif', 'tiff']
+MASK_FP = "mask.png" # default masking image
+LOG_FILE = "log_pyImgProc.csv"
+LOG_HEADER = ",".join(LOG_FIELDS) + "\n"
+MAX_ERRS = 100 # max. number of error messages kept in a batch summary
+### font file for 'text' process
+if sys.platform == "darwin":
+    FONT_FP = "/System/Library/Fonts/Monaco.dfont"
+elif sys.platform.startswith("win"):
+    FONT_FP = "/Windows/Fonts/cour.ttf"
+else:
+    FONT_FP = "DejaVuSansMono.ttf" # Pillow looks up system font folders
+_worker = {} # plan and image extension of a worker process of runBatch
+PLAN_CACHE_SZ = 32 # number of compiled plans kept by getPlan
+_plans = OrderedDict() # compiled plans of this process (getPlan);
+  # key: steps and masking image in JSON
+_plansLock = Lock()
+
+#-----------------------------------------------------------------------
+
+def makeSteps(procList, ipParamVal):
+    """ Make a list of process steps from names of processes
+    and a dictionary of parameter values (as in ImgProcsFrame).
+
+    Args:
+        procList (list): List of process names.
+        ipParamVal (dict): Parameter values of each process.
+
+    Returns:
+        steps (list): List of (process name, parameter list) tuples.
+
+    Examples:
+        >>> makeSteps(['flip'], dict(flip=[1]))
+        [('flip', [1])]
+    """
+    if DEBUG: print("imgProcEngine.makeSteps()")
+
+    return [(pn, list(ipParamVal[pn])) for pn in procList]
+
+#-----------------------------------------------------------------------
+
+def loadPipeline(fp):
+    """ Load process steps from a JSON file.
+
+    Args:
+        fp (str): File path of JSON file, containing a list of
+          [process name, parameter list] items. Omitted trailing
+          parameters are filled with default values.
+
+    Returns:
+        steps (list): List of (process name, parameter list) tuples.
+
+    Examples:
+        >>> steps = loadPipeline('pipeline.json')
+
+    Raises:
+        ValueError: When an unknown process name or too many parameters
+          are given.
+    """
+    if DEBUG: print("imgProcEngine.loadPipeline()")
+
+    with open(fp, 'r') as f: items = json.load(f)
+    return parseSteps(items)
+
+#-----------------------------------------------------------------------
+
+def parseSteps(items):
+    """ Make process steps from a pipeline description 
+    (e.g.: loaded from JSON).
+
+    Args:
+        items (list): List of [process name, parameter list] items 
+          (or process names). Omitted trailing parameters are filled 
+          with default values.
+
+    Returns:
+        steps (list): List of (process name, parameter list) tuples.
+
+    Examples:
+        >>> parseSteps([["flip", [1]], "greyscale"])
+        [('flip', [1]), ('greyscale', [0])]
+
+    Raises:
+        ValueError: When a step is malformed, or an unknown process name
+          or too many parameters are given.
+    """
+    if not isinstance(items, list):
+        raise ValueError("Pipeline has to be a list of process steps.")
+    steps = []
+    for item in items:
+        if isinstance(item, str): item = [item] # process name only
+        if not isinstance(item, (list, tuple)) or not 1 <= len(item) <= 2 \
+          or not isinstance(item[0], str) or \
+          (len(item) == 2 and not isinstance(item[1], (list, tuple))):
+            msg = "Process step has to be [process name, parameter list]"
+            msg += " or process name: %s"%(json.dumps(item, default=str))
+            raise ValueError(msg)
+        pn = item[0]
+        if len(item) > 1: params = list(item[1])
+        else: params = []
+        if pn not in IMG_PROC_OPTIONS:
+            raise ValueError("Unknown process name: %s"%(pn))
+        nP = len(IP_PARAMS[pn])
+        if len(params) > nP:
+            msg = "%s takes %i parameters, %i given."%(pn, nP, len(params))
+            raise ValueError(msg)
+        params += deepcopy(IP_PARAM_VAL[pn][len(params):])
+        steps.append((pn, params))
+    return steps
+
+#-----------------------------------------------------------------------
+
+def compilePlan(steps, maskFP=MASK_FP):
+    """ Compile process steps into a plan of operators,
+    which can be applied to many images.
+    Adjacent crop/ crop_ratio/ flip steps become one operator, 
+      which only makes a view of the array, adjacent resize/ 
+      resize_ratio/ rotate steps become one operator, 
+      resampling the image once, and adjacent point processes 
+      (brighten, darken, levels, gamma, contrast, invert, threshold)
+      become one lookup table, applied in one pass.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        (ImgProcPlan): Compiled plan.
+
+    Examples:
+        >>> plan = compilePlan([('crop', [0, 0, 100, 100]), ('flip', [0])])
+        >>> img = plan.run(img)
+    """
+    if DEBUG: print("imgProcEngine.compilePlan()")
+
+    opClasses = dict(
+                        greyscale = GreyscaleOp,
+                        crop = ViewOp,
+                        crop_ratio = ViewOp,
+                        masking = MaskingOp,
+                        resize = ResampleOp,
+                        resize_ratio = ResampleOp,
+                        rotate = ResampleOp,
+                        flip = ViewOp,
+                        brighten = PointOp,
+                        darken = PointOp,
+                        levels = PointOp,
+                        gamma = PointOp,
+                        contrast = PointOp,
+                        invert = PointOp,
+                        threshold = PointOp,
+                        text = TextOp,
+                    ) # operator class for each process
+    ops = []
+    for pn, params in steps:
+        opClass = opClasses[pn]
+        if len(ops) > 0 and type(ops[-1]) == opClass and opClass.fusible:
+        # same kind of operator as the previous one
+            ops[-1].steps.append((pn, params)) # fuse into it
+        elif opClass == MaskingOp:
+            ops.append(opClass([(pn, params)], maskFP))
+        else:
+            ops.append(opClass([(pn, params)]))
+    return ImgProcPlan(steps, ops)
+
+#-----------------------------------------------------------------------
+
+def getPlan(steps, maskFP=MASK_FP):
+    """ Get a compiled plan of steps from the cache of this process,
+    compiling it, if it's not there.
+    Kept plans keep their rendered text, etc. for following uses
+      (e.g.: requests of ipServer, files of jobs in jobScheduler).
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        plan (ImgProcPlan): Compiled plan.
+
+    Examples:
+        >>> plan = getPlan([('flip', [1])])
+    """
+    key = json.dumps([steps, maskFP])
+    with _plansLock:
+        plan = _plans.get(key)
+        if plan is not None:
+            _plans.move_to_end(key)
+            return plan
+    plan = compilePlan(steps, maskFP)
+    with _plansLock:
+        _plans[key] = plan
+        while len(_plans) > PLAN_CACHE_SZ: _plans.popitem(last=False)
+    return plan
+
+#-----------------------------------------------------------------------
+
+def procImg(img, steps, maskFP=MASK_FP):
+    """ Process the given image with the given process steps.
+
+    Args:
+        img (np.ndarray): Input image
+        steps (list): List of (process name, parameter list) tuples.
+        maskFP (str): File path of masking image.
+
+    Return:
+        img (np.ndarray): Output image
+
+    Examples:
+        >>> img = procImg(img, [('flip', [0]), ('darken', [30])])
+    """
+    return compilePlan(steps, maskFP).run(img)
+
+#-----------------------------------------------------------------------
+
+def loadPreviewImg(fp, maxSz):
+    """ Load an image, decoding it at reduced scale to fit in 'maxSz'.
+    JPEG files are decoded at reduced scale (Image.draft), 
+      and other images are reduced right after decoding.
+
+    Args:
+        fp (str): File path of image.
+        maxSz (tuple): Max. width and height.
+
+    Returns:
+        img (PIL.Image): Loaded image.
+        scale (float): Scale of the loaded image to the original image.
+
+    Examples:
+        >>> img, scale = loadPreviewImg('img1.jpg', (800, 600))
+    """
+    if DEBUG: print("imgProcEngine.loadPreviewImg()")
+
+    img = Image.open(fp)
+    w = img.size[0]
+    if w > maxSz[0] or img.size[1] > maxSz[1]:
+        img.thumbnail((int(maxSz[0]), int(maxSz[1])))
+    else:
+        img.load()
+    return img, img.size[0]/w
+
+#-----------------------------------------------------------------------
+
+def displayArray(img, maxSz, buf=None):
+    """ Make a contiguous RGB or RGBA array of an image to display,
+    reduced (by taking every n-th pixel) to fit in 'maxSz'.
+    The reduced image is a view of the input, so pixels are copied 
+      only once, into 'buf' if its shape fits.
+
+    Args:
+        img (np.ndarray): Image.
+        maxSz (tuple): Max. width and height.
+        buf (np.ndarray, optional): Array to reuse (e.g.: returned
+          array of the previous call for the same panel).
+
+    Returns:
+        buf (np.ndarray): C-contiguous uint8 array in (h, w, 3) 
+          or (h, w, 4) shape.
+
+    Examples:
+        >>> buf = displayArray(img, (800, 600))
+        >>> bmp = wx.Bitmap.FromBuffer(buf.shape[1], buf.shape[0], buf)
+    """
+    if DEBUG: print("imgProcEngine.displayArray()")
+
+    n = max(1, int(np.ceil(max(img.shape[1]/maxSz[0], 
+                               img.shape[0]/maxSz[1]))))
+    if n > 1: img = img[::n, ::n]
+    if img.dtype == np.bool_: img = img.view(np.uint8) * np.uint8(255)
+    elif img.dtype != np.uint8: img = np.clip(img, 0, 255).astype(np.uint8)
+    if img.ndim == 2: img = img[:,:,np.newaxis]
+    nCh = 4 if img.shape[2] in [2, 4] else 3
+    shape = (img.shape[0], img.shape[1], nCh)
+    if buf is None or buf.shape != shape: 
+        buf = np.empty(shape, dtype=np.uint8)
+    if img.shape[2] < 3: # greyscale
+        buf[:,:,:3] = img[:,:,:1]
+        if nCh == 4: buf[:,:,3] = img[:,:,1]
+    else:
+        buf[:] = img[:,:,:nCh]
+    return buf
+
+#-----------------------------------------------------------------------
+
+def scaleSteps(steps, scale):
+    """ Scale parameters in pixel unit of process steps, 
+    to process an image loaded at reduced scale.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        scale (float): Scale of image.
+
+    Returns:
+        sSteps (list): Scaled steps.
+
+    Examples:
+        >>> scaleSteps([('crop', [100, 100, 400, 300])], 0.5)
+        [('crop', [50, 50, 200, 150])]
+    """
+    if DEBUG: print("imgProcEngine.scaleSteps()")
+
+    sSteps = []
+    for pn, params in steps:
+        params = list(params)
+        if pn in ['crop', 'resize']: # all parameters are in pixel
+            params = [int(round(v*scale)) for v in params]
+            if pn == 'resize': params = [max(1, v) for v in params]
+        elif pn == 'text': # font size
+            params[3] = max(1, int(round(params[3]*scale)))
+        sSteps.append((pn, params))
+    return sSteps
+
+#-----------------------------------------------------------------------
+
+def rotationMatrix(sz, deg, expand):
+    """ Affine matrix of Image.rotate (from output to input coordinates).
+
+    Args:
+        sz (tuple): Width and height of input image.
+        deg (float): Degree to rotate (counter clockwise).
+        expand (int/ bool): Whether to expand to contain rotated image.
+
+    Returns:
+        mat (np.ndarray): 3x3 matrix.
+        sz (tuple): Width and height of output image.
+
+    Examples:
+        >>> mat, sz = rotationMatrix((640, 480), 90, 1)
+    """
+    w, h = sz
+    a = -np.radians(deg)
+    cos = round(np.cos(a), 15)
+    sin = round(np.sin(a), 15)
+    mat = np.array([[cos, sin, 0.0],
+                    [-sin, cos, 0.0],
+                    [0.0, 0.0, 1.0]])
+    ### rotate around the center
+    cx = w / 2.0
+    cy = h / 2.0
+    mat[0,2], mat[1,2] = mat[:2,:2].dot([-cx, -cy]) + [cx, cy]
+    if expand:
+        corners = np.array([[0, w, w, 0], [0, 0, h, h], [1, 1, 1, 1]])
+        xx, yy = mat[:2].dot(corners)
+        nw = int(np.ceil(xx.max()) - np.floor(xx.min()))
+        nh = int(np.ceil(yy.max()) - np.floor(yy.min()))
+        mat[0,2], mat[1,2] = mat[:2].dot([-(nw-w)/2.0, -(nh-h)/2.0, 1])
+        w, h = nw, nh
+    return mat, (w, h)
+
+#-----------------------------------------------------------------------
+
+@lru_cache(maxsize=32)
+def getFont(fontFP, sz):
+    """ Load a font, caching it for later calls with the same arguments.
+
+    Args:
+        fontFP (str): File path of font.
+        sz (int): Font size.
+
+    Returns:
+        (PIL.ImageFont.FreeTypeFont): Loaded font.
+
+    Examples:
+        >>> font = getFont(FONT_FP, 12)
+    """
+    return ImageFont.truetype(font=fontFP, size=sz)
+
+#-----------------------------------------------------------------------
+
+def pointLUT(pn, params):
+    """ Make lookup tables of a point process, which maps each pixel 
+    value to a new value, regardless of other pixels.
+
+    Args:
+        pn (str): Process name ('brighten', 'darken', 'levels', 
+          'gamma', 'contrast', 'invert' or 'threshold').
+        params (list): Parameters of the process.
+
+    Returns:
+        (tuple): Lookup tables (np.ndarray of 256 uint8 values) for 
+          color channels and for alpha channel.
+
+    Examples:
+        >>> lut, alphaLUT = pointLUT('brighten', [20])
+    """
+    x = np.arange(256, dtype=np.float64)
+    identity = np.arange(256, dtype=np.uint8)
+    if pn in ['brighten', 'darken']:
+        value = int(min(params[0], 255))
+        if value < 1: return identity, identity # no change
+        if pn == 'darken': value = -value
+        lut = np.clip(x + value, 0, 255).astype(np.uint8)
+        return lut, lut # alpha channel is also changed 
+    elif pn == 'levels':
+        inB, inW, gamma, outB, outW = params
+        v = np.clip((x - inB) / max(1e-6, inW - inB), 0.0, 1.0)
+        if gamma > 0: v = v ** (1.0 / gamma)
+        v = outB + v * (outW - outB)
+    elif pn == 'gamma':
+        v = x / 255
+        if params[0] > 0: v = v ** (1.0 / params[0])
+        v = v * 255
+    elif pn == 'contrast':
+        v = (x - 128) * params[0] + 128
+    elif pn == 'invert':
+        v = 255 - x
+    elif pn == 'threshold':
+        v = (x >= params[0]) * 255.0
+    # alpha channel is not changed
+    return np.clip(np.round(v), 0, 255).astype(np.uint8), identity
+
+#-----------------------------------------------------------------------
+
+def applyLUT(img, lut, chunkSz=1<<20):
+    """ Apply a lookup table to an uint8 array in place.
+    The array is processed in chunks, so that no temporary array
+      of the whole image size is made.
+
+    Args:
+        img (np.ndarray): Image array (uint8); it can be a view.
+        lut (np.ndarray): Lookup table of 256 uint8 values.
+        chunkSz (int): Approx. number of values in a chunk.
+
+    Returns:
+        None
+    """
+    if img.flags.c_contiguous: 
+        img = img.reshape(-1) # a view
+        for i in range(0, img.size, chunkSz):
+            chunk = img[i:i+chunkSz]
+            np.take(lut, chunk, out=chunk, mode='clip')
+    else:
+        nRows = max(1, chunkSz // max(1, img[0].size))
+        for i in range(0, img.shape[0], nRows):
+            chunk = img[i:i+nRows]
+            np.take(lut, chunk, out=chunk, mode='clip')
+
+#-----------------------------------------------------------------------
+
+def pipelineSig(steps, imgExt='', maskFP=MASK_FP):
+    """ Signature of a pipeline; the steps with their parameters,
+    the output format and files the steps use.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension for saving.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        (str): Hex digest.
+
+    Examples:
+        >>> pipelineSig([('flip', [0])], '.png')
+        '0c5a...'
+    """
+    items = [[[pn, list(params)] for pn, params in steps], imgExt]
+    pns = [pn for pn, params in steps]
+    if 'masking' in pns: items.append([path.abspath(maskFP), fileSig(maskFP)])
+    if 'text' in pns: items.append(FONT_FP)
+    return sha1(json.dumps(items).encode("utf-8")).hexdigest()
+
+#-----------------------------------------------------------------------
+
+def getOutputFP(fp, imgExt=''):
+    """ Get file path to save the processed image of 'fp'.
+
+    Args:
+        fp (str): File path of input image.
+        imgExt (str): Image file extension to use (e.g.: '.png').
+          Empty string means to keep the original extension.
+
+    Returns:
+        (str): Output file path.
+
+    Examples:
+        >>> getOutputFP('/data/img1.jpg', '.png')
+        '/data/img1.png'
+    """
+    if imgExt == '': return fp
+    return path.splitext(fp)[0] + imgExt
+
+#-----------------------------------------------------------------------
+
+def procFile(fp, plan, imgExt='', prof=None):
+    """ Load an image file, process it and save the result.
+
+    Args:
+        fp (str): File path of image to process.
+        plan (ImgProcPlan): Compiled processing plan.
+        imgExt (str): Image file extension for saving.
+        prof (ProcProfiler, optional): Profiler to measure decoding,
+          each operator and encoding.
+
+    Returns:
+        oFP (str): File path of the saved image.
+
+    Examples:
+        >>> procFile('img1.jpg', compilePlan([('flip', [0])]), '.png')
+        'img1.png'
+    """
+    if DEBUG: print("imgProcEngine.procFile()")
+
+    if isTileable(plan) and isLargeImg(fp):
+        # very large image; process in strips to bound memory
+        oFP = getOutputFP(fp, imgExt)
+        if prof is not None: t = prof.start()
+        procFileTiled(fp, oFP, plan)
+        if prof is not None: prof.stop('(tiled)', t)
+        return oFP
+    if prof is None:
+        img = plan.run(Image.open(fp), asArray=False) # open & process image
+        if isinstance(img, np.ndarray): img = Image.fromarray(img)
+        oFP = getOutputFP(fp, imgExt)
+        img.save(oFP) # save image
+        return oFP
+    t = prof.start()
+    img = Image.open(fp)
+    img.load() # decode here, not lazily in the first operator
+    prof.stop('(decode)', t, imgBytes(img))
+    img = plan.run(img, asArray=False, prof=prof)
+    t = prof.start()
+    if isinstance(img, np.ndarray): img = Image.fromarray(img)
+    oFP = getOutputFP(fp, imgExt)
+    img.save(oFP)
+    prof.stop('(encode)', t, imgBytes(img))
+    return oFP
+
+#-----------------------------------------------------------------------
+
+def procData(fp, data, plan, imgExt='', prof=None):
+    """ Process an image file, which is already read into memory,
+    and encode the result in memory, without touching the disk.
+
+    Args:
+        fp (str): File path of image to process.
+        data (bytes): Content of the image file.
+        plan (ImgProcPlan): Compiled processing plan.
+        imgExt (str): Image file extension for saving.
+        prof (ProcProfiler, optional): Profiler to measure decoding,
+          each operator and encoding.
+
+    Returns:
+        oFP (str): File path to save the processed image.
+        (bytes): Encoded processed image.
+
+    Examples:
+        >>> oFP, oData = procData('img1.jpg', data, plan, '.png')
+    """
+    oFP = getOutputFP(fp, imgExt)
+    fmt = Image.registered_extensions().get(path.splitext(oFP)[1].lower())
+    if fmt is None:
+        raise ValueError("unknown file extension: %s"%(
+                                                    path.splitext(oFP)[1]))
+    if prof is not None: t = prof.start()
+    try: img = Image.open(BytesIO(data))
+    except (UnidentifiedImageError, OSError) as e:
+        raise IOError("cannot identify image file '%s'"%(fp)) from e
+    img.load() # decode
+    if prof is not None: prof.stop('(decode)', t, imgBytes(img))
+    img = plan.run(img, asArray=False, prof=prof)
+    if prof is not None: t = prof.start()
+    if isinstance(img, np.ndarray): img = Image.fromarray(img)
+    buf = BytesIO()
+    img.save(buf, format=fmt)
+    if prof is not None: prof.stop('(encode)', t, imgBytes(img))
+    return oFP, buf.getvalue()
+
+#-----------------------------------------------------------------------
+
+def imgBytes(img):
+    """ Size of an image in memory.
+
+    Args:
+        img (np.ndarray/ PIL.Image): Image.
+
+    Returns:
+        (int): Size in bytes.
+    """
+    if isinstance(img, np.ndarray): return img.nbytes
+    return img.width * img.height * len(img.getbands())
+
+#-----------------------------------------------------------------------
+
+def logRecord(rslt, steps):
+    """ Make a record for the log file about a processed file.
+
+    Args:
+        rslt (tuple): Result tuple of _procFileSafe.
+        steps (list): List of (process name, parameter list) tuples.
+
+    Returns:
+        (dict): Value of each field in batchStore.LOG_FIELDS.
+    """
+    fp, oFP, err, sec, nBytes = rslt[:5]
+    return dict(
+                timestamp = datetime.now().strftime("%Y_%m_%d_%H_%M_%S"),
+                status = 'ok' if err == '' else 'error',
+                source = fp,
+                output = oFP or '',
+                processes = "/".join([pn for pn, params in steps]),
+                seconds = round(sec, 4),
+                outBytes = nBytes,
+                error = err,
+               )
+
+#-----------------------------------------------------------------------
+
+def _initWorker(plan, imgExt, flagProfile=False):
+    """ Initialize a worker process of runBatch.
+    The plan is sent once to each worker (not with every file), 
+      so that its operators keep their loaded fonts, rendered text, etc.
+      for all files the worker processes.
+
+    Args:
+        plan (ImgProcPlan): Compiled processing plan.
+        imgExt (str): Image file extension for saving.
+        flagProfile (bool): Whether to profile processing of each file.
+
+    Returns:
+        None
+    """
+    _worker["plan"] = plan
+    _worker["imgExt"] = imgExt
+    _worker["flagProfile"] = flagProfile
+
+#-----------------------------------------------------------------------
+
+def _procFileSafe(fp, plan=None, imgExt=None, flagProfile=None):
+    """ Run procFile, catching an error, so that one broken file does
+    not stop the whole batch. This is also the task function of
+    worker processes in runBatch.
+
+    Args:
+        fp (str): File path of image to process.
+        plan (ImgProcPlan): Compiled processing plan.
+          None means the plan of this worker process.
+        imgExt (str): Image file extension for saving.
+          None means the extension of this worker process.
+        flagProfile (bool): Whether to profile processing.
+          None means the setting of this worker process.
+
+    Returns:
+        (tuple): Input file path, output file path (None, if failed),
+          error message, seconds taken, output file size and
+          measurements of ProcProfiler (None, if not profiled).
+    """
+    if plan is None: plan = _worker["plan"]
+    if imgExt is None: imgExt = _worker["imgExt"]
+    if flagProfile is None: flagProfile = _worker["flagProfile"]
+    prof = ProcProfiler() if flagProfile else None
+    stats = prof.stats if flagProfile else None
+    t0 = perf_counter()
+    try:
+        oFP = procFile(fp, plan, imgExt, prof)
+        return (fp, oFP, '', perf_counter()-t0, path.getsize(oFP), stats)
+    except Exception as e:
+        return (fp, None, str(e), perf_counter()-t0, 0, stats)
+
+#-----------------------------------------------------------------------
+
+def _procDataSafe(item, plan=None, imgExt=None, flagProfile=None):
+    """ Run procData, catching an error. This is the task function 
+    of workers in runBatch with FileIOStages, which read and write files.
+
+    Args:
+        item (tuple): Input file path, its content (None, if failed
+          or left to be read in strips), error message of reading, 
+          seconds and CPU seconds of reading.
+        plan (ImgProcPlan): Compiled processing plan.
+          None means the plan of this worker process.
+        imgExt (str): Image file extension for saving.
+          None means the extension of this worker process.
+        flagProfile (bool): Whether to profile processing.
+          None means the setting of this worker process.
+
+    Returns:
+        (tuple): As _procFileSafe, but with the encoded output
+          (None, if failed or already written) instead of 
+          the output file size.
+    """
+    if plan is None: plan = _worker["plan"]
+    if imgExt is None: imgExt = _worker["imgExt"]
+    if flagProfile is None: flagProfile = _worker["flagProfile"]
+    fp, data, err, readSec, readCPU = item
+    prof = ProcProfiler() if flagProfile else None
+    stats = prof.stats if flagProfile else None
+    if err != '': return (fp, None, err, readSec, None, stats)
+    t0 = perf_counter()
+    if data is None: # not read; to be processed in strips by procFile
+        try:
+            oFP = procFile(fp, plan, imgExt, prof)
+            return (fp, oFP, '', perf_counter()-t0, None, stats)
+        except Exception as e:
+            return (fp, None, str(e), perf_counter()-t0, None, stats)
+    if flagProfile: prof.add('(read)', readSec, readCPU, len(data))
+    try:
+        oFP, oData = procData(fp, data, plan, imgExt, prof)
+        return (fp, oFP, '', readSec+perf_counter()-t0, oData, stats)
+    except Exception as e:
+        return (fp, None, str(e), readSec+perf_counter()-t0, None, stats)
+
+#-----------------------------------------------------------------------
+
+def runBatch(fileList, steps, imgExt='', logFile=LOG_FILE, maskFP=MASK_FP,
+             nWorkers=1, q=None, flagSkip=False, journalFP='',
+             flagResume=False, profileFP='', nIOThreads=2, stopEvent=None):
+    """ Process and save all files in the given list.
+    With more than one worker, files are spread across worker processes.
+    Files are read and written by threads of FileIOStages, so that 
+      reading, processing and writing of different files overlap.
+
+    Args:
+        fileList (list): List of image file paths.
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension for saving.
+        logFile (str): File path of log file (batchStore.LogSink).
+          Empty string for no logging.
+        maskFP (str): File path of masking image.
+        nWorkers (int): Number of worker processes.
+          1 means processing in the calling process.
+        q (Queue, optional): Queue to report progress. After each file,
+          ('progress', number of finished files, number of all files,
+          result tuple) is put into the queue.
+        flagSkip (bool): Whether to skip files, whose output recorded
+          in the result index (batchStore.ResultCache) is up to date
+          with the same steps, parameters and output format.
+        journalFP (str): File path of journal (batchStore.BatchJournal)
+          to record each processed file. Empty string for no journal.
+        flagResume (bool): Whether to skip files recorded as processed
+          with the same pipeline in the journal, continuing a run
+          which stopped.
+        profileFP (str): File path to save the profile (ProcProfiler)
+          of decoding, each operator and encoding, as JSON.
+          Empty string for no profiling.
+        nIOThreads (int): Number of threads to read files, and also
+          number of threads to write files. 0 means that workers read
+          and write files themselves.
+        stopEvent (threading.Event, optional): Set to stop the run after
+          the file in processing; files in other workers are dropped.
+          The journal keeps processed files, so the run can be resumed.
+
+    Returns:
+        summary (dict): Numbers of files to process ('nFiles'), 
+          processed ('nDone'), failed ('nErr') and skipped ('nSkipped'), 
+          total seconds ('sec'), total size of output files ('outBytes')
+          and (input file path, error message) tuples of up to MAX_ERRS
+          failed files ('errs') and whether it was stopped by 'stopEvent'
+          ('stopped'). Details of each file are in the log.
+          With profiling, the report of ProcProfiler ('profile').
+
+    Examples:
+        >>> runBatch(['img1.jpg', 'img2.jpg'], [('greyscale', [])])
+        >>> runBatch(fileList, steps, '.png', nWorkers=8)
+    """
+    if DEBUG: print("imgProcEngine.runBatch()")
+
+    t0 = perf_counter()
+    plan = compilePlan(steps, maskFP) # compile once for all files
+    sig = pipelineSig(steps, imgExt, maskFP)
+    nListed = len(fileList)
+    journal = None
+    if journalFP != '':
+        journal = BatchJournal(journalFP, sig, flagResume)
+        if len(journal.done) > 0:
+            fileList = [fp for fp in fileList if fp not in journal.done]
+    if flagSkip:
+        ### leave out files with up-to-date output
+        rCache = ResultCache()
+        srcSigs = {} # signature of each source before processing
+        for fp in fileList:
+            if not rCache.isDone(fp, getOutputFP(fp, imgExt), sig):
+                srcSigs[fp] = fileSig(fp)
+        fileList = list(srcSigs.keys())
+    nFiles = len(fileList)
+    nWorkers = max(1, min(nWorkers, nFiles))
+    flagProfile = profileFP != ''
+    if flagProfile: prof = ProcProfiler() # profile of all files
+    stages = None
+    if nIOThreads > 0:
+        # at most two files per worker are read and not written yet
+        # very large images are not read here, but in strips by workers
+        skipRead = isLargeImg if isTileable(plan) else None
+        stages = FileIOStages(fileList, nIOThreads, nWorkers*2, skipRead)
+        stages.start()
+        taskFunc = _procDataSafe
+        tasks = stages.readItems()
+        chunkSz = 1 # files are large and bounded in number
+    else:
+        taskFunc = _procFileSafe
+        tasks = fileList
+        # small chunks, so that progress is reported often enough
+        chunkSz = max(1, min(16, nFiles//(nWorkers*4)))
+    if nWorkers == 1:
+        pool = None
+        rsltIter = map(partial(taskFunc, plan=plan, imgExt=imgExt,
+                               flagProfile=flagProfile), tasks)
+    else:
+        pool = Pool(nWorkers, _initWorker, (plan, imgExt, flagProfile))
+        rsltIter = pool.imap_unordered(taskFunc, tasks, chunkSz)
+    if stages is not None: rsltIter = stages.writeItems(rsltIter)
+    summary = dict(nFiles=nFiles, nDone=0, nErr=0, 
+                   nSkipped=nListed-nFiles, sec=0.0, outBytes=0, errs=[],
+                   stopped=False)
+    log = None
+    if logFile != '': log = LogSink(logFile)
+    flagFinished = False
+    try:
+        for i, rslt in enumerate(rsltIter):
+        # go through each processed file
+            fp, oFP, err, sec, nBytes, stats = rslt
+            if flagProfile: prof.merge(stats)
+            if err == '':
+                summary["nDone"] += 1
+                summary["outBytes"] += nBytes
+            else:
+                summary["nErr"] += 1
+                if len(summary["errs"]) < MAX_ERRS:
+                    summary["errs"].append((fp, err))
+            if log is not None: log.write(logRecord(rslt, steps))
+            if flagSkip and err == '': 
+                rCache.record(fp, oFP, sig, srcSigs[fp])
+            if journal is not None: journal.record(fp, oFP, err)
+            if q is not None: q.put(('progress', i+1, nFiles, rslt))
+            if stopEvent is not None and stopEvent.is_set():
+                summary["stopped"] = True
+                break
+        flagFinished = not summary["stopped"]
+    finally:
+        if stages is not None: stages.close()
+        if pool is not None:
+            if flagFinished: pool.close()
+            else: pool.terminate() # stopped by an error
+            pool.join()
+        if flagSkip: rCache.save()
+        if journal is not None: journal.close()
+        if log is not None: log.close()
+        if flagProfile: stopMemTrace()
+    summary["sec"] = perf_counter() - t0
+    if flagProfile:
+        prof.save(profileFP)
+        summary["profile"] = prof.report()
+    return summary
+
+#-----------------------------------------------------------------------
+
+def summaryText(summary, logFile=''):
+    """ Make a text to show the summary of a batch run.
+
+    Args:
+        summary (dict): Summary returned by runBatch.
+        logFile (str): File path of log file.
+
+    Returns:
+        txt (str): Summary text.
+    """
+    txt = ""
+    for fp, err in summary["errs"]: txt += "[ERROR] %s: %s\n"%(fp, err)
+    nMore = summary["nErr"] - len(summary["errs"])
+    if nMore > 0: txt += "... and %i more errors.\n"%(nMore)
+    txt += "%i files processed"%(summary["nDone"])
+    txt += " (%.1f MB) in %.1f seconds.\n"%(summary["outBytes"]/1e6, 
+                                             summary["sec"])
+    if summary["nErr"] > 0: txt += "%i files failed.\n"%(summary["nErr"])
+    if summary["nSkipped"] > 0:
+        txt += "%i files skipped.\n"%(summary["nSkipped"])
+    if summary.get("stopped", False):
+        txt += "Stopped before all files were processed.\n"
+    if logFile != '': txt += "Details of each file are in %s\n"%(logFile)
+    if "profile" in summary: 
+        txt += "\nProfile (slowest steps) -----\n"
+        txt += profileTable(summary["profile"])
+    return txt
+
+#-----------------------------------------------------------------------
+
+def collectFiles(paths, extList=EXT_LIST, recursive=False):
+    """ Collect image files from the given file and folder paths.
+
+    Args:
+        paths (list): File or folder paths.
+        extList (list): File extensions to recognize as image files.
+        recursive (bool): Whether to include sub-folders.
+
+    Returns:
+        fileList (list): Sorted list of image file paths.
+
+    Examples:
+        >>> collectFiles(['./imgs'], recursive=True)
+    """
+    if DEBUG: print("imgProcEngine.collectFiles()")
+
+    fileList = []
+    for p in paths:
+        if path.isfile(p): fileList.append(p)
+        else: fileList += listImgFiles([p], "*", extList, recursive)
+    return fileList
+
+#-----------------------------------------------------------------------
+
+def runCLI(argv):
+    """ Run a batch from the command line, without GUI.
+
+    Args:
+        argv (list): Command line arguments (without program name).
+
+    Returns:
+        (int): Exit status.
+
+    Examples:
+        >>> runCLI(['pipeline.json', '-f', '.png', './imgs'])
+    """
+    if DEBUG: print("imgProcEngine.runCLI()")
+
+    parser = argparse.ArgumentParser(
+                    prog="imgProcEngine",
+                    description="Process a batch of images without GUI.",
+                                    )
+    parser.add_argument("pipeline",
+                        help="JSON file with list of [process, params]")
+    parser.add_argument("paths", nargs="+",
+                        help="image files or folders to process")
+    parser.add_argument("-r", "--recursive", action="store_true",
+                        help="include sub-folders")
+    parser.add_argument("-f", "--format", default="",
+                        help="file extension for saving (e.g.: .png)")
+    parser.add_argument("-m", "--mask", default=MASK_FP,
+                        help="masking image (default: %s)"%(MASK_FP))
+    parser.add_argument("-l", "--log", default=LOG_FILE,
+                        help="log file, CSV or '.jsonl'"
+                             " (default: %s)"%(LOG_FILE))
+    parser.add_argument("-j", "--workers", type=int, default=cpu_count(),
+                        help="number of worker processes"
+                             " (default: number of CPUs)")
+    parser.add_argument("-s", "--skip-unchanged", action="store_true",
+                        help="skip files whose output is up to date")
+    parser.add_argument("--journal", default=JOURNAL_FILE,
+                        help="journal of processed files"
+                             " (default: %s)"%(JOURNAL_FILE))
+    parser.add_argument("--resume", action="store_true",
+                        help="continue the run recorded in the journal")
+    parser.add_argument("--io-threads", type=int, default=2,
+                        help="number of threads to read (and to write)"
+                             " files; 0 to read and write in workers")
+    parser.add_argument("--profile", default="", metavar="FILE",
+                        help="save time and memory of each step"
+                             " to a JSON file")
+    parser.add_argument("-w", "--watch", action="store_true",
+                        help="watch the folders and process files as they"
+                             " arrive, until Ctrl+C")
+    parser.add_argument("--poll", action="store_true",
+                        help="with --watch, scan folders instead of inotify"
+                             " (e.g.: network folders)")
+    parser.add_argument("--settle", type=float, default=WATCH_SETTLE_SEC,
+                        help="with --watch, seconds a file has to stay"
+                             " unchanged before processing")
+    args = parser.parse_args(argv)
+
+    imgExt = args.format
+    if imgExt != "" and not imgExt.startswith("."): imgExt = "." + imgExt
+    steps = loadPipeline(args.pipeline)
+    if args.watch:
+        print("Watching %s (Ctrl+C to stop)..."%(", ".join(args.paths)))
+        summary = watchFolders(args.paths, steps, imgExt, args.log, args.mask,
+                               args.workers, args.recursive, 
+                               settleSec=args.settle, flagPoll=args.poll)
+        print(summaryText(summary, args.log).rstrip())
+        return 0
+    fileList = collectFiles(args.paths, recursive=args.recursive)
+    summary = runBatch(fileList, steps, imgExt, args.log, args.mask,
+                       args.workers, flagSkip=args.skip_unchanged, 
+                       journalFP=args.journal, flagResume=args.resume,
+                       profileFP=args.profile, nIOThreads=args.io_threads)
+    print(summaryText(summary, args.log).rstrip())
+    if summary["nErr"] > 0: return 1
+    return 0
+
+#=======================================================================
+
+class ImgProcPlan:
+    """ Compiled plan of image processing, made by compilePlan.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        ops (list): List of operators (ImgOp) to execute the steps.
+    """
+    def __init__(self, steps, ops):
+        if DEBUG: print("ImgProcPlan.__init__()")
+
+        self.steps = steps
+        self.ops = ops
+
+    #-------------------------------------------------------------------
+
+    def run(self, img, asArray=True, isCancelled=None, prof=None):
+        """ Run all operators on the given image.
+        The image is converted between np.ndarray and PIL.Image only
+          when the next operator works on the other representation.
+
+        Args:
+            img (np.ndarray/ PIL.Image): Input image.
+              An input array can be modified in place.
+            asArray (bool): Whether to return np.ndarray.
+              If False, the result is returned in the representation
+              the last operator produced.
+            isCancelled (function, optional): Checked before each operator.
+              When it returns True, processing stops and None is returned.
+            prof (ProcProfiler, optional): Profiler to measure 
+              each operator (and conversion between representations).
+
+        Returns:
+            img (np.ndarray/ PIL.Image/ None): Output image.
+        """
+        if prof is not None: return self.runProfiled(img, asArray, prof)
+        for op in self.ops:
+            if isCancelled is not None and isCancelled(): return None
+            isPIL = isinstance(img, Image.Image)
+            if op.pil and not isPIL: img = Image.fromarray(img)
+            elif not op.pil and isPIL: img = np.array(img)
+            img = op.apply(img)
+        if asArray and isinstance(img, Image.Image): img = np.array(img)
+        return img
+
+    #-------------------------------------------------------------------
+
+    def runProfiled(self, img, asArray, prof):
+        """ Run all operators as 'run', measuring each operator.
+        Fused steps are measured together, named with their process
+          names joined with '+'.
+
+        Args:
+            img (np.ndarray/ PIL.Image): Input image.
+            asArray (bool): Whether to return np.ndarray.
+            prof (ProcProfiler): Profiler.
+
+        Returns:
+            img (np.ndarray/ PIL.Image): Output image.
+        """
+        for op in self.ops:
+            isPIL = isinstance(img, Image.Image)
+            if op.pil != isPIL:
+                t = prof.start()
+                if op.pil: img = Image.fromarray(img)
+                else: img = np.array(img)
+                prof.stop('(convert)', t, imgBytes(img))
+            nBytes = imgBytes(img)
+            t = prof.start()
+            img = op.apply(img)
+            name = "+".join([pn for pn, params in op.steps])
+            prof.stop(name, t, max(nBytes, imgBytes(img)))
+        if asArray and isinstance(img, Image.Image): img = np.array(img)
+        return img
+
+    #-------------------------------------------------------------------
+
+    def runCached(self, img, cache, srcKey, isCancelled=None):
+        """ Run all operators, caching the result after each operator.
+        When the result of leading steps is found in the cache, 
+          only the following operators are run.
+
+        Args:
+            img (np.ndarray): Input image (not modified).
+            cache (LRUCache): Cache of intermediate results.
+            srcKey (hashable): Key to identify the input image.
+            isCancelled (function, optional): As in 'run'.
+
+        Returns:
+            img (np.ndarray/ None): Output image. It can be an array 
+              in the cache; do not modify it.
+        """
+        ### keys of results after each operator
+        keys = []
+        n = 0 # number of steps executed
+        for op in self.ops:
+            n += len(op.steps)
+            keys.append((srcKey, repr(self.steps[:n])))
+        ### start after the longest cached leading steps
+        start = 0
+        for i in range(len(keys)-1, -1, -1):
+            rslt = cache.get(keys[i])
+            if rslt is not None:
+                img = rslt
+                start = i + 1
+                break
+        if start == len(self.ops): return img
+        img = img.copy() # operators can modify it in place
+        for i in range(start, len(self.ops)):
+            img = ImgProcPlan(self.steps, self.ops[i:i+1]).run(img, False,
+                                                                isCancelled)
+            if img is None: return None # cancelled
+            rslt = np.array(img) # copy, as the next operator can modify img
+            cache.put(keys[i], rslt, rslt.nbytes)
+        return rslt
+
+#=======================================================================
+
+class ImgOp:
+    """ Base class of operators in ImgProcPlan.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples
+          executed by this operator.
+
+    Attributes:
+        pil (bool): Whether 'apply' takes and returns PIL.Image 
+          (otherwise np.ndarray).
+        fusible (bool): Whether adjacent steps of the same operator class
+          are executed by one operator.
+        tileLocal (bool): Whether it can be applied to strips of rows
+          of an image (tiledProc), instead of the whole image.
+        view (bool): Whether it only selects and flips rows and columns.
+    """
+    pil = False
+    fusible = False
+    tileLocal = False
+    view = False
+
+    def __init__(self, steps):
+        self.steps = steps
+
+    #-------------------------------------------------------------------
+
+    def apply(self, img):
+        """ Apply the operator to the given image.
+
+        Args:
+            img (np.ndarray/ PIL.Image): Input image.
+
+        Returns:
+            img (np.ndarray/ PIL.Image): Output image.
+        """
+        raise NotImplementedError
+
+    #-------------------------------------------------------------------
+
+    def applyStrip(self, img, y0, h, w):
+        """ Apply the operator to a strip of rows of an image.
+        Only for a tile-local operator.
+
+        Args:
+            img (np.ndarray): Rows of image.
+            y0 (int): First row of the strip in the image.
+            h (int): Height of the image.
+            w (int): Width of the image.
+
+        Returns:
+            img (np.ndarray): Output rows.
+        """
+        return self.apply(img)
+
+#=======================================================================
+
+class GreyscaleOp(ImgOp):
+    """ 'greyscale' process.
+    Luma is computed by PIL's fixed-point integer transform
+      (L = R*299/1000 + G*587/1000 + B*114/1000, rounded), without
+      a floating point copy of the image. Palette images are converted
+      with their palette, and alpha channel is kept.
+    With 'single-channel' option, the result is an 'L' image
+      ('LA' with alpha channel); otherwise grey values are written
+      in R, G and B channels.
+    """
+    pil = True
+    tileLocal = True
+
+    def apply(self, img):
+        params = self.steps[0][1]
+        flagSingle = len(params) > 0 and params[0] != 0
+        if img.mode in ['P', 'PA']:
+            if img.mode == 'PA' or 'transparency' in img.info:
+                img = img.convert('RGBA')
+            else:
+                img = img.convert('RGB')
+        bands = img.getbands()
+        if len(bands) < 3: return img # already grey ('L', 'LA', 'I', ..)
+        grey = img.convert('L')
+        if 'A' in bands:
+            alpha = img.getchannel('A')
+            if flagSingle: return Image.merge('LA', (grey, alpha))
+            return Image.merge('RGBA', (grey, grey, grey, alpha))
+        if flagSingle: return grey
+        return grey.convert('RGB')
+
+    def applyStrip(self, img, y0, h, w):
+        return np.array(self.apply(Image.fromarray(img)))
+
+#=======================================================================
+
+class ViewOp(ImgOp):
+    """ 'crop', 'crop_ratio' and 'flip' processes.
+    These only change the view of the array; no pixel is copied.
+    """
+    fusible = True
+    tileLocal = True
+    view = True
+
+    def apply(self, img):
+        for pn, params in self.steps:
+            if pn == 'crop':
+                x, y, w, h = params
+                img = img[y:y+h,x:x+w]
+            elif pn == 'crop_ratio':
+                x, y, w, h = params
+                x = int(x * img.shape[1])
+                y = int(y * img.shape[0])
+                w = int(w * img.shape[1])
+                h = int(h * img.shape[0])
+                img = img[y:y+h,x:x+w]
+            elif pn == 'flip':
+                direction = params[0]
+                # 0: horizontal, 1: vertical, 2: both
+                if direction in [0, 2]: img = img[:,::-1]
+                if direction in [1, 2]: img = img[::-1]
+        return img
+
+#=======================================================================
+
+class LRUCache:
+    """ Thread-safe LRU cache, bounded by total bytes of cached values.
+
+    Args:
+        maxBytes (int): Max. total bytes of cached values.
+          The least recently used values are removed beyond it
+          (the most recent value is kept, even if it is larger).
+    """
+    def __init__(self, maxBytes):
+        if DEBUG: print("LRUCache.__init__()")
+
+        self.maxBytes = maxBytes
+        self.items = OrderedDict() # key: (value, bytes of value)
+        self.nBytes = 0 # current total bytes of cached values
+        self.lock = Lock()
+
+    #-------------------------------------------------------------------
+
+    def get(self, key, default=None):
+        """ Get a cached value, marking it as recently used.
+
+        Args:
+            key (hashable): Key of value.
+            default: Returned when key is not cached.
+
+        Returns:
+            Cached value or 'default'.
+        """
+        with self.lock:
+            if key not in self.items: return default
+            self.items.move_to_end(key)
+            return self.items[key][0]
+
+    #-------------------------------------------------------------------
+
+    def put(self, key, value, nBytes):
+        """ Cache a value, removing least recently used values if necessary.
+
+        Args:
+            key (hashable): Key of value.
+            value: Value to cache.
+            nBytes (int): Bytes of value.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            if key in self.items: self.nBytes -= self.items.pop(key)[1]
+            self.items[key] = (value, nBytes)
+            self.nBytes += nBytes
+            while self.nBytes > self.maxBytes and len(self.items) > 1:
+                _key, (_value, _nBytes) = self.items.popitem(last=False)
+                self.nBytes -= _nBytes
+
+#=======================================================================
+
+class MaskCache:
+    """ LRU cache of masks (boolean array; True where the masking image
+    is black), resized to image sizes, so that the masking image is
+    not loaded and resized again for every processed image.
+
+    Args:
+        maxBytes (int): Max. total bytes of cached masks.
+          The least recently used masks are removed beyond it.
+    """
+    def __init__(self, maxBytes=256*1024*1024):
+        if DEBUG: print("MaskCache.__init__()")
+
+        # key: (file path, mtime, h, w)
+        self.masks = LRUCache(maxBytes)
+        self.src = (None, None) # (key, masking image) of the last
+          # loaded masking image in its original size
+        self.lock = Lock()
+
+    #-------------------------------------------------------------------
+
+    def get(self, maskFP, h, w):
+        """ Get the mask for an image size.
+
+        Args:
+            maskFP (str): File path of masking image.
+            h (int): Height of image.
+            w (int): Width of image.
+
+        Returns:
+            mask (np.ndarray): Boolean array in (h, w) shape.
+        """
+        mtime = stat(maskFP).st_mtime
+        key = (maskFP, mtime, h, w)
+        mask = self.masks.get(key)
+        if mask is not None: return mask
+        with self.lock:
+            ### load masking image
+            if self.src[0] != (maskFP, mtime):
+                maskImg = Image.open(maskFP)
+                maskImg.load()
+                self.src = ((maskFP, mtime), maskImg)
+            maskImg = self.src[1].resize((w, h))
+        maskImg = np.array(maskImg)
+        # sum r,g,b channel
+        if maskImg.ndim == 3: maskImg = np.sum(maskImg[:,:,0:3], axis=2)
+        mask = maskImg == 0 # black parts
+        self.masks.put(key, mask, mask.nbytes)
+        return mask
+
+    #-------------------------------------------------------------------
+
+    def getStrip(self, maskFP, h, w, y0, y1):
+        """ Get rows of the mask for an image size, without making
+        the whole mask (for very large images). Strips are not cached.
+
+        Args:
+            maskFP (str): File path of masking image.
+            h (int): Height of image.
+            w (int): Width of image.
+            y0 (int): First row.
+            y1 (int): Row after the last row.
+
+        Returns:
+            mask (np.ndarray): Boolean array in (y1-y0, w) shape.
+        """
+        mtime = stat(maskFP).st_mtime
+        with self.lock:
+            if self.src[0] != (maskFP, mtime):
+                maskImg = Image.open(maskFP)
+                maskImg.load()
+                self.src = ((maskFP, mtime), maskImg)
+            maskImg = self.src[1]
+            mh = maskImg.size[1]
+            box = (0, y0*mh/h, maskImg.size[0], y1*mh/h)
+            maskImg = maskImg.resize((w, y1-y0), box=box)
+        maskImg = np.array(maskImg)
+        if maskImg.ndim == 3: maskImg = np.sum(maskImg[:,:,0:3], axis=2)
+        return maskImg == 0 # black parts
+
+MASK_CACHE = MaskCache() # shared by all masking operators in the process
+
+#=======================================================================
+
+class MaskingOp(ImgOp):
+    """ 'masking' process.
+
+    Args:
+        steps (list): List of (process name, parameter list) tuples.
+        maskFP (str): File path of masking image.
+    """
+    tileLocal = True
+
+    def __init__(self, steps, maskFP=MASK_FP):
+        ImgOp.__init__(self, steps)
+        self.maskFP = maskFP
+        ### set fill color
+        fCol = self.steps[0][1][0].lstrip("#")
+        self.fCol = [int(fCol[:2], 16), int(fCol[2:4], 16), int(fCol[4:6], 16)]
+
+    def apply(self, img):
+        mask = MASK_CACHE.get(self.maskFP, img.shape[0], img.shape[1])
+        return self.fill(img, mask)
+
+    def applyStrip(self, img, y0, h, w):
+        mask = MASK_CACHE.getStrip(self.maskFP, h, w, y0, y0+img.shape[0])
+        return self.fill(img, mask)
+
+    def fill(self, img, mask):
+        if img.ndim == 2 or img.shape[2] < 3:
+        # greyscale image; fill with luma of the fill color
+            grey = ImageColor.getcolor("#%02x%02x%02x"%tuple(self.fCol), "L")
+            if img.ndim == 2: fillCol = grey
+            else: fillCol = np.array([grey, 255])
+        elif img.shape[2] == 3: fillCol = np.array(self.fCol)
+        elif img.shape[2] == 4: fillCol = np.array(self.fCol+[255])
+        # delete (with fill color) black parts in masking image
+        img[mask] = fillCol
+        return img
+
+#=======================================================================
+
+class ResampleOp(ImgOp):
+    """ 'resize', 'resize_ratio' and 'rotate' processes.
+    A run of these steps is resampled in a single affine transform
+      of the image. A resize, which shrinks the image, is done 
+      with Image.resize to keep its anti-aliasing, and a run has
+      at most one rotation.
+    """
+    pil = True
+    fusible = True
+
+    def apply(self, img):
+        pending = [] # steps to be fused; (process name, parameters, 
+          # affine matrix from output to input, output size)
+        sz = img.size
+        for pn, params in self.steps:
+            if pn == 'rotate':
+                if 'rotate' in [x[0] for x in pending]:
+                # pixels outside of the previous rotated frame must not
+                #   be sampled; resample the pending steps first
+                    img = self.resample(img, pending)
+                    pending = []
+                value, expand = params
+                mat, sz = rotationMatrix(sz, value, expand)
+            else:
+                w, h = params
+                if pn == 'resize_ratio':
+                    w = int(w * sz[0])
+                    h = int(h * sz[1])
+                if w < sz[0] or h < sz[1]: # shrinking
+                    img = self.resample(img, pending)
+                    pending = []
+                    img = img.resize((w,h))
+                    sz = img.size
+                    continue
+                mat = np.array([[sz[0]/w, 0.0, 0.0],
+                                [0.0, sz[1]/h, 0.0],
+                                [0.0, 0.0, 1.0]])
+                sz = (w, h)
+            pending.append((pn, params, mat, sz))
+        return self.resample(img, pending)
+
+    #-------------------------------------------------------------------
+
+    def resample(self, img, pending):
+        """ Resample the image once for the pending steps.
+
+        Args:
+            img (PIL.Image): Input image.
+            pending (list): Pending steps.
+
+        Returns:
+            img (PIL.Image): Output image.
+        """
+        if len(pending) == 0: return img
+        if len(pending) == 1:
+        # single step; use the original PIL function
+            pn, params, mat, sz = pending[0]
+            if pn == 'rotate': return img.rotate(params[0], expand=params[1])
+            else: return img.resize(sz)
+        mat = np.identity(3)
+        resample = Image.NEAREST # as in Image.rotate
+        for pn, params, _mat, sz in pending:
+            mat = mat.dot(_mat) # output to input of all steps 
+            if pn != 'rotate': resample = Image.BICUBIC
+        data = tuple(mat[:2].ravel())
+        return img.transform(sz, Image.AFFINE, data, resample)
+
+#=======================================================================
+
+class PointOp(ImgOp):
+    """ 'brighten', 'darken', 'levels', 'gamma', 'contrast', 'invert' 
+    and 'threshold' processes.
+    Lookup tables of adjacent steps are composed into one, and pixel
+      values are mapped through it in place, in a single pass without
+      a copy of the image.
+    """
+    fusible = True
+    tileLocal = True
+
+    def __init__(self, steps):
+        ImgOp.__init__(self, steps)
+        self.luts = None # lookup tables for color and alpha channels
+
+    def getLUTs(self):
+        """ Lookup tables of all steps of this operator, composed. """
+        if self.luts is None:
+            lut = np.arange(256, dtype=np.uint8)
+            alphaLUT = lut.copy()
+            for pn, params in self.steps:
+                _lut, _alphaLUT = pointLUT(pn, params)
+                lut = _lut[lut]
+                alphaLUT = _alphaLUT[alphaLUT]
+            self.luts = (lut, alphaLUT)
+        return self.luts
+
+    def apply(self, img):
+        if img.dtype != np.uint8: img = np.clip(img, 0, 255).astype(np.uint8)
+        lut, alphaLUT = self.getLUTs()
+        flagAlpha = img.ndim == 3 and img.shape[2] in [2, 4]
+        if not flagAlpha or np.array_equal(lut, alphaLUT):
+            applyLUT(img, lut)
+            return img
+        identity = np.arange(256, dtype=np.uint8)
+        if not np.array_equal(lut, identity): applyLUT(img[:,:,:-1], lut)
+        if not np.array_equal(alphaLUT, identity):
+            applyLUT(img[:,:,-1], alphaLUT)
+        return img
+
+#=======================================================================
+
+class TextOp(ImgOp):
+    """ 'text' process.
+    The text is rendered once into an alpha stamp, which is blended
+      into every image.
+    """
+    def __init__(self, steps):
+        ImgOp.__init__(self, steps)
+        self.stamp = None # alpha stamp of rendered text
+        self.offset = None # offset of the stamp from the text position
+
+    def __getstate__(self):
+        # rendered stamp is not sent to worker processes
+        state = self.__dict__.copy()
+        state["stamp"] = None
+        return state
+
+    def render(self):
+        """ Render the text into the alpha stamp.
+
+        Args: None
+
+        Returns: None
+        """
+        txt, x, y, sz, col = self.steps[0][1]
+        font = getFont(FONT_FP, sz)
+        l, t, r, b = font.getbbox(txt)
+        stamp = Image.new("L", (max(1, r-l), max(1, b-t)), 0)
+        ImageDraw.Draw(stamp).text((-l, -t), txt, 255, font=font)
+        self.stamp = np.array(stamp, dtype=np.uint16)
+        self.offset = (l, t)
+
+    def apply(self, img):
+        txt, x, y, sz, col = self.steps[0][1]
+        if img.dtype != np.uint8 or img.ndim == 3 and img.shape[2] > 4:
+        # unusual image; draw with PIL
+            img = Image.fromarray(img)
+            draw = ImageDraw.Draw(img)
+            draw.text((int(x * img.size[0]), int(y * img.size[1])), txt, col,
+                      font=getFont(FONT_FP, sz))
+            return np.array(img)
+        if self.stamp is None: self.render()
+        ### set the region of the image to blend the stamp
+        x = int(x * img.shape[1]) + self.offset[0]
+        y = int(y * img.shape[0]) + self.offset[1]
+        sh, sw = self.stamp.shape
+        x0 = max(0, x); x1 = min(img.shape[1], x+sw)
+        y0 = max(0, y); y1 = min(img.shape[0], y+sh)
+        if x0 >= x1 or y0 >= y1: return img # text is out of the image
+        alpha = self.stamp[y0-y:y1-y, x0-x:x1-x]
+        ### set ink color
+        if img.ndim == 2:
+            ink = np.uint16(ImageColor.getcolor(col, "L"))
+        else:
+            alpha = alpha[:,:,np.newaxis]
+            if img.shape[2] <= 2: # grey with alpha channel
+                ink = [ImageColor.getcolor(col, "L")]
+            else:
+                ink = list(ImageColor.getrgb(col)[:3])
+            if img.shape[2] in [2, 4]: ink.append(255)
+            ink = np.array(ink[:img.shape[2]], dtype=np.uint16)
+        ### blend, rounding as PIL does
+        region = img[y0:y1, x0:x1]
+        flagAlpha = img.ndim == 3 and img.shape[2] in [2, 4]
+        if flagAlpha:
+        # PIL paints ink color on fully transparent pixels
+            clear = (region[:,:,-1] == 0) & (alpha[:,:,0] > 0)
+        tmp = region * (255 - alpha) + ink * alpha + 128
+        region[:] = ((tmp >> 8) + tmp) >> 8
+        if flagAlpha: region[clear,:-1] = ink[:-1]
+        return img
+
+#=======================================================================
+
+class FileIOStages:
+    """ Threads to read files before, and write files after processing
+    by workers of runBatch, so that the disk (or network storage) and
+      the CPUs are busy at the same time.
+    Read files wait in a queue of limited size, and the number of files
+      in processing or waiting to be written is limited, 
+      so that memory use is bounded, however many files there are.
+
+    Args:
+        fileList (list): File paths to read.
+        nThreads (int): Number of reading threads, and also of
+          writing threads.
+        maxInFlight (int): Max. number of files, which were handed to
+          workers, but are not written yet.
+        skipRead (function, optional): Called with a file path; when it
+          returns True, the file is not read and is handed to workers
+          with None as its content.
+
+    Examples:
+        >>> stages = FileIOStages(fileList, 2, 8)
+        >>> stages.start()
+        >>> rslts = map(procFunc, stages.readItems())
+        >>> for rslt in stages.writeItems(rslts): print(rslt)
+        >>> stages.close()
+    """
+    def __init__(self, fileList, nThreads=2, maxInFlight=4, skipRead=None):
+        if DEBUG: print("FileIOStages.__init__()")
+
+        self.skipRead = skipRead
+        self.fileIter = iter(fileList)
+        self.iterLock = Lock() # lock to take the next file path
+        self.nThreads = max(1, nThreads)
+        self.readQ = Queue(maxsize=max(2, self.nThreads*2)) # read files
+        self.writeQ = Queue(maxsize=max(2, self.nThreads*2)) # to write
+        self.doneQ = Queue() # written files
+        self.inFlight = Semaphore(max(1, maxInFlight))
+        self.stopEvent = Event()
+        self.readers = []
+        self.writers = []
+
+    #-------------------------------------------------------------------
+
+    def start(self):
+        """ Start reading and writing threads.
+
+        Args: None
+
+        Returns: None
+        """
+        for i in range(self.nThreads):
+            th = Thread(target=self.readFiles, daemon=True)
+            th.start()
+            self.readers.append(th)
+            th = Thread(target=self.writeFiles, daemon=True)
+            th.start()
+            self.writers.append(th)
+
+    #-------------------------------------------------------------------
+
+    def readFiles(self):
+        """ Read files into the read queue (run in reading threads).
+
+        Args: None
+
+        Returns: None
+        """
+        try:
+            while not self.stopEvent.is_set():
+                with self.iterLock: fp = next(self.fileIter, None)
+                if fp is None: break
+                t0 = perf_counter()
+                c0 = thread_time()
+                try:
+                    if self.skipRead is not None and self.skipRead(fp):
+                        data = None
+                    else:
+                        with open(fp, 'rb') as f: data = f.read()
+                    err = ''
+                except Exception as e: # also errors of skipRead, etc.
+                    data = None
+                    err = str(e)
+                item = (fp, data, err, perf_counter()-t0, thread_time()-c0)
+                self.putWhileRunning(self.readQ, item)
+        finally:
+            # always tell readItems that this reader finished
+            self.putWhileRunning(self.readQ, None)
+
+    #-------------------------------------------------------------------
+
+    def readItems(self):
+        """ Yield read files for processing, one more whenever 
+        a file was written, with a limit of files in processing.
+
+        Args: None
+
+        Yields:
+            (tuple): Input file path, its content (None, if failed), 
+              error message, seconds and CPU seconds of reading.
+        """
+        nFinished = 0 # number of finished readers
+        while nFinished < self.nThreads:
+            while not self.inFlight.acquire(timeout=0.1):
+                if self.stopEvent.is_set(): return
+            item = self.getWhileRunning(self.readQ)
+            if item is None:
+                self.inFlight.release()
+                if self.stopEvent.is_set(): return
+                nFinished += 1
+                continue
+            yield item
+
+    #-------------------------------------------------------------------
+
+    def writeFiles(self):
+        """ Write processed files from the write queue 
+        (run in writing threads).
+
+        Args: None
+
+        Returns: None
+        """
+        while True:
+            rslt = self.getWhileRunning(self.writeQ)
+            if rslt is None: break
+            fp, oFP, err, sec, oData, stats = rslt
+            t0 = perf_counter()
+            c0 = thread_time()
+            wallSec = 0.0
+            try:
+                with open(oFP, 'wb') as f: f.write(oData)
+                nBytes = len(oData)
+                wallSec = perf_counter() - t0
+                if stats is not None:
+                    ProcProfiler(stats).add('(write)', wallSec, 
+                                            thread_time()-c0, nBytes)
+            except Exception as e:
+                oFP = None
+                err = str(e)
+                nBytes = 0
+            finally:
+                # always hand the result back, so writeItems does not wait
+                self.doneQ.put((fp, oFP, err, sec+wallSec, nBytes, stats))
+                self.inFlight.release()
+
+    #-------------------------------------------------------------------
+
+    def writeItems(self, rsltIter):
+        """ Hand processed files to writing threads and yield results
+        of written files.
+
+        Args:
+            rsltIter (iterator): Results of _procDataSafe.
+
+        Yields:
+            (tuple): Result tuple as _procFileSafe.
+        """
+        nPending = 0 # number of files handed to writers, not done yet
+        for rslt in rsltIter:
+            if rslt[4] is not None: 
+                self.writeQ.put(rslt) # blocks, if writers are behind
+                nPending += 1
+            else: # failed or already written; nothing to write
+                self.inFlight.release()
+                nBytes = 0 if rslt[1] is None else path.getsize(rslt[1])
+                yield rslt[:4] + (nBytes, rslt[5])
+            while True:
+                try: done = self.doneQ.get_nowait()
+                except Empty: break
+                nPending -= 1
+                yield done
+        for i in range(nPending): yield self.doneQ.get()
+
+    #-------------------------------------------------------------------
+
+    def putWhileRunning(self, q, item):
+        """ Put an item into a bounded queue, giving up when stopped.
+
+        Args:
+            q (Queue): Queue.
+            item: Item to put.
+
+        Returns: None
+        """
+        while not self.stopEvent.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    #-------------------------------------------------------------------
+
+    def getWhileRunning(self, q):
+        """ Get an item from a queue, giving up (returning None)
+        when stopped.
+
+        Args:
+            q (Queue): Queue.
+
+        Returns:
+            Item, or None.
+        """
+        while not self.stopEvent.is_set():
+            try: return q.get(timeout=0.1)
+            except Empty: pass
+        return None
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Finish writing and stop all threads.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("FileIOStages.close()")
+
+        for th in self.writers: self.writeQ.put(None)
+        for th in self.writers: th.join()
+        self.stopEvent.set()
+        for th in self.readers: th.join()
+
+#=======================================================================
+
+class PreviewWorker(Thread):
+    """ Thread to render previews (input image at reduced scale and its
+    processed result) in the background.
+    Only the newest request is kept; an older pending request is dropped
+      and a running one is cancelled between operators.
+
+    Decoded images and results after each operator are cached, 
+      so that changing a later step only recomputes from that step.
+
+    Args:
+        callback (function): Called in this thread with (request id, 
+          file path, input image, output image, error message) 
+          when a preview is ready. Images are np.ndarray (None on error),
+          which must not be modified.
+        maxBytes (int): Max. total bytes of cached images.
+    """
+    def __init__(self, callback, maxBytes=512*1024*1024):
+        if DEBUG: print("PreviewWorker.__init__()")
+
+        Thread.__init__(self, daemon=True)
+        self.callback = callback
+        self.cache = LRUCache(maxBytes)
+        self.cond = Condition()
+        self.reqId = 0 # id of the newest request
+        self.req = None # pending request
+        self.flagStop = False
+
+    #-------------------------------------------------------------------
+
+    def submit(self, fp, steps, maxSz, maskFP=MASK_FP):
+        """ Request a preview, replacing any pending request.
+
+        Args:
+            fp (str): File path of image.
+            steps (list): List of (process name, parameter list) tuples.
+            maxSz (tuple): Max. width and height of input image.
+            maskFP (str): File path of masking image.
+
+        Returns:
+            (int): Request id.
+        """
+        if DEBUG: print("PreviewWorker.submit()")
+
+        with self.cond:
+            self.reqId += 1
+            self.req = (self.reqId, fp, steps, maxSz, maskFP)
+            self.cond.notify()
+            return self.reqId
+
+    #-------------------------------------------------------------------
+
+    def isStale(self, reqId):
+        """ Whether a newer request was submitted after 'reqId'.
+
+        Args:
+            reqId (int): Request id.
+
+        Returns:
+            (bool)
+        """
+        return self.flagStop or reqId != self.reqId
+
+    #-------------------------------------------------------------------
+
+    def stop(self):
+        """ Stop the thread.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("PreviewWorker.stop()")
+
+        with self.cond:
+            self.flagStop = True
+            self.cond.notify()
+
+    #-------------------------------------------------------------------
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.req is None and not self.flagStop:
+                    self.cond.wait()
+                if self.flagStop: return
+                reqId, fp, steps, maxSz, maskFP = self.req
+                self.req = None
+            isCancelled = partial(self.isStale, reqId)
+            try:
+                # mask's mtime, so that previews are renewed after it's edited
+                if path.isfile(maskFP): maskMTime = stat(maskFP).st_mtime
+                else: maskMTime = None # no masking file; not used
+                srcKey = (fp, stat(fp).st_mtime, tuple(maxSz), maskFP,
+                          maskMTime)
+                rslt = self.cache.get(srcKey)
+                if rslt is None:
+                    iImg, scale = loadPreviewImg(fp, maxSz)
+                    iImg = np.array(iImg)
+                    self.cache.put(srcKey, (iImg, scale), iImg.nbytes)
+                else:
+                    iImg, scale = rslt
+                if isCancelled(): continue
+                plan = compilePlan(scaleSteps(steps, scale), maskFP)
+                oImg = plan.runCached(iImg, self.cache, srcKey, isCancelled)
+                if oImg is None: continue # cancelled
+                err = ''
+            except Exception as e:
+                iImg = oImg = None
+                err = str(e)
+            if not isCancelled(): self.callback(reqId, fp, iImg, oImg, err)
+
+#=======================================================================
+
+if __name__ == "__main__":
+    sys.exit(runCLI(sys.argv[1:]))
@@ -0,0 +1,613 @@
+# coding: UTF-8
+
+"""
+ipServer
+Local HTTP service of image processing of pyImgProc (without wxPython).
+Other programs send an image with a pipeline, and get the processed
+  image back, without starting their own copy of pyImgProc.
+Worker processes, with their compiled plans, loaded fonts and masks,
+  are kept for all requests.
+
+Usage:
+    python ipServer.py [--port 8765] [--unix /tmp/pyImgProc.sock] [-j 4]
+    (or 'python pyImgProc.py -s ...')
+
+Requests:
+    POST /process?pipeline=<JSON>&format=.png
+        Body is an image file. The pipeline (as in pipeline.json of
+          batch processing) can be also given in 'X-Pipeline' header.
+          Without format, the format of the input image is kept.
+        Response is the processed image file.
+    POST /batch
+        Body is JSON; {"pipeline": [...], "format": ".png",
+          "images": [base64 of image files]}.
+        Response is JSON; {"images": [base64 of processed images],
+          "errors": [error messages]} (None or '' for each failed
+          or successful image).
+    GET /metrics
+        Number of requests, errors and latency (p50, p99, mean, max)
+          of each endpoint, as JSON.
+    GET /health
+
+e.g.:
+    curl --data-binary @img1.jpg -o out.png \\
+      'http://127.0.0.1:8765/process?format=.png&pipeline=[["flip",[1]]]'
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import sys, json, argparse, base64, signal
+from os import cpu_count, path, remove
+from time import perf_counter, time
+from io import BytesIO
+from collections import deque
+from threading import Lock, BoundedSemaphore
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+from multiprocessing import Pool
+
+import numpy as np
+from PIL import Image, UnidentifiedImageError
+
+from imgProcEngine import MASK_FP, getPlan, parseSteps
+
+DEBUG = False
+SERVER_PORT = 8765
+MAX_BODY = 256 * 1024 * 1024 # max. size of request body in bytes
+LATENCY_WINDOW = 10000 # number of latest requests for percentiles
+BUSY_WAIT_SEC = 30.0 # max. seconds a request waits for a free slot
+POST_PATHS = ['/process', '/batch'] # endpoints with their own statistics
+
+#-----------------------------------------------------------------------
+
+def procBytes(data, steps, imgExt='', maskFP=MASK_FP):
+    """ Process an image file in memory.
+
+    Args:
+        data (bytes): Content of an image file.
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension of the output format.
+          Empty string means the format of the input.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        (bytes): Encoded processed image.
+        fmt (str): Format of the processed image (e.g.: 'PNG').
+
+    Examples:
+        >>> oData, fmt = procBytes(data, [('flip', [1])], '.png')
+    """
+    if imgExt != '':
+        fmt = Image.registered_extensions().get(imgExt.lower())
+        if fmt is None: raise ValueError("unknown format: %s"%(imgExt))
+    try: img = Image.open(BytesIO(data))
+    except (UnidentifiedImageError, OSError) as e:
+        raise IOError("cannot identify image file") from e
+    if imgExt == '': fmt = img.format
+    img.load()
+    img = getPlan(steps, maskFP).run(img, asArray=False)
+    if isinstance(img, np.ndarray): img = Image.fromarray(img)
+    buf = BytesIO()
+    img.save(buf, format=fmt)
+    return buf.getvalue(), fmt
+
+#-----------------------------------------------------------------------
+
+def _procBytesSafe(data, steps, imgExt, maskFP):
+    """ Run procBytes, catching an error. This is the task function
+    of worker processes of ProcService.
+
+    Args:
+        As procBytes.
+
+    Returns:
+        (tuple): Encoded processed image (None, if failed),
+          its format and error message.
+    """
+    try:
+        oData, fmt = procBytes(data, steps, imgExt, maskFP)
+        return (oData, fmt, '')
+    except Exception as e:
+        return (None, None, str(e))
+
+#-----------------------------------------------------------------------
+
+def _initServiceWorker():
+    """ Initialize a worker process of ProcService.
+    Ctrl+C is left to the main process, which stops the workers.
+
+    Args: None
+
+    Returns: None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+#=======================================================================
+
+class LatencyStats:
+    """ Number of requests, errors and latency of each endpoint.
+    Percentiles are computed from the latest LATENCY_WINDOW requests.
+    """
+    def __init__(self):
+        if DEBUG: print("LatencyStats.__init__()")
+
+        self.lock = Lock()
+        self.stats = {} # key: endpoint name
+
+    #-------------------------------------------------------------------
+
+    def add(self, name, sec, flagErr=False):
+        """ Add a request.
+
+        Args:
+            name (str): Endpoint name.
+            sec (float): Latency in seconds.
+            flagErr (bool): Whether the request failed.
+
+        Returns:
+            None
+        """
+        with self.lock:
+            st = self.stats.get(name)
+            if st is None:
+                st = dict(n=0, nErr=0, sec=deque(maxlen=LATENCY_WINDOW))
+                self.stats[name] = st
+            st["n"] += 1
+            if flagErr: st["nErr"] += 1
+            st["sec"].append(sec)
+
+    #-------------------------------------------------------------------
+
+    def report(self):
+        """ Summarize the statistics.
+
+        Args: None
+
+        Returns:
+            report (dict): For each endpoint, number of requests and
+              errors, and p50, p99, mean and max latency (ms) of
+              the latest requests.
+        """
+        report = {}
+        with self.lock:
+            for name, st in self.stats.items():
+                ms = np.array(st["sec"]) * 1000
+                report[name] = dict(n=st["n"], nErr=st["nErr"])
+                if len(ms) == 0: continue
+                p50, p99 = np.percentile(ms, [50, 99])
+                report[name].update(p50MS=float(p50), p99MS=float(p99),
+                                    meanMS=float(ms.mean()),
+                                    maxMS=float(ms.max()))
+        return report
+
+#=======================================================================
+
+class ProcService:
+    """ Processing of images for requests, shared by all connections.
+    Images are processed by a pool of worker processes, which is kept
+      for all requests, or in the threads of requests (nWorkers=0).
+    At most 'maxConcurrent' requests are processed at a time;
+      others wait for a free slot.
+
+    Args:
+        nWorkers (int): Number of worker processes.
+          0 means processing in threads of requests.
+        maxConcurrent (int): Max. number of requests in processing.
+        maskFP (str): File path of masking image.
+        busyWaitSec (float): Max. seconds a request waits for a free
+          slot, before it is answered with 503.
+
+    Examples:
+        >>> service = ProcService(4)
+        >>> oData, fmt = service.process(data, steps, '.png')
+    """
+    def __init__(self, nWorkers=cpu_count(), maxConcurrent=None,
+                 maskFP=MASK_FP, busyWaitSec=BUSY_WAIT_SEC):
+        if DEBUG: print("ProcService.__init__()")
+
+        if maxConcurrent is None: maxConcurrent = max(1, nWorkers) * 2
+        self.nWorkers = nWorkers
+        self.maxConcurrent = maxConcurrent
+        self.maskFP = maskFP
+        self.busyWaitSec = busyWaitSec
+        self.pool = None
+        if nWorkers > 0: self.pool = Pool(nWorkers, _initServiceWorker)
+        self.slots = BoundedSemaphore(maxConcurrent)
+        self.stats = LatencyStats()
+        self.lock = Lock()
+        self.nInFlight = 0 # number of requests in processing
+        self.t0 = time()
+
+    #-------------------------------------------------------------------
+
+    def acquire(self, timeout=None):
+        """ Wait for a free slot to process a request.
+
+        Args:
+            timeout (float): Max. seconds to wait.
+              None means 'busyWaitSec' of the service.
+
+        Returns:
+            (bool): Whether a slot was acquired.
+        """
+        if timeout is None: timeout = self.busyWaitSec
+        if not self.slots.acquire(timeout=timeout): return False
+        with self.lock: self.nInFlight += 1
+        return True
+
+    #-------------------------------------------------------------------
+
+    def release(self):
+        """ Free a slot taken by 'acquire'.
+
+        Args: None
+
+        Returns: None
+        """
+        with self.lock: self.nInFlight -= 1
+        self.slots.release()
+
+    #-------------------------------------------------------------------
+
+    def process(self, data, steps, imgExt=''):
+        """ Process an image file in memory.
+
+        Args:
+            data (bytes): Content of an image file.
+            steps (list): List of (process name, parameter list) tuples.
+            imgExt (str): Image file extension of the output format.
+
+        Returns:
+            (tuple): As _procBytesSafe.
+        """
+        args = (data, steps, imgExt, self.maskFP)
+        if self.pool is None: return _procBytesSafe(*args)
+        return self.pool.apply(_procBytesSafe, args)
+
+    #-------------------------------------------------------------------
+
+    def processBatch(self, dataList, steps, imgExt=''):
+        """ Process image files of a request, spread across workers.
+
+        Args:
+            dataList (list): Contents of image files.
+            steps (list): List of (process name, parameter list) tuples.
+            imgExt (str): Image file extension of the output format.
+
+        Returns:
+            (list): Result tuples of _procBytesSafe.
+        """
+        argsList = [(data, steps, imgExt, self.maskFP) for data in dataList]
+        if self.pool is None:
+            return [_procBytesSafe(*args) for args in argsList]
+        return self.pool.starmap(_procBytesSafe, argsList, 1)
+
+    #-------------------------------------------------------------------
+
+    def metrics(self):
+        """ Metrics of the service.
+
+        Args: None
+
+        Returns:
+            (dict): Uptime, settings, number of requests in processing
+              and statistics of each endpoint (LatencyStats.report).
+        """
+        return dict(
+                    uptimeSec = time() - self.t0,
+                    nWorkers = self.nWorkers,
+                    maxConcurrent = self.maxConcurrent,
+                    inFlight = self.nInFlight,
+                    endpoints = self.stats.report(),
+                   )
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Stop worker processes.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ProcService.close()")
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+#=======================================================================
+
+class ProcRequestHandler(BaseHTTPRequestHandler):
+    """ Handler of HTTP requests to ProcService ('service' attribute
+    of the server).
+    """
+    protocol_version = "HTTP/1.1" # keep connections alive
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path == '/metrics':
+            self.sendJSON(200, self.server.service.metrics())
+        elif url.path == '/health':
+            self.sendJSON(200, dict(status='ok'))
+        else:
+            self.sendJSON(404, dict(error="unknown path: %s"%(url.path)))
+
+    #-------------------------------------------------------------------
+
+    def do_POST(self):
+        t0 = perf_counter()
+        url = urlsplit(self.path)
+        service = self.server.service
+        code = 500
+        try:
+            body = self.readBody()
+            if url.path not in POST_PATHS:
+                code = 404
+                self.sendJSON(code, dict(error="unknown path: %s"%(url.path)))
+                return
+            if body is None:
+                code = 413
+                self.sendJSON(code, dict(error="request body is too large"))
+                return
+            if not service.acquire():
+                code = 503
+                self.sendJSON(code, dict(error="service is busy"),
+                              {"Retry-After": "1"})
+                return
+            try:
+                if url.path == '/process': code = self.process(url, body)
+                else: code = self.processBatch(body)
+            finally:
+                service.release()
+        except (ValueError, TypeError, IndexError, KeyError) as e:
+        # bad request
+            code = 400
+            self.sendJSON(code, dict(error=str(e)))
+        finally:
+            # unknown paths share one entry, so that they can't grow stats
+            name = url.path if url.path in POST_PATHS else "other"
+            service.stats.add(name, perf_counter()-t0, code != 200)
+
+    #-------------------------------------------------------------------
+
+    def process(self, url, body):
+        """ Process an image of '/process' request, and send the result.
+
+        Args:
+            url (urllib.parse.SplitResult): Requested URL.
+            body (bytes): Request body.
+
+        Returns:
+            (int): HTTP status code sent.
+        """
+        query = parse_qs(url.query)
+        pipeline = query.get('pipeline', [None])[0]
+        if pipeline is None: pipeline = self.headers.get('X-Pipeline')
+        if pipeline is None: raise ValueError("pipeline is not given")
+        steps = parseSteps(json.loads(pipeline))
+        imgExt = self.extParam(query.get('format', [''])[0])
+        oData, fmt, err = self.server.service.process(body, steps, imgExt)
+        if err != '':
+            self.sendJSON(422, dict(error=err))
+            return 422
+        mime = Image.MIME.get(fmt, "application/octet-stream")
+        self.sendBytes(200, oData, mime)
+        return 200
+
+    #-------------------------------------------------------------------
+
+    def processBatch(self, body):
+        """ Process images of '/batch' request, and send the results.
+
+        Args:
+            body (bytes): Request body.
+
+        Returns:
+            (int): HTTP status code sent.
+        """
+        req = json.loads(body.decode("utf-8"))
+        if not isinstance(req, dict): raise ValueError("JSON object expected")
+        steps = parseSteps(req.get('pipeline'))
+        imgExt = self.extParam(req.get('format', ''))
+        dataList = [base64.b64decode(s) for s in req.get('images', [])]
+        rslts = self.server.service.processBatch(dataList, steps, imgExt)
+        images = []
+        errors = []
+        for oData, fmt, err in rslts:
+            if oData is None: images.append(None)
+            else: images.append(base64.b64encode(oData).decode("ascii"))
+            errors.append(err)
+        self.sendJSON(200, dict(images=images, errors=errors))
+        return 200
+
+    #-------------------------------------------------------------------
+
+    def extParam(self, imgExt):
+        """ Normalize an output format parameter to a file extension.
+
+        Args:
+            imgExt (str): e.g.: '.png', 'png' or ''.
+
+        Returns:
+            (str): e.g.: '.png' or ''.
+        """
+        if imgExt != '' and not imgExt.startswith("."): imgExt = "." + imgExt
+        return imgExt
+
+    #-------------------------------------------------------------------
+
+    def readBody(self):
+        """ Read the request body.
+
+        Args: None
+
+        Returns:
+            (bytes): Request body. None if it's larger than MAX_BODY.
+
+        Raises:
+            ValueError: Content-Length is not a valid number.
+        """
+        try: n = int(self.headers.get('Content-Length', 0))
+        except ValueError:
+            self.close_connection = True # body length is unknown
+            raise ValueError("invalid Content-Length")
+        if n < 0:
+            self.close_connection = True
+            raise ValueError("invalid Content-Length")
+        if n > MAX_BODY:
+            self.close_connection = True # body is left unread
+            return None
+        return self.rfile.read(n)
+
+    #-------------------------------------------------------------------
+
+    def sendBytes(self, code, data, mime, headers={}):
+        """ Send a response.
+
+        Args:
+            code (int): HTTP status code.
+            data (bytes): Response body.
+            mime (str): Content type.
+            headers (dict): Additional headers.
+
+        Returns:
+            None
+        """
+        self.send_response(code)
+        self.send_header("Content-Type", mime)
+        self.send_header("Content-Length", str(len(data)))
+        for k, v in headers.items(): self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(data)
+
+    #-------------------------------------------------------------------
+
+    def sendJSON(self, code, obj, headers={}):
+        """ Send a JSON response.
+
+        Args:
+            code (int): HTTP status code.
+            obj (dict): Object to send as JSON.
+            headers (dict): Additional headers.
+
+        Returns:
+            None
+        """
+        data = json.dumps(obj).encode("utf-8")
+        self.sendBytes(code, data, "application/json", headers)
+
+    #-------------------------------------------------------------------
+
+    def address_string(self):
+        # client address is empty with a Unix socket
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        if self.server.flagVerbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+#=======================================================================
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """ HTTP server on a Unix socket, handling each connection
+    in a thread.
+    """
+    daemon_threads = True
+
+#-----------------------------------------------------------------------
+
+def makeServer(service, host='127.0.0.1', port=SERVER_PORT, unixFP='',
+               flagVerbose=False):
+    """ Make an HTTP server of a ProcService.
+
+    Args:
+        service (ProcService): Service to process requests.
+        host (str): Host address to listen on.
+        port (int): Port number (0 for any free port).
+        unixFP (str): File path of Unix socket. If given, the server
+          listens on it instead of host and port.
+        flagVerbose (bool): Whether to print each request.
+
+    Returns:
+        server (socketserver.BaseServer): Server; call serve_forever.
+
+    Examples:
+        >>> server = makeServer(ProcService(4), port=0)
+        >>> port = server.server_address[1]
+    """
+    if DEBUG: print("ipServer.makeServer()")
+
+    if unixFP != '':
+        if path.exists(unixFP): remove(unixFP) # socket of an old server
+        server = UnixHTTPServer(unixFP, ProcRequestHandler)
+    else:
+        server = ThreadingHTTPServer((host, port), ProcRequestHandler)
+    server.service = service
+    server.flagVerbose = flagVerbose
+    return server
+
+#-----------------------------------------------------------------------
+
+def runServer(argv):
+    """ Run the server from the command line, until Ctrl+C.
+
+    Args:
+        argv (list): Command line arguments (without program name).
+
+    Returns:
+        (int): Exit status.
+
+    Examples:
+        >>> runServer(['--port', '8765', '-j', '4'])
+    """
+    if DEBUG: print("ipServer.runServer()")
+
+    parser = argparse.ArgumentParser(
+                    prog="ipServer",
+                    description="Local HTTP service of image processing"
+                                " of pyImgProc.",
+                                    )
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=SERVER_PORT,
+                        help="port number (default: %i)"%(SERVER_PORT))
+    parser.add_argument("--unix", default="", metavar="SOCKET",
+                        help="listen on a Unix socket instead")
+    parser.add_argument("-j", "--workers", type=int, default=cpu_count(),
+                        help="number of worker processes; 0 to process"
+                             " in threads of requests")
+    parser.add_argument("-c", "--max-concurrent", type=int, default=None,
+                        help="max. number of requests in processing"
+                             " (default: workers x 2)")
+    parser.add_argument("-m", "--mask", default=MASK_FP,
+                        help="masking image (default: %s)"%(MASK_FP))
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print each request")
+    args = parser.parse_args(argv)
+
+    service = ProcService(args.workers, args.max_concurrent, args.mask)
+    server = makeServer(service, args.host, args.port, args.unix,
+                        args.verbose)
+    if args.unix != '': where = args.unix
+    else: where = "http://%s:%i"%server.server_address[:2]
+    print("Serving on %s (Ctrl+C to stop)..."%(where))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+        if args.unix != '' and path.exists(args.unix): remove(args.unix)
+    return 0
+
+#=======================================================================
+
+if __name__ == '__main__':
+    sys.exit(runServer(sys.argv[1:]))
@@ -0,0 +1,629 @@
+# coding: UTF-8
+
+"""
+jobScheduler
+Queue of batch jobs of pyImgProc (without wxPython), sharing one pool
+  of worker processes.
+Each job has its own files, processes (with parameters) and output
+  format. Jobs can be submitted while others are running, and can be
+  paused, resumed, cancelled and re-prioritized.
+Files of jobs with a higher priority are dispatched first; jobs with
+  the same priority share the workers equally. A job, which waited 
+  long for workers, gets a higher priority for a file (aging), so that
+  lower priority jobs are not starved by higher ones arriving.
+
+Usage:
+    python jobScheduler.py jobs.json [-j 8] [-l log.csv]
+
+    'jobs.json' is a list of jobs, e.g.:
+      [{"name": "archive", "pipeline": [["resize_ratio", [0.5, 0.5]]],
+        "paths": ["./archive"], "recursive": true, "format": ".jpg"},
+       {"name": "urgent", "pipeline": [["flip", [1]]],
+        "paths": ["./today"], "priority": 10}]
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import sys, json, argparse, signal
+from os import cpu_count
+from time import time
+from functools import partial
+from threading import Thread, Condition
+from multiprocessing import Pool
+
+from imgProcEngine import MASK_FP, LOG_FILE, MAX_ERRS
+from imgProcEngine import getPlan, parseSteps, collectFiles, logRecord
+from imgProcEngine import _procFileSafe
+from batchStore import LogSink
+
+DEBUG = False
+JOB_STATES = ['queued', 'running', 'paused', 'cancelled', 'done']
+AGING_SEC = 30.0 # priority of a job is raised by 1 for every this many
+  # seconds it waited without a file dispatched
+
+#-----------------------------------------------------------------------
+
+def _procJobFile(fp, steps, imgExt, maskFP):
+    """ Process a file of a job. This is the task function of worker
+    processes of JobScheduler. Plans are compiled once per worker
+      for each pipeline (getPlan).
+
+    Args:
+        fp (str): File path of image to process.
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension for saving.
+        maskFP (str): File path of masking image.
+
+    Returns:
+        (tuple): Result tuple of _procFileSafe.
+    """
+    try:
+        plan = getPlan(steps, maskFP)
+    except Exception as e:
+        return (fp, None, str(e), 0.0, 0, None)
+    return _procFileSafe(fp, plan, imgExt, False)
+
+#-----------------------------------------------------------------------
+
+def _initJobWorker():
+    """ Initialize a worker process of JobScheduler.
+    Ctrl+C is left to the main process.
+
+    Args: None
+
+    Returns: None
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+#=======================================================================
+
+class BatchJob:
+    """ A batch job of JobScheduler; files to process with a pipeline,
+    and its progress.
+
+    Args:
+        jobId (int): Job id.
+        fileList (list): List of image file paths.
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension for saving.
+        priority (int): Priority; higher is dispatched first.
+        maskFP (str): File path of masking image.
+        name (str): Name to show.
+        q (Queue, optional): Queue to report progress, as runBatch.
+          When the job ends, ('done', job status) is put.
+    """
+    def __init__(self, jobId, fileList, steps, imgExt='', priority=0,
+                 maskFP=MASK_FP, name='', q=None):
+        if DEBUG: print("BatchJob.__init__()")
+
+        self.jobId = jobId
+        self.fileList = list(fileList)
+        self.steps = steps
+        self.imgExt = imgExt
+        self.priority = priority
+        self.maskFP = maskFP
+        self.name = name if name != '' else "job%i"%(jobId)
+        self.q = q
+        self.state = 'queued'
+        self.iNext = 0 # index of the next file to dispatch
+        self.nInFlight = 0 # number of files in worker processes
+        self.nDispatched = 0
+        self.nDone = 0
+        self.nErr = 0
+        self.outBytes = 0
+        self.procSec = 0.0 # sum of seconds taken in workers
+        self.errs = [] # (file path, error message) of failed files
+        self.tSubmit = time()
+        self.tStart = None # time the first file was dispatched
+        self.tLastDispatch = self.tSubmit # time a file was last dispatched
+          # (or the job was submitted or resumed)
+        self.tEnd = None
+
+    #-------------------------------------------------------------------
+
+    def isRunnable(self):
+        """ Whether a file of this job can be dispatched now.
+
+        Args: None
+
+        Returns:
+            (bool)
+        """
+        return self.state in ['queued', 'running'] and \
+          self.iNext < len(self.fileList)
+
+    #-------------------------------------------------------------------
+
+    def effPriority(self, now, agingSec=AGING_SEC):
+        """ Priority raised by the time the job waited for a file
+        to be dispatched.
+
+        Args:
+            now (float): Current time.
+            agingSec (float): Seconds of waiting to raise the priority
+              by 1. 0 means no aging.
+
+        Returns:
+            (int)
+        """
+        if agingSec <= 0: return self.priority
+        return self.priority + int((now - self.tLastDispatch) / agingSec)
+
+    #-------------------------------------------------------------------
+
+    def status(self):
+        """ Progress and throughput of the job.
+
+        Args: None
+
+        Returns:
+            (dict): Id, name, state, priority, numbers of files
+              ('nFiles', 'nDone', 'nErr', 'nInFlight', 'nLeft'),
+              output size, seconds since start, throughput (files and
+              MB per second), estimated seconds left ('etaSec'; None
+              if unknown) and up to MAX_ERRS errors.
+        """
+        if self.tStart is None: sec = 0.0
+        else: sec = (self.tEnd if self.tEnd is not None else time()) - \
+                      self.tStart
+        nFinished = self.nDone + self.nErr
+        nLeft = len(self.fileList) - nFinished
+        imgPerSec = nFinished / sec if sec > 0 else 0.0
+        eta = None
+        if self.state in ['queued', 'running'] and imgPerSec > 0:
+            eta = nLeft / imgPerSec
+        return dict(
+                    jobId = self.jobId,
+                    name = self.name,
+                    state = self.state,
+                    priority = self.priority,
+                    nFiles = len(self.fileList),
+                    nDone = self.nDone,
+                    nErr = self.nErr,
+                    nInFlight = self.nInFlight,
+                    nLeft = nLeft,
+                    outBytes = self.outBytes,
+                    sec = sec,
+                    procSec = self.procSec,
+                    imgPerSec = imgPerSec,
+                    mbPerSec = self.outBytes / 1e6 / sec if sec > 0 else 0.0,
+                    etaSec = eta,
+                    errs = list(self.errs),
+                   )
+
+#=======================================================================
+
+class JobScheduler:
+    """ Runs batch jobs on one pool of worker processes.
+    A dispatcher thread keeps a few files per worker in the pool,
+      so that a new or re-prioritized job gets workers as soon as
+      the files in processing finish.
+    The next file is taken from the runnable job with the highest
+      priority; among jobs with the same priority, from the job with
+      the fewest files in processing (then the earliest submitted),
+      so that they share the workers equally.
+    For choosing, the priority of a job is raised by 1 for every
+      'agingSec' seconds since a file of the job was last dispatched
+      (aging), so that a low priority job gets a file now and then,
+      while higher priority jobs keep arriving.
+    Pausing or cancelling a job stops dispatching its files; files
+      already in processing are finished.
+
+    Args:
+        nWorkers (int): Number of worker processes.
+        logFile (str): File path of log file (batchStore.LogSink),
+          shared by all jobs. Empty string for no logging.
+        nInFlightPerWorker (int): Number of files per worker to keep
+          in the pool.
+        agingSec (float): Seconds of waiting to raise the priority of
+          a job by 1. 0 means no aging (strict priority; lower priority
+          jobs wait while higher ones are runnable).
+
+    Examples:
+        >>> sched = JobScheduler(8)
+        >>> jId = sched.submit(fileList, [('flip', [1])], '.png')
+        >>> urgent = sched.submit(fileList2, steps2, priority=10)
+        >>> sched.wait(urgent)
+        >>> print(sched.status(jId))
+        >>> sched.close()
+    """
+    def __init__(self, nWorkers=cpu_count(), logFile=LOG_FILE,
+                 nInFlightPerWorker=2, agingSec=AGING_SEC):
+        if DEBUG: print("JobScheduler.__init__()")
+
+        self.nWorkers = max(1, nWorkers)
+        self.maxInFlight = self.nWorkers * nInFlightPerWorker
+        self.agingSec = agingSec
+        self.pool = Pool(self.nWorkers, _initJobWorker)
+        self.log = None
+        if logFile != '': self.log = LogSink(logFile)
+        self.cond = Condition() # guards jobs; notified on any change
+        self.jobs = {} # key: job id
+        self.nextId = 1
+        self.nInFlight = 0 # number of files in the pool
+        self.flagClosing = False
+        self.dispatcher = Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    #-------------------------------------------------------------------
+
+    def submit(self, fileList, steps, imgExt='', priority=0,
+               maskFP=MASK_FP, name='', q=None):
+        """ Add a job to the queue.
+
+        Args:
+            fileList (list): List of image file paths.
+            steps (list): List of (process name, parameter list) tuples.
+            imgExt (str): Image file extension for saving.
+            priority (int): Priority; higher is dispatched first.
+            maskFP (str): File path of masking image.
+            name (str): Name to show.
+            q (Queue, optional): Queue to report progress (see BatchJob).
+
+        Returns:
+            (int): Job id.
+        """
+        if DEBUG: print("JobScheduler.submit()")
+
+        getPlan(steps, maskFP) # raise an error of the pipeline here
+        with self.cond:
+            if self.flagClosing: raise RuntimeError("scheduler is closed")
+            jobId = self.nextId
+            self.nextId += 1
+            job = BatchJob(jobId, fileList, steps, imgExt, priority, maskFP,
+                           name, q)
+            self.jobs[jobId] = job
+            if len(job.fileList) == 0: self.finishJob(job, 'done')
+            self.cond.notify_all()
+        return jobId
+
+    #-------------------------------------------------------------------
+
+    def pause(self, jobId):
+        """ Pause a job; its files are not dispatched until resumed.
+
+        Args:
+            jobId (int): Job id.
+
+        Returns:
+            (bool): Whether the job was paused.
+        """
+        with self.cond:
+            job = self.jobs[jobId]
+            if job.state not in ['queued', 'running']: return False
+            job.state = 'paused'
+            self.cond.notify_all()
+        return True
+
+    #-------------------------------------------------------------------
+
+    def resume(self, jobId):
+        """ Resume a paused job.
+
+        Args:
+            jobId (int): Job id.
+
+        Returns:
+            (bool): Whether the job was resumed.
+        """
+        with self.cond:
+            job = self.jobs[jobId]
+            if job.state != 'paused': return False
+            job.state = 'queued' if job.tStart is None else 'running'
+            job.tLastDispatch = time() # time paused is not waiting
+            self.checkEnd(job)
+            self.cond.notify_all()
+        return True
+
+    #-------------------------------------------------------------------
+
+    def cancel(self, jobId):
+        """ Cancel a job. Files in processing are finished, and
+        the rest are left.
+
+        Args:
+            jobId (int): Job id.
+
+        Returns:
+            (bool): Whether the job was cancelled.
+        """
+        with self.cond:
+            job = self.jobs[jobId]
+            if job.state in ['cancelled', 'done']: return False
+            job.state = 'cancelled'
+            if job.nInFlight == 0: self.finishJob(job, 'cancelled')
+            self.cond.notify_all()
+        return True
+
+    #-------------------------------------------------------------------
+
+    def setPriority(self, jobId, priority):
+        """ Change priority of a job.
+
+        Args:
+            jobId (int): Job id.
+            priority (int): Priority; higher is dispatched first.
+
+        Returns:
+            None
+        """
+        with self.cond:
+            self.jobs[jobId].priority = priority
+            self.cond.notify_all()
+
+    #-------------------------------------------------------------------
+
+    def status(self, jobId=None):
+        """ Status of a job, or of all jobs.
+
+        Args:
+            jobId (int, optional): Job id. None means all jobs.
+
+        Returns:
+            (dict/ list): Status (BatchJob.status) of the job,
+              or list of status of all jobs in order of submission.
+        """
+        with self.cond:
+            if jobId is not None: return self.jobs[jobId].status()
+            return [self.jobs[k].status() for k in sorted(self.jobs.keys())]
+
+    #-------------------------------------------------------------------
+
+    def wait(self, jobId=None, timeout=None):
+        """ Wait until a job (or all jobs) ended.
+        A paused job does not end until resumed (or cancelled);
+          waiting for all jobs skips paused jobs.
+
+        Args:
+            jobId (int, optional): Job id. None means all jobs, 
+              except paused ones.
+            timeout (float, optional): Max. seconds to wait.
+
+        Returns:
+            (bool): Whether the job(s) ended.
+        """
+        def ended():
+            if jobId is None:
+                jobs = [job for job in self.jobs.values()
+                        if job.state != 'paused']
+            else:
+                jobs = [self.jobs[jobId]]
+            return all([job.tEnd is not None for job in jobs])
+        with self.cond: return self.cond.wait_for(ended, timeout)
+
+    #-------------------------------------------------------------------
+
+    def nextJob(self):
+        """ Choose the job to take the next file from.
+
+        Args: None
+
+        Returns:
+            (BatchJob): None if no job is runnable.
+        """
+        now = time()
+        best = None
+        for job in self.jobs.values():
+            if not job.isRunnable(): continue
+            key = (-job.effPriority(now, self.agingSec), job.nInFlight,
+                   job.jobId)
+            if best is None or key < bestKey:
+                best = job
+                bestKey = key
+        return best
+
+    #-------------------------------------------------------------------
+
+    def dispatch(self):
+        """ Send files of jobs to the pool (executed in a thread).
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("JobScheduler.dispatch()")
+
+        with self.cond:
+            while not self.flagClosing:
+                job = None
+                if self.nInFlight < self.maxInFlight: job = self.nextJob()
+                if job is None:
+                    self.cond.wait()
+                    continue
+                fp = job.fileList[job.iNext]
+                job.iNext += 1
+                job.nInFlight += 1
+                job.nDispatched += 1
+                job.tLastDispatch = time()
+                self.nInFlight += 1
+                if job.tStart is None:
+                    job.tStart = time()
+                    job.state = 'running'
+                self.pool.apply_async(_procJobFile,
+                                (fp, job.steps, job.imgExt, job.maskFP),
+                                callback=partial(self.onResult, job),
+                                error_callback=partial(self.onError, job, fp))
+
+    #-------------------------------------------------------------------
+
+    def onResult(self, job, rslt):
+        """ Record a processed file (called in the result thread
+        of the pool).
+
+        Args:
+            job (BatchJob): Job of the file.
+            rslt (tuple): Result tuple of _procFileSafe.
+
+        Returns:
+            None
+        """
+        fp, oFP, err, sec, nBytes = rslt[:5]
+        with self.cond:
+            job.nInFlight -= 1
+            self.nInFlight -= 1
+            job.procSec += sec
+            if err == '':
+                job.nDone += 1
+                job.outBytes += nBytes
+            else:
+                job.nErr += 1
+                if len(job.errs) < MAX_ERRS: job.errs.append((fp, err))
+            if self.log is not None:
+                self.log.write(logRecord(rslt, job.steps))
+            if job.q is not None:
+                job.q.put(('progress', job.nDone+job.nErr,
+                           len(job.fileList), rslt))
+            self.checkEnd(job)
+            self.cond.notify_all()
+
+    #-------------------------------------------------------------------
+
+    def onError(self, job, fp, e):
+        """ Record a file, whose task failed in the pool (e.g.: a worker
+        failed to send the result), as a failed file.
+
+        Args:
+            job (BatchJob): Job of the file.
+            fp (str): File path.
+            e (Exception): Error of the task.
+
+        Returns:
+            None
+        """
+        self.onResult(job, (fp, None, str(e), 0.0, 0, None))
+
+    #-------------------------------------------------------------------
+
+    def checkEnd(self, job):
+        """ End a job, if all its files are processed, or it's cancelled
+        and has no file in processing. (Called with self.cond held.)
+
+        Args:
+            job (BatchJob): Job.
+
+        Returns:
+            None
+        """
+        if job.nInFlight > 0 or job.tEnd is not None: return
+        if job.state == 'cancelled': self.finishJob(job, 'cancelled')
+        elif job.state != 'paused' and \
+          job.nDone + job.nErr == len(job.fileList):
+            self.finishJob(job, 'done')
+
+    #-------------------------------------------------------------------
+
+    def finishJob(self, job, state):
+        """ Mark a job as ended. (Called with self.cond held.)
+
+        Args:
+            job (BatchJob): Job.
+            state (str): 'done' or 'cancelled'.
+
+        Returns:
+            None
+        """
+        job.state = state
+        job.tEnd = time()
+        if job.tStart is None: job.tStart = job.tEnd
+        if self.log is not None: self.log.flush()
+        if job.q is not None: job.q.put(('done', job.status()))
+
+    #-------------------------------------------------------------------
+
+    def close(self, flagWait=True):
+        """ Stop the scheduler.
+
+        Args:
+            flagWait (bool): Whether to wait until all jobs, except
+              paused ones, end. Unfinished (or paused) jobs are
+              cancelled (files in processing are finished).
+
+        Returns:
+            None
+        """
+        if DEBUG: print("JobScheduler.close()")
+
+        if flagWait: self.wait()
+        with self.cond:
+            for job in self.jobs.values():
+                if job.tEnd is None: job.state = 'cancelled'
+            self.flagClosing = True
+            self.cond.notify_all()
+        self.dispatcher.join()
+        self.pool.close()
+        self.pool.join() # files in processing are finished
+        with self.cond:
+            for job in self.jobs.values(): self.checkEnd(job)
+        if self.log is not None: self.log.close()
+
+#=======================================================================
+
+def runJobs(argv):
+    """ Run jobs listed in a JSON file from the command line,
+    printing progress of each job.
+
+    Args:
+        argv (list): Command line arguments (without program name).
+
+    Returns:
+        (int): Exit status; 1, if a file failed.
+
+    Examples:
+        >>> runJobs(['jobs.json', '-j', '8'])
+    """
+    if DEBUG: print("jobScheduler.runJobs()")
+
+    parser = argparse.ArgumentParser(
+                    prog="jobScheduler",
+                    description="Run batch jobs of pyImgProc on a shared"
+                                " pool of workers.",
+                                    )
+    parser.add_argument("jobs", help="JSON file listing jobs")
+    parser.add_argument("-j", "--workers", type=int, default=cpu_count(),
+                        help="number of worker processes")
+    parser.add_argument("-l", "--log", default=LOG_FILE,
+                        help="log file (default: %s)"%(LOG_FILE))
+    parser.add_argument("-m", "--mask", default=MASK_FP,
+                        help="masking image (default: %s)"%(MASK_FP))
+    parser.add_argument("--interval", type=float, default=2.0,
+                        help="seconds between progress reports")
+    args = parser.parse_args(argv)
+
+    with open(args.jobs, 'r') as f: items = json.load(f)
+    sched = JobScheduler(args.workers, args.log)
+    try:
+        for item in items:
+            imgExt = item.get("format", "")
+            if imgExt != "" and not imgExt.startswith("."):
+                imgExt = "." + imgExt
+            fileList = collectFiles(item["paths"],
+                                    recursive=item.get("recursive", False))
+            sched.submit(fileList, parseSteps(item["pipeline"]), imgExt,
+                         item.get("priority", 0), args.mask,
+                         item.get("name", ""))
+        while not sched.wait(timeout=args.interval):
+            for st in sched.status():
+                print("%-16s %-9s %6i/%-6i %6.1f img/s"%(st["name"][:16],
+                        st["state"], st["nDone"]+st["nErr"], st["nFiles"],
+                        st["imgPerSec"]))
+    except KeyboardInterrupt:
+        print("Cancelling jobs; files in processing are finished...")
+        sched.close(flagWait=False)
+    else:
+        sched.close()
+    nErr = 0
+    for st in sched.status():
+        nErr += st["nErr"]
+        for fp, err in st["errs"]: print("[ERROR] %s: %s"%(fp, err))
+        print("%s: %s; %i files processed (%.1f MB), %i failed,"
+              " in %.1f seconds (%.1f img/s)."%(st["name"], st["state"],
+                st["nDone"], st["outBytes"]/1e6, st["nErr"], st["sec"],
+                st["imgPerSec"]))
+    if nErr > 0: return 1
+    return 0
+
+#=======================================================================
+
+if __name__ == '__main__':
+    sys.exit(runJobs(sys.argv[1:]))
@@ -0,0 +1,240 @@
+# coding: UTF-8
+
+"""
+procProfiler
+Per-step timing and memory profile of image processing
+  in pyImgProc (without wxPython).
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import json, tracemalloc
+from time import perf_counter, thread_time
+
+DEBUG = False
+PROFILE_FILE = "profile_pyImgProc.json"
+# upper edges (milliseconds) of histogram bins of wall time;
+#   the last bin counts the rest
+HIST_EDGES = [0.1, 0.2, 0.5, 1, 2, 5, 10, 20, 50, 100, 200, 500,
+              1000, 2000, 5000, 10000]
+_memTrace = dict(started=False) # whether ProcProfiler started tracemalloc
+
+#-----------------------------------------------------------------------
+
+def profileTable(report, nRows=10):
+    """ Make a text table of the slowest steps in a profile report.
+
+    Args:
+        report (dict): Report made by ProcProfiler.report.
+        nRows (int): Max. number of steps to show.
+
+    Returns:
+        txt (str): Text table.
+
+    Examples:
+        >>> print(profileTable(prof.report()))
+    """
+    rows = sorted(report.items(), key=_totalSec, reverse=True)[:nRows]
+    txt = "%-28s %7s %9s %9s %9s %9s %9s\n"%("Step", "Count", "Total(s)",
+                            "Mean(ms)", "CPU(s)", "Peak(MB)", "Alloc(MB)")
+    for name, r in rows:
+        txt += "%-28s %7i %9.2f %9.2f %9.2f %9.1f %9.1f\n"%(name[:28],
+                        r["n"], r["totalSec"], r["meanMS"], r["cpuSec"],
+                        r["peakMB"], r["peakAllocMB"])
+    return txt
+
+#-----------------------------------------------------------------------
+
+def _totalSec(item):
+    """ Key function to sort report items by total time. """
+    return item[1]["totalSec"]
+
+#-----------------------------------------------------------------------
+
+def stopMemTrace():
+    """ Stop tracing memory allocations, if ProcProfiler started it,
+    so that processing after profiling is not slowed down.
+
+    Args: None
+
+    Returns: None
+    """
+    if _memTrace["started"]:
+        tracemalloc.stop()
+        _memTrace["started"] = False
+
+#=======================================================================
+
+class ProcProfiler:
+    """ Collects wall time, CPU time, peak image size in memory and
+    peak memory allocated during each step (with decoding and encoding
+      of files).
+    CPU time is of the measuring thread, so reading and writing threads
+      are not charged to the step. Allocated memory is traced with
+      tracemalloc (started by the first measurement; see stopMemTrace),
+      which covers Python objects and NumPy arrays, but not buffers
+      of PIL images. It is of the whole process, so allocations of other
+      threads during a step are counted as well.
+    Measurements are aggregated as they come, with a histogram of wall
+      time, so that memory use doesn't grow with the number of images.
+    Profilers of worker processes are combined with 'merge'.
+
+    Args:
+        stats (dict, optional): Measurements to continue with
+          ('stats' attribute of another ProcProfiler).
+
+    Examples:
+        >>> prof = ProcProfiler()
+        >>> t = prof.start()
+        >>> img = op.apply(img)
+        >>> prof.stop('flip', t, img.nbytes)
+    """
+    def __init__(self, stats=None):
+        if DEBUG: print("ProcProfiler.__init__()")
+
+        if stats is None: stats = {}
+        self.stats = stats # aggregated measurements; key: step name
+
+    #-------------------------------------------------------------------
+
+    def start(self):
+        """ Start measuring a step.
+
+        Args: None
+
+        Returns:
+            (tuple): Wall time, CPU time of this thread and traced
+              memory at the start, to pass to 'stop'.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _memTrace["started"] = True
+        tracemalloc.reset_peak()
+        mem = tracemalloc.get_traced_memory()[0]
+        return (perf_counter(), thread_time(), mem)
+
+    #-------------------------------------------------------------------
+
+    def stop(self, name, t, nBytes=0):
+        """ Finish measuring a step and add the measurement.
+
+        Args:
+            name (str): Name of the step.
+            t (tuple): Returned value of 'start'.
+            nBytes (int): Size of the image (the larger of input
+              and output) in bytes.
+
+        Returns:
+            None
+        """
+        wall = perf_counter() - t[0]
+        cpu = thread_time() - t[1]
+        allocBytes = max(0, tracemalloc.get_traced_memory()[1] - t[2])
+        self.add(name, wall, cpu, nBytes, allocBytes)
+
+    #-------------------------------------------------------------------
+
+    def add(self, name, wall, cpu, nBytes=0, allocBytes=0):
+        """ Add a measurement, taken elsewhere (e.g.: in another thread).
+
+        Args:
+            name (str): Name of the step.
+            wall (float): Wall time in seconds.
+            cpu (float): CPU time in seconds.
+            nBytes (int): Size of the data in bytes.
+            allocBytes (int): Peak memory allocated during the step
+              in bytes.
+
+        Returns:
+            None
+        """
+        st = self.stats.get(name)
+        if st is None:
+            st = dict(n=0, wall=0.0, cpu=0.0, maxWall=0.0, peakBytes=0,
+                      allocBytes=0, peakAlloc=0,
+                      hist=[0]*(len(HIST_EDGES)+1))
+            self.stats[name] = st
+        st["n"] += 1
+        st["wall"] += wall
+        st["cpu"] += cpu
+        st["maxWall"] = max(st["maxWall"], wall)
+        st["peakBytes"] = max(st["peakBytes"], nBytes)
+        st["allocBytes"] += allocBytes
+        st["peakAlloc"] = max(st["peakAlloc"], allocBytes)
+        ms = wall * 1000
+        for i, edge in enumerate(HIST_EDGES):
+            if ms < edge: break
+        else:
+            i = len(HIST_EDGES)
+        st["hist"][i] += 1
+
+    #-------------------------------------------------------------------
+
+    def merge(self, stats):
+        """ Add measurements of another profiler.
+
+        Args:
+            stats (dict): 'stats' attribute of another ProcProfiler.
+
+        Returns:
+            None
+        """
+        for name, o in stats.items():
+            st = self.stats.get(name)
+            if st is None:
+                self.stats[name] = dict(o, hist=list(o["hist"]))
+                continue
+            for k in ["n", "wall", "cpu", "allocBytes"]: st[k] += o[k]
+            for k in ["maxWall", "peakBytes", "peakAlloc"]:
+                st[k] = max(st[k], o[k])
+            st["hist"] = [a+b for a, b in zip(st["hist"], o["hist"])]
+
+    #-------------------------------------------------------------------
+
+    def report(self):
+        """ Summarize the measurements.
+
+        Args: None
+
+        Returns:
+            report (dict): For each step name, count, total/mean/max
+              wall time, CPU time, peak image size, mean and peak
+              allocated memory and histogram of wall time.
+        """
+        report = {}
+        for name, st in self.stats.items():
+            n = max(1, st["n"])
+            report[name] = dict(
+                                n = st["n"],
+                                totalSec = st["wall"],
+                                meanMS = st["wall"] / n * 1000,
+                                maxMS = st["maxWall"] * 1000,
+                                cpuSec = st["cpu"],
+                                peakMB = st["peakBytes"] / 1e6,
+                                meanAllocMB = st["allocBytes"] / n / 1e6,
+                                peakAllocMB = st["peakAlloc"] / 1e6,
+                                histEdgesMS = HIST_EDGES,
+                                histCounts = st["hist"],
+                               )
+        return report
+
+    #-------------------------------------------------------------------
+
+    def save(self, fp):
+        """ Write the report to a JSON file.
+
+        Args:
+            fp (str): File path.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ProcProfiler.save()")
+
+        with open(fp, 'w') as f: json.dump(self.report(), f, indent=1)
+
+#=======================================================================
+
+if __name__ == '__main__':
+    pass
@@ -13,7 +13,7 @@ October 2019.
 Dependency:
     wxPython (4.0)
     NumPy (1.15)
-    Pillow (6.1)
+    Pillow (7.0)
 
 ------------------------------------------------------------------------
 Copyright (C) 2019 Jinook Oh, W. Tecumseh Fitch 
@@ -40,28 +40,82 @@ v.0.1: (2019.Oct.)
   - Initial development.
 v.0.1.1: (2019.Oct.22.)
   - Adding more functions, flip, masking, type... 
+v.0.1.2:
+  - Moving image processing into GUI-free module, imgProcEngine.py.
+  - Batch processing from command line with option '-b'.
+  - Processing files with multiple worker processes.
+  - Compiling processes into a plan of operators, fusing adjacent
+    crop/flip and resize/rotate steps.
+  - Caching resized masks for masking.
+  - Rendering text only once for all images.
+  - Previewing with images decoded at reduced scale.
+  - Rendering previews in a background thread.
+  - Caching decoded images and intermediate results for previews.
+  - Searching files with os.scandir in a background thread.
+  - Virtual list control over a compact index of file paths.
+  - Option to skip files, whose output is up to date.
+  - Journal of batch runs, with an option to resume a stopped run.
+  - Streaming CSV/JSONL log with per-file timing and output size,
+    and a summary of results instead of the full list.
+  - Option to profile time and memory of each process.
+  - Benchmark of file formats, processes and batch throughput,
+    benchmark.py.
+  - Reading and writing files in threads, overlapping with processing.
+  - Processing very large images in strips, tiledProc.py.
+  - Brighten/darken with a lookup table in place; a process after
+    brighten/darken with value below 1 is no longer skipped.
+  - Adding 'levels' process.
+  - Adding 'gamma', 'contrast', 'invert' and 'threshold' processes;
+    adjacent point processes are applied as one lookup table.
+  - Greyscale with integer arithmetic, for greyscale, RGBA and palette
+    images, with an option to output a single-channel image.
+  - Drawing previews from a display buffer of each panel, reduced to
+    the panel size, with wx.Bitmap.FromBuffer(RGBA).
+  - In-memory index of scanned folders; target files (several wildcard
+    patterns, regular expressions, size and date filters) are found
+    in the index without accessing the disk. 'Refresh' button.
+  - Watching folders (inotify, or scanning) and processing image files
+    as they arrive, watchFolder.py; '--watch' in command line.
+  - Local HTTP (or Unix socket) service of image processing with
+    a shared pool of workers and latency metrics, ipServer.py.
+  - Queue of batch jobs with priorities, sharing one pool of workers,
+    with pause/resume/cancel and progress of each job, jobScheduler.py.
 """
 
-import sys
-from os import path, getcwd, mkdir
-from copy import copy
-from glob import glob
+import sys, re
+from os import path, getcwd, mkdir, cpu_count
+from copy import copy, deepcopy
+from threading import Thread, Event
+from queue import Queue
+
+if __name__ == "__main__" and sys.argv[1:2] in [['-b'], ['-s']]:
+# batch processing or processing service; wxPython is not imported
+    if sys.argv[1] == '-b':
+        from imgProcEngine import runCLI
+        sys.exit(runCLI(sys.argv[2:]))
+    from ipServer import runServer
+    sys.exit(runServer(sys.argv[2:]))
 
 import wx, wx.adv
 import wx.lib.scrolledpanel as SPanel 
 import wx.lib.agw.multidirdialog as MDD
-import numpy as np
-from PIL import Image
-from PIL import ImageFont
-from PIL import ImageDraw 
 
-from fFuncNClasses import get_time_stamp, GNU_notice, writeFile, getWXFonts
+from fFuncNClasses import GNU_notice, writeFile, getWXFonts
 from fFuncNClasses import add2gbs, setupStaticText, updateFrameSize
-from fFuncNClasses import str2num, PopupDialog
+from fFuncNClasses import str2num, PopupDialog, receiveDataFromQueue
+from imgProcEngine import IMG_PROC_OPTIONS, IP_PARAMS, IP_PARAM_VAL
+from imgProcEngine import EXT_LIST, MASK_FP, LOG_FILE, LOG_HEADER
+from imgProcEngine import makeSteps, procImg, runBatch, summaryText
+from imgProcEngine import PreviewWorker, displayArray
+from watchFolder import watchFolders
+from batchStore import JOURNAL_FILE
+from procProfiler import PROFILE_FILE
+from fileIndex import DirIndex, PathIndex, parseFileFilter
 
 DEBUG = False 
 CWD = getcwd()
-__version__ = "0.1.1"
+__version__ = "0.1.2"
+CLOSE_WAIT_SEC = 10.0 # max. seconds to wait for each thread when closing
 
 
 #=======================================================================
@@ -104,43 +158,24 @@ class ImgProcsFrame(wx.Frame):
         self.pi = pi # pnael information
         self.gbs = {} # for GridBagSizer
         self.panel = {} # panels
+        self.dispBuf = {} # display buffer of each image panel
         self.timer = {} # timers
         self.selectedFolders = [] # list of selected folders
-        self.fileList = [] # file list of images to process 
+        self.fileList = PathIndex() # file list of images to process 
         self.imgFormats = [".bmp", ".eps", ".gif", 
                            ".jpg", ".pcx", ".png", 
                            ".tiff", ".webp"] # image formats for
           # saving after image processing
         self.imgFormats = sorted(self.imgFormats)
         self.imgFormats.insert(0, "Use original file extension as it is")
-        self.imgProcOptions = [
-                                'greyscale',
-                                'crop',
-                                'crop_ratio',
-                                'masking',
-                                'resize',
-                                'resize_ratio',
-                                'rotate',
-                                'flip',
-                                'brighten',
-                                'darken',
-                                'text',
-                              ] # image processing options 
-        self.ipParams = dict(
-                                greyscale = [],
-                                crop = ['x', 'y', 'w', 'h'],
-                                crop_ratio = ['x', 'y', 'w', 'h'],
-                                masking = ['fill-color'],
-                                resize = ['w', 'h'],
-                                resize_ratio = ['w', 'h'],
-                                rotate = ['deg', 'expand'],
-                                flip = ['direction'],
-                                brighten = ['value'],
-                                darken = ['value'],
-                                text = ['text', 'x', 'y', 'font-size', 'color'],
-                             ) # parameters for each image processing
+        # image processing options 
+        self.imgProcOptions = copy(IMG_PROC_OPTIONS)
+        # parameters for each image processing
+        self.ipParams = deepcopy(IP_PARAMS)
         self.ipParamDesc = dict(
-            greyscale = [],
+            greyscale = [
+                'output single-channel image (0 or 1)',
+                ],
             crop = [
                 'x-coordinate to start (pixel)',
                 'y-coordinate to start (pixel)',
@@ -177,6 +212,23 @@ class ImgProcsFrame(wx.Frame):
             darken = [
                 'pixel value to subtract'
                 ],
+            levels = [
+                'input value to become black (0-255)',
+                'input value to become white (0-255)',
+                'gamma (1.0 = linear)',
+                'output value of black (0-255)',
+                'output value of white (0-255)',
+                ],
+            gamma = [
+                'gamma (1.0 = no change; >1.0 brightens)',
+                ],
+            contrast = [
+                'contrast factor (1.0 = no change)',
+                ],
+            invert = [],
+            threshold = [
+                'pixel value to become white (0-255)',
+                ],
             text = [
                 'text to insert',
                 'x-coordinate (0.0-1.0)',
@@ -185,19 +237,8 @@ class ImgProcsFrame(wx.Frame):
                 'font color (hexadecimal)',
                 ],
         ) # description of parameters
-        self.ipParamVal = dict(
-                                greyscale = [],
-                                crop = [0, 0, 1, 1],
-                                crop_ratio = [0.0, 0.0, 0.5, 0.5],
-                                masking = ['#000000'], 
-                                resize = [1, 1],
-                                resize_ratio = [0.1, 0.1],
-                                rotate = [0, 0],
-                                flip = [0],
-                                brighten = [20],
-                                darken = [20],
-                                text = ['', 0.0, 0.0, 12, '#000000'],
-                              ) # default value of each parameter
+        # default value of each parameter
+        self.ipParamVal = deepcopy(IP_PARAM_VAL)
         # max. number of parameters among all processes
         self.mNumParam = -1 
         for k in self.ipParams.keys():
@@ -205,18 +246,33 @@ class ImgProcsFrame(wx.Frame):
             if self.mNumParam < n: self.mNumParam = copy(n)
         self.iImgArr = None # numpy array of input image
         self.oImgArr = None # numpy array of output image
-        self.logFile = "log_pyImgProc.txt"
+        self.logFile = LOG_FILE
+        self.journalFile = JOURNAL_FILE # journal of processed files
+        self.profileFile = PROFILE_FILE # profile of processes
         # extension list to recognize as an image file for processing
-        self.extList = ['bmp', 'png', 'jpg', 'gif', 'pcx', 'tif', 'tiff'] 
+        self.extList = copy(EXT_LIST)
         self.procList = [] # image processing list to execute
-        self.maskFP = "mask.png" # masking image
+        self.maskFP = MASK_FP # masking image
+        self.th = None # thread for running batch processing
+        self.batchStop = None # event to stop batch processing
+        self.q2m = None # queue to receive progress from the batch thread
+        # thread to render previews in the background
+        self.previewWorker = PreviewWorker(self.onPreviewReady)
+        self.previewWorker.start()
+        self.previewFP = '' # file path of image in preview
+        self.flagSubFolders = False # whether to include sub-folders
+        self.scanStop = None # event to stop searching files
+        self.scanTh = None # thread searching files
+        self.dirIndex = DirIndex(self.extList) # contents of scanned folders
+        self.q2scan = None # queue to receive found files
+        self.watchStop = None # event to stop watching folders
+        self.q2w = None # queue to receive results of watching folders
+        self.watchTh = None # thread watching folders
         ##### end of setting up attributes -----  
         
         ### make log file 
-        logHeader = "Timestamp, Image file name, Processes\n"
-        logHeader += "# ----------------------------------------\n"
         if not path.isfile(self.logFile): # log file doesn't exist
-            writeFile(self.logFile, logHeader) # write header
+            writeFile(self.logFile, LOG_HEADER) # write header
 
         ### create panels
         for pk in pi.keys():
@@ -256,6 +312,15 @@ class ImgProcsFrame(wx.Frame):
                          )
         chk.SetValue(False)
         add2gbs(self.gbs["ui"], chk, (row,col), (1,1))
+        col += 1
+        btn = wx.Button(
+                            self.panel["ui"],
+                            -1,
+                            label="Refresh",
+                            name="refreshFiles_btn",
+                       )
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        add2gbs(self.gbs["ui"], btn, (row,col), (1,1))
         row += 1; col = 0
         sTxt = setupStaticText(
                             self.panel["ui"], 
@@ -283,7 +348,8 @@ class ImgProcsFrame(wx.Frame):
                 (row,col), 
                 (1,nCol)) # horizontal line separator
         row += 1; col = 0
-        lbl = "Target files (you can use wildcard characters)"
+        lbl = "Target files (wildcards, 're:' regex, size>1M, date>2019-10-01;"
+        lbl += " separated by ';')"
         sTxt = setupStaticText(
                             self.panel["ui"], 
                             lbl, 
@@ -325,12 +391,11 @@ class ImgProcsFrame(wx.Frame):
                               )
         add2gbs(self.gbs["ui"], sTxt, (row,col), (1,nCol))
         row += 1; col = 0
-        lstCtrl = wx.ListCtrl(
+        lstCtrl = FileListCtrl(
                             self.panel["ui"],
-                            -1,
+                            self.fileList,
                             name="selFile_lst",
                             size=(hlSz[0], 100),
-                            style=wx.LC_REPORT|wx.LC_SINGLE_SEL,
                              ) # selected files to be processed 
         lstCtrl.AppendColumn("FilePath")
         lstCtrl.SetColumnWidth(0, lstCtrl.GetSize()[0])
@@ -462,6 +527,48 @@ class ImgProcsFrame(wx.Frame):
                        )
         add2gbs(self.gbs["ui"], cho, (row,col), (1,nCol-1))
         row += 1; col = 0
+        sTxt = setupStaticText(self.panel["ui"], 
+                               "Workers:", 
+                               font=self.fonts[1])
+        add2gbs(self.gbs["ui"], sTxt, (row,col), (1,1))
+        col += 1 
+        spin = wx.SpinCtrl(
+                            self.panel["ui"],
+                            -1,
+                            name="nWorkers_spin",
+                            min=1,
+                            max=max(64, cpu_count()),
+                            initial=cpu_count(),
+                          ) # number of worker processes for batch
+        add2gbs(self.gbs["ui"], spin, (row,col), (1,1))
+        col += 1
+        chk = wx.CheckBox(
+                            self.panel["ui"],
+                            -1,
+                            label="Skip unchanged files",
+                            name="skipUnchanged_chk",
+                         ) # skip files processed with the same processes
+        chk.SetValue(False)
+        add2gbs(self.gbs["ui"], chk, (row,col), (1,nCol-2))
+        row += 1; col = 0
+        chk = wx.CheckBox(
+                            self.panel["ui"],
+                            -1,
+                            label="Resume the last (stopped) run",
+                            name="resume_chk",
+                         ) # skip files recorded in the journal
+        chk.SetValue(False)
+        add2gbs(self.gbs["ui"], chk, (row,col), (1,nCol))
+        row += 1; col = 0
+        chk = wx.CheckBox(
+                            self.panel["ui"],
+                            -1,
+                            label="Profile time & memory of processes",
+                            name="profile_chk",
+                         ) # measure each process and save to a file
+        chk.SetValue(False)
+        add2gbs(self.gbs["ui"], chk, (row,col), (1,nCol))
+        row += 1; col = 0
         btn = wx.Button(
                             self.panel["ui"],
                             -1,
@@ -472,6 +579,16 @@ class ImgProcsFrame(wx.Frame):
         btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
         add2gbs(self.gbs["ui"], btn, (row,col), (1,nCol))
         row += 1; col = 0
+        btn = wx.Button(
+                            self.panel["ui"],
+                            -1,
+                            label="Start watching folders for new files",
+                            name="watch_btn",
+                            size=(hlSz[0],-1),
+                       ) # process files as they arrive in the folders
+        btn.Bind(wx.EVT_LEFT_DOWN, self.onButtonPressDown)
+        add2gbs(self.gbs["ui"], btn, (row,col), (1,nCol))
+        row += 1; col = 0
         sTxt = setupStaticText(self.panel["ui"], " ", font=self.fonts[1])
         add2gbs(self.gbs["ui"], sTxt, (row,col), (1,nCol))
         self.panel["ui"].SetSizer(self.gbs["ui"])
@@ -535,6 +652,9 @@ class ImgProcsFrame(wx.Frame):
         self.statusbar = self.CreateStatusBar(1)
         self.sbBgCol = self.statusbar.GetBackgroundColour()
         self.timer["sbTimer"] = None 
+        self.timer["procTimer"] = None # for polling batch progress
+        self.timer["scanTimer"] = None # for polling found files
+        self.timer["watchTimer"] = None # for polling watched folders
 
         updateFrameSize(self, wSz)
 
@@ -600,10 +720,20 @@ class ImgProcsFrame(wx.Frame):
         if objName == "selFolders_btn":
             self.selectFolders() 
 
+        elif objName == "refreshFiles_btn":
+            # scan the selected folders again
+            self.dirIndex.invalidate(self.selectedFolders)
+            self.updateFileList()
+
         elif objName == "run_btn":
             self.showHideProcParamWidgets() # hide all parameter widgets
             self.runImgProc() # run image processing 
 
+        elif objName == "watch_btn":
+            self.showHideProcParamWidgets() # hide all parameter widgets
+            if self.watchStop is None: self.startWatching()
+            else: self.stopWatching()
+
         elif objName == "clearProc_btn":
             self.showHideProcParamWidgets() # hide all parameter widgets
             lc = wx.FindWindowByName("proc_lst", self.panel["ui"])
@@ -630,6 +760,10 @@ class ImgProcsFrame(wx.Frame):
         elif objName == "updateParam_btn":
             self.updateParamValues() # update parameters
             self.showHideProcParamWidgets() # hide all parameter widgets
+
+        if objName in ["clearProc_btn", "clearAllProc_btn", "moveProcUp_btn",
+                       "moveProcDown_btn", "updateParam_btn"]:
+            self.showImgProcRslt(self.previewFP) # update preview 
    
     #-------------------------------------------------------------------
     
@@ -668,6 +802,8 @@ class ImgProcsFrame(wx.Frame):
         lc.SetItemState(newRI, wx.LIST_STATE_SELECTED, wx.LIST_STATE_SELECTED) 
         # delete the previous row 
         lc.DeleteItem(ri)
+        # planned processes in the new order
+        self.procList = [lc.GetItemText(i) for i in range(lc.GetItemCount())]
     
     #-------------------------------------------------------------------
     
@@ -702,23 +838,18 @@ class ImgProcsFrame(wx.Frame):
             ### include sub folder, 
             ###   if "including sub folder" option was checked.
             sfChk = wx.FindWindowByName("subFolders_chk", self.panel["ui"])
-            if sfChk.GetValue() == True:
-                ### update folder lists
-                folderL = copy(self.selectedFolders)
-                self.selectedFolders = []
-                for dp in folderL:
-                # go through selected folders
-                    self.selectedFolders.append(dp) # append the selected folder
-                    self.addFolders(dp) # add sub-folders in this folder
+            self.flagSubFolders = sfChk.GetValue()
 
             ### show folder list in UI
             selDir_txt = wx.FindWindowByName("selDir_txt", 
                                              self.panel["ui"])
             _txt = str(self.selectedFolders)
             _txt = _txt.strip("[]").replace("'","").replace(", ","\n\n")
+            if self.flagSubFolders: _txt += "\n\n(including sub-folders)"
             selDir_txt.SetValue(_txt) # show list of selected folders
 
-            self.updateFileList() # update files to be renamed
+            # folders changed since they were indexed are scanned again
+            self.updateFileList(flagCheck=True) 
         dlg.Destroy()
 
     #-------------------------------------------------------------------
@@ -796,6 +927,7 @@ class ImgProcsFrame(wx.Frame):
                     _str += " %s"%(self.ipParamVal[pn][i])
                     rowVal.append(_str)
                 lc.Append(rowVal) # show it in the listCtrl
+                self.showImgProcRslt(self.previewFP) # update preview 
     
     #-------------------------------------------------------------------
     
@@ -897,60 +1029,104 @@ class ImgProcsFrame(wx.Frame):
         objName = obj.GetName()
         
         if objName == 'targetFN_txt':
-        # target file format has changed
+        # target file format has changed; filter the index of files
             self.updateFileList()
     
     #-------------------------------------------------------------------
     
-    def addFolders(self, dp):
-        """ Adding sub-folders in the 'self.selectedFolders' list.
-
-        Args:
-            dp (str): Folder path to look for any other sub folders in it.
-
-        Returns:
-            None
-        """
-        if DEBUG: print("ImgProcsFrame.addFolders()")
-
-        for fp in glob(path.join(dp, '*')):
-        # go through everything in the selected folder
-            if path.isdir(fp) == True: # this is a folder
-                self.selectedFolders.append(fp) # add this sub-folder 
-                self.addFolders(fp) # add folders in this sub-folder
-    
-    #-------------------------------------------------------------------
-    
-    def updateFileList(self):
+    def updateFileList(self, flagCheck=False):
         """ This function is called when selected folders or target file 
         name or extension has changed. 
         This function updates file list, which will be renamed.
+        Folders already scanned are searched in the index of files,
+          without accessing the disk.
 
-        Args: None
+        Args:
+            flagCheck (bool): Whether to scan folders again, which were
+              changed since they were indexed.
 
         Returns: None
         """
         if DEBUG: print("ImgProcsFrame.updateFileList()")
 
-        fL = []
         tcFN = wx.FindWindowByName("targetFN_txt", self.panel["ui"])
         fileForm = "%s"%(tcFN.GetValue()) 
-        ### update self.fileList
-        for dp in self.selectedFolders:
-            p = path.join(dp, fileForm)
-            for fp in glob(p):
-                bn = path.basename(fp)
-                ext = bn.split(".")[-1]
-                if ext in self.extList:
-                    fL.append(fp)
-        self.fileList = fL
-
-        ### update ListCtrl to show files to be processed 
+        try: fileFilter = parseFileFilter(fileForm)
+        except (ValueError, re.error) as e:
+            self.statusbar.SetStatusText("[ERROR] target files: %s"%(str(e)))
+            return
+        if self.scanStop is not None: self.scanStop.set() # stop old scan
+        self.fileList.clear()
+        lc = wx.FindWindowByName("selFile_lst", self.panel["ui"])
+        lc.SetItemCount(0) # delete the current contents
+        self.previewFP = ''
+
+        ### search files in a thread; found files are shown with a timer
+        self.scanStop = Event()
+        self.q2scan = Queue()
+        args = (list(self.selectedFolders), fileFilter, self.flagSubFolders,
+                flagCheck, self.q2scan, self.scanStop)
+        self.scanTh = Thread(target=self.scanFilesThread, args=args, 
+                             daemon=True)
+        self.scanTh.start()
+        if self.timer["scanTimer"] is None:
+            self.timer["scanTimer"] = wx.Timer(self)
+            self.Bind(wx.EVT_TIMER, self.onScanTimer, 
+                      self.timer["scanTimer"])
+        self.timer["scanTimer"].Start(100)
+        self.statusbar.SetStatusText("Searching files...")
+
+    #-------------------------------------------------------------------
+
+    def scanFilesThread(self, folders, fileFilter, recursive, flagCheck, q,
+                        stopEvent):
+        """ Search image files (executed in a thread, not touching
+        any wxPython widgets).
+
+        Args:
+            folders (list): Folders to search.
+            fileFilter (FileFilter): Compiled file filter.
+            recursive (bool): Whether to search sub-folders.
+            flagCheck (bool): Whether to scan changed folders again.
+            q (Queue): Queue to send found files.
+            stopEvent (threading.Event): Set when the search is obsolete.
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.scanFilesThread()")
+
+        for batch in self.dirIndex.find(folders, fileFilter, recursive,
+                                        stopEvent.is_set, flagCheck=flagCheck):
+            q.put(('files', batch))
+        q.put(('done', None))
+
+    #-------------------------------------------------------------------
+
+    def onScanTimer(self, event):
+        """ Receive found files from the queue and show them.
+
+        Args: event (wx.Event)
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.onScanTimer()")
+
         lc = wx.FindWindowByName("selFile_lst", self.panel["ui"])
-        lc.DeleteAllItems() # delete the current contents
-        for i, fp in enumerate(self.fileList):
-            lc.Append([fp])
-        self.showImgProcRslt()
+        while True:
+            rData = receiveDataFromQueue(self.q2scan, self.logFile)
+            if rData is None: return
+            if rData[0] == 'files':
+                self.fileList.extend(rData[1])
+                lc.SetItemCount(len(self.fileList))
+                # show the first image
+                if self.previewFP == '': self.showImgProcRslt()
+                self.statusbar.SetStatusText("Searching files... %i"%(
+                                                        len(self.fileList)))
+            elif rData[0] == 'done':
+                self.timer["scanTimer"].Stop()
+                self.statusbar.SetStatusText("%i files found."%(
+                                                        len(self.fileList)))
+                return
 
     #-------------------------------------------------------------------
     
@@ -965,9 +1141,52 @@ class ImgProcsFrame(wx.Frame):
         """
         if DEBUG: print("ImgProcsFrame.showImgProcRslt()")
 
-        if fp == '': fp = self.fileList[0]
-        iImg = np.array(Image.open(fp))
-        oImg = self.procImg(iImg.copy()) 
+        if fp == '':
+            if len(self.fileList) == 0: return
+            fp = self.fileList[0]
+        self.previewFP = fp
+        # render in the background, at reduced scale to fit in the panel
+        self.previewWorker.submit(fp, self.getSteps(), self.pi["ip"]["sz"],
+                                  self.maskFP)
+
+    #-------------------------------------------------------------------
+
+    def onPreviewReady(self, reqId, fp, iImg, oImg, err):
+        """ A preview was rendered (called in the preview thread).
+
+        Args:
+            reqId (int): Request id.
+            fp (str): File path of image.
+            iImg (np.ndarray): Input image.
+            oImg (np.ndarray): Output image.
+            err (str): Error message.
+
+        Returns: None
+        """
+        wx.CallAfter(self.drawImgProcRslt, reqId, fp, iImg, oImg, err)
+
+    #-------------------------------------------------------------------
+
+    def drawImgProcRslt(self, reqId, fp, iImg, oImg, err):
+        """ Draw an image and its result after image processing
+
+        Args:
+            reqId (int): Request id.
+            fp (str): File path of image.
+            iImg (np.ndarray): Input image.
+            oImg (np.ndarray): Output image.
+            err (str): Error message.
+
+        Returns:
+            None
+        """
+        if DEBUG: print("ImgProcsFrame.drawImgProcRslt()")
+
+        # a newer preview is on its way
+        if self.previewWorker.isStale(reqId): return
+        if err != '':
+            self.statusbar.SetStatusText("[ERROR] %s: %s"%(fp, err))
+            return
 
         ### draw image
         for i in range(2):
@@ -977,17 +1196,14 @@ class ImgProcsFrame(wx.Frame):
             elif i == 1:
                 img = oImg 
                 k = "op"
-            if len(img.shape) > 2 and img.shape[2] == 4:
-                wxImg = wx.ImageFromBuffer(img.shape[1], 
-                                           img.shape[0], 
-                                           img[:,:,:3].tostring(),
-                                           img[:,:,3].tostring())
-            else:
-                wxImg = wx.ImageFromBuffer(img.shape[1], 
-                                           img.shape[0], 
-                                           img.tostring())
+            # reduce to the panel size in the display buffer of the panel
+            buf = displayArray(img, self.pi[k]["sz"], self.dispBuf.get(k))
+            self.dispBuf[k] = buf
+            bh, bw = buf.shape[:2]
+            if buf.shape[2] == 4: bmp = wx.Bitmap.FromBufferRGBA(bw, bh, buf)
+            else: bmp = wx.Bitmap.FromBuffer(bw, bh, buf)
             w = wx.FindWindowByName("%s_sBmp"%(k), self.panel[k])
-            w.SetBitmap(wx.Bitmap(wxImg))
+            w.SetBitmap(bmp)
             self.panel[k].SetupScrolling()
     
     #-------------------------------------------------------------------
@@ -1001,88 +1217,19 @@ class ImgProcsFrame(wx.Frame):
         Return:
             img (np.ndarray): Output image
         """
-        for pn in self.procList:
-        # go through all planned processes 
-            if pn == 'greyscale':
-                rgb_weights = [0.2989, 0.5870, 0.1140]
-                gMat = np.dot(img[...,:3], rgb_weights)
-                img[:,:,0] = gMat
-                img[:,:,1] = gMat
-                img[:,:,2] = gMat
-            elif pn == 'crop':
-                x, y, w, h = self.ipParamVal[pn]
-                img = img[y:y+h,x:x+w]
-            elif pn == 'crop_ratio':
-                x, y, w, h = self.ipParamVal[pn]
-                x = int(x * img.shape[1])
-                y = int(y * img.shape[0])
-                w = int(w * img.shape[1])
-                h = int(h * img.shape[0])
-                img = img[y:y+h,x:x+w]
-            elif pn == 'masking':
-                fCol = self.ipParamVal[pn][0]
-                ### load masking image
-                maskImg = Image.open(self.maskFP)
-                maskImg = maskImg.resize((img.shape[1],img.shape[0]))
-                maskImg = np.array(maskImg)
-                # sum r,g,b channel
-                maskImg = np.sum(maskImg[:,:,0:3], axis=2)
-                ### set fill color
-                fCol = fCol.lstrip("#")
-                c1 = int(fCol[:2], 16)
-                c2 = int(fCol[2:4], 16)
-                c3 = int(fCol[4:6], 16)
-                if img.shape[2] == 3: fillCol = np.array([c1,c2,c3])
-                elif img.shape[2] == 4: fillCol = np.array([c1,c2,c3,255])
-                # delete (with fill color) black parts in masking image 
-                img[maskImg==0] = fillCol 
-            elif pn == 'resize':
-                w, h = self.ipParamVal[pn]
-                img = np.array(Image.fromarray(img).resize((w,h)))
-            elif pn == 'resize_ratio':
-                w, h = self.ipParamVal[pn]
-                w = int(w * img.shape[1])
-                h = int(h * img.shape[0])
-                img = np.array(Image.fromarray(img).resize((w,h)))
-            elif pn == 'rotate':
-                value, expand = self.ipParamVal[pn]
-                img = Image.fromarray(img)
-                img = img.rotate(value, expand=expand)
-                img = np.array(img)
-            elif pn == 'flip':
-                direction = self.ipParamVal[pn][0]
-                img = Image.fromarray(img)
-                ### 0:Image.FLIP_LEFT_RIGHT, 1:Image.FLIP_TOP_BOTTOM
-                if direction == 2:
-                    img = img.transpose(0)
-                    img = img.transpose(1)
-                else:
-                    img = img.transpose(direction)
-                img = np.array(img)
-            elif pn in ['brighten', 'darken']:
-                value = self.ipParamVal[pn][0]
-                if value < 1: return img 
-                if value > 255: value = 255
-                if pn == 'darken': value = -value
-                img = img.astype(np.int16)
-                img += value
-                img[img<0] = 0
-                img[img>255] = 255
-                img = img.astype(np.uint8)
-            elif pn == 'text':
-                txt, x, y, sz, col = self.ipParamVal[pn]
-                x = int(x * img.shape[1])
-                y = int(y * img.shape[0])
-                img = Image.fromarray(img)
-                draw = ImageDraw.Draw(img)
-                if sys.platform == "darwin":
-                    fontFP = "/System/Library/Fonts/Monaco.dfont"
-                elif sys.platform.startswith("win"):
-                    fontFP = "/Windows/Fonts/cour.ttf"
-                font = ImageFont.truetype(font=fontFP, size=sz)
-                draw.text((x, y), txt, col, font=font)
-                img = np.array(img)
-        return img
+        return procImg(img, self.getSteps(), self.maskFP)
+    
+    #-------------------------------------------------------------------
+
+    def getSteps(self):
+        """ Get planned processes with their current parameter values 
+
+        Args: None
+
+        Returns:
+            (list): List of (process name, parameter list) tuples.
+        """
+        return makeSteps(self.procList, self.ipParamVal)
     
     #-------------------------------------------------------------------
 
@@ -1104,34 +1251,218 @@ class ImgProcsFrame(wx.Frame):
                           flagOkayBtn=True, flagCancelBtn=True)
         if dlg.ShowModal() == wx.ID_CANCEL: return
         
-        msg = "Processed files -----\n\n" # result message 
-        msg4log = "" # log message
-        
         ### get image file extension user wants to use 
         obj = wx.FindWindowByName("imgFormat_cho", self.panel["ui"])
         imgExt = obj.GetString(obj.GetSelection())
         if "original" in imgExt.lower(): imgExt = ""
-       
-        for i, fp in enumerate(self.fileList):
-        # go through each file
-            img = np.array(Image.open(fp)) # open image
-            img = self.procImg(img) # process
-            if imgExt != "":
-            # if there's a specific image format user chose
-                ### change file extension
-                ext = "." + fp.split(".")[-1]
-                if ext != imgExt: fp = fp.replace(ext, imgExt) 
-            Image.fromarray(img).save(fp) # save image
-            pl = str(self.procList)
-            pl = pl.strip("[]").replace(", ","/").replace("'","")
-            msg4log += "%s, %s, %s\n"%(get_time_stamp(), fp, pl)
-            msg += "%s\n\n"%(fp)
-
-        writeFile(self.logFile, msg4log) # logging results
+        obj = wx.FindWindowByName("nWorkers_spin", self.panel["ui"])
+        nWorkers = obj.GetValue() # number of worker processes
+        obj = wx.FindWindowByName("skipUnchanged_chk", self.panel["ui"])
+        flagSkip = obj.GetValue() # skip files with up-to-date output
+        obj = wx.FindWindowByName("resume_chk", self.panel["ui"])
+        flagResume = obj.GetValue() # skip files done in the last run
+        obj = wx.FindWindowByName("profile_chk", self.panel["ui"])
+        profileFP = self.profileFile if obj.GetValue() else ''
+
+        ### disable the run button until all files are processed 
+        btn = wx.FindWindowByName("run_btn", self.panel["ui"])
+        btn.Disable()
+        self.statusbar.SetStatusText("Processing %i files..."%(
+                                                        len(self.fileList)))
+        ### run batch in a thread and poll its progress with a timer
+        self.q2m = Queue()
+        self.batchStop = Event()
+        args = (self.fileList.copy(), self.getSteps(), imgExt, nWorkers, 
+                flagSkip, flagResume, profileFP, self.batchStop)
+        self.th = Thread(target=self.runBatchThread, args=args)
+        self.th.start()
+        self.timer["procTimer"] = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onProcTimer, self.timer["procTimer"])
+        self.timer["procTimer"].Start(100)
+
+    #-------------------------------------------------------------------
+
+    def runBatchThread(self, fileList, steps, imgExt, nWorkers, flagSkip,
+                       flagResume, profileFP, stopEvent):
+        """ Run batch processing (executed in a thread, not touching
+        any wxPython widgets).
+
+        Args:
+            fileList (PathIndex): List of image files to process.
+            steps (list): List of (process name, parameter list) tuples.
+            imgExt (str): Image file extension for saving.
+            nWorkers (int): Number of worker processes.
+            flagSkip (bool): Whether to skip files with up-to-date output.
+            flagResume (bool): Whether to skip files recorded as done
+              in the journal of the last run.
+            profileFP (str): File path to save the profile of processes.
+              Empty string for no profiling.
+            stopEvent (threading.Event): Set to stop processing
+              (e.g.: closing the frame).
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.runBatchThread()")
+
+        try:
+            summary = runBatch(fileList, steps, imgExt, self.logFile, 
+                               self.maskFP, nWorkers, self.q2m, flagSkip,
+                               self.journalFile, flagResume, profileFP,
+                               stopEvent=stopEvent)
+        except Exception as e:
+            summary = dict(nFiles=len(fileList), nDone=0, nErr=1, 
+                           nSkipped=0, sec=0.0, outBytes=0, 
+                           errs=[('', str(e))])
+        self.q2m.put(('done', summary))
+
+    #-------------------------------------------------------------------
+
+    def onProcTimer(self, event):
+        """ Receive progress of batch processing from the queue, 
+        and show the results when finished.
+
+        Args: event (wx.Event)
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.onProcTimer()")
+
+        while True:
+            rData = receiveDataFromQueue(self.q2m, self.logFile)
+            if rData is None: return
+            if rData[0] == 'progress':
+                nDone, nFiles = rData[1:3]
+                self.statusbar.SetStatusText("Processing... %i/%i"%(nDone,
+                                                                    nFiles))
+            elif rData[0] == 'done':
+                break 
+
+        ### batch finished
+        self.timer["procTimer"].Stop()
+        self.timer["procTimer"] = None
+        self.th.join()
+        btn = wx.FindWindowByName("run_btn", self.panel["ui"])
+        btn.Enable()
+        summary = rData[1]
+        sbMsg = "%i files processed, %i failed, %i skipped."%(
+                    summary["nDone"], summary["nErr"], summary["nSkipped"])
+        self.statusbar.SetStatusText(sbMsg)
+        summary["errs"] = summary["errs"][:10] # show only a few errors
+        msg = summaryText(summary, self.logFile) # result message
+        if "profile" in summary:
+            msg += "Profile is saved in %s\n"%(self.profileFile)
         wx.MessageBox(msg, 'Results', wx.OK)
 
     #-------------------------------------------------------------------
 
+    def startWatching(self):
+        """ Start watching the selected folders, processing image files
+        as they arrive.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.startWatching()")
+
+        if len(self.selectedFolders) == 0:
+            self.statusbar.SetStatusText("Please select folders to watch.")
+            return
+        obj = wx.FindWindowByName("imgFormat_cho", self.panel["ui"])
+        imgExt = obj.GetString(obj.GetSelection())
+        if "original" in imgExt.lower(): imgExt = ""
+        obj = wx.FindWindowByName("nWorkers_spin", self.panel["ui"])
+        nWorkers = obj.GetValue() # number of worker processes
+
+        btn = wx.FindWindowByName("watch_btn", self.panel["ui"])
+        btn.SetLabel("Stop watching folders")
+        self.statusbar.SetStatusText("Watching folders...")
+        ### watch in a thread and poll its results with a timer
+        self.watchStop = Event()
+        self.q2w = Queue()
+        args = (list(self.selectedFolders), self.getSteps(), imgExt, 
+                self.logFile, self.maskFP, nWorkers, self.flagSubFolders,
+                self.q2w, self.watchStop)
+        self.watchTh = Thread(target=self.watchThread, args=args)
+        self.watchTh.start()
+        self.timer["watchTimer"] = wx.Timer(self)
+        self.Bind(wx.EVT_TIMER, self.onWatchTimer, self.timer["watchTimer"])
+        self.timer["watchTimer"].Start(500)
+
+    #-------------------------------------------------------------------
+
+    def watchThread(self, *args):
+        """ Watch folders with watchFolders (executed in a thread, 
+        not touching any wxPython widgets).
+
+        Args:
+            args (tuple): Arguments of watchFolders.
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.watchThread()")
+
+        q = args[7]
+        try:
+            summary = watchFolders(*args)
+        except Exception as e:
+            summary = dict(nFiles=0, nDone=0, nErr=1, nSkipped=0, sec=0.0,
+                           outBytes=0, errs=[('', str(e))])
+        q.put(('done', summary))
+
+    #-------------------------------------------------------------------
+
+    def stopWatching(self):
+        """ Stop watching folders. Files, which arrived already, 
+        are finished in the watching thread.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.stopWatching()")
+
+        if self.watchStop is not None: self.watchStop.set()
+        btn = wx.FindWindowByName("watch_btn", self.panel["ui"])
+        btn.Disable() # until the watching thread finishes
+
+    #-------------------------------------------------------------------
+
+    def onWatchTimer(self, event):
+        """ Receive results of watching folders from the queue.
+
+        Args: event (wx.Event)
+
+        Returns: None
+        """
+        if DEBUG: print("ImgProcsFrame.onWatchTimer()")
+
+        while True:
+            rData = receiveDataFromQueue(self.q2w, self.logFile)
+            if rData is None: return
+            if rData[0] == 'progress':
+                nDone, nFiles, rslt = rData[1:4]
+                self.statusbar.SetStatusText(
+                    "Watching folders... %i/%i new files processed (%s)"%(
+                                        nDone, nFiles, path.basename(rslt[0])))
+            elif rData[0] == 'done':
+                break
+
+        ### watching stopped
+        self.timer["watchTimer"].Stop()
+        self.timer["watchTimer"] = None
+        self.watchTh.join()
+        self.watchStop = None
+        btn = wx.FindWindowByName("watch_btn", self.panel["ui"])
+        btn.SetLabel("Start watching folders for new files")
+        btn.Enable()
+        summary = rData[1]
+        self.statusbar.SetStatusText(
+                "Stopped watching; %i files processed, %i failed."%(
+                                            summary["nDone"], summary["nErr"]))
+
+    #-------------------------------------------------------------------
+
     def onClose(self, event):
         """ Close this frame.
 
@@ -1144,12 +1475,55 @@ class ImgProcsFrame(wx.Frame):
         for k in self.timer.keys():
             if isinstance(self.timer[k], wx.Timer):
                 self.timer[k].Stop()
+        self.previewWorker.stop()
+        ### stop threads, which use queues and the file index of this frame
+        if self.th is not None and self.th.is_alive():
+            # finish the file in processing; the rest can be resumed
+            self.batchStop.set()
+            self.th.join(CLOSE_WAIT_SEC)
+        if self.scanTh is not None:
+            self.scanStop.set()
+            self.scanTh.join(CLOSE_WAIT_SEC)
+        if self.watchStop is not None: 
+            self.watchStop.set()
+            self.watchTh.join(CLOSE_WAIT_SEC)
         self.Destroy()
 
     #-------------------------------------------------------------------
 
 #=======================================================================
 
+class FileListCtrl(wx.ListCtrl):
+    """ Virtual list control showing files in a PathIndex.
+    Only visible rows are requested (OnGetItemText), 
+      so that millions of files can be listed quickly.
+
+    Args:
+        parent (wx.Panel): Parent panel.
+        fileList (PathIndex): File paths to show. After changing it, 
+          call SetItemCount with its new length.
+        name (str): Name of the widget.
+        size (tuple): Size of the widget.
+    """
+    def __init__(self, parent, fileList, name, size):
+        if DEBUG: print("FileListCtrl.__init__()")
+
+        wx.ListCtrl.__init__(self, 
+                             parent, 
+                             -1, 
+                             name=name, 
+                             size=size,
+                             style=wx.LC_REPORT|wx.LC_VIRTUAL|wx.LC_SINGLE_SEL)
+        self.fileList = fileList
+        self.SetItemCount(len(fileList))
+
+    #-------------------------------------------------------------------
+
+    def OnGetItemText(self, item, col):
+        return self.fileList[item]
+
+#=======================================================================
+
 class ImgProcsApp(wx.App):
     """ Initializing ImgProcs app with ImgProcsFrame.
 
@@ -0,0 +1,147 @@
+# coding: UTF-8
+
+"""
+Tests of batchStore with runBatch; skipping files with up-to-date
+  output (ResultCache) and resuming stopped runs (BatchJournal).
+"""
+
+import os
+from threading import Event
+from os import path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from batchStore import ResultCache, BatchJournal, INDEX_FN, fileSig
+from batchStore import readJournal
+from imgProcEngine import runBatch, pipelineSig
+
+STEPS = [('flip', [1])]
+
+#-----------------------------------------------------------------------
+
+def makeImgFiles(dp, n=4):
+    fileList = []
+    for i in range(n):
+        fp = str(dp / ("img%i.png"%(i)))
+        Image.fromarray(np.full((8, 10, 3), i*30, np.uint8)).save(fp)
+        fileList.append(fp)
+    return fileList
+
+#-----------------------------------------------------------------------
+
+def test_skipUnchanged(tmp_path):
+    fileList = makeImgFiles(tmp_path)
+    kw = dict(imgExt='.bmp', logFile='', flagSkip=True)
+    summary = runBatch(fileList, STEPS, **kw)
+    assert summary["nDone"] == 4 and summary["nSkipped"] == 0
+    assert path.isfile(str(tmp_path / INDEX_FN))
+    summary = runBatch(fileList, STEPS, **kw)
+    assert summary["nDone"] == 0 and summary["nSkipped"] == 4
+
+def test_skipChanged(tmp_path):
+    fileList = makeImgFiles(tmp_path)
+    kw = dict(imgExt='.bmp', logFile='', flagSkip=True)
+    runBatch(fileList, STEPS, **kw)
+    # changed source
+    st = os.stat(fileList[0])
+    os.utime(fileList[0], ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    # removed output
+    os.remove(path.splitext(fileList[1])[0] + ".bmp")
+    summary = runBatch(fileList, STEPS, **kw)
+    assert summary["nDone"] == 2 and summary["nSkipped"] == 2
+    # other parameters and other output format
+    summary = runBatch(fileList, [('flip', [0])], **kw)
+    assert summary["nDone"] == 4
+    summary = runBatch(fileList, [('flip', [0])], '.png', '', flagSkip=True)
+    assert summary["nDone"] == 4
+
+def test_skipInPlace(tmp_path):
+    fileList = makeImgFiles(tmp_path, 2)
+    # output replaces its source
+    summary = runBatch(fileList, STEPS, '', '', flagSkip=True)
+    assert summary["nDone"] == 2
+    summary = runBatch(fileList, STEPS, '', '', flagSkip=True)
+    assert summary["nSkipped"] == 2
+
+def test_resultCache(tmp_path):
+    fp, = makeImgFiles(tmp_path, 1)
+    oFP = str(tmp_path / "img0.bmp")
+    sig = pipelineSig(STEPS, '.bmp')
+    rCache = ResultCache()
+    assert not rCache.isDone(fp, oFP, sig)
+    Image.open(fp).save(oFP)
+    rCache.record(fp, oFP, sig, fileSig(fp))
+    rCache.save()
+    rCache = ResultCache() # loaded from the index file
+    assert rCache.isDone(fp, oFP, sig)
+    assert not rCache.isDone(fp, oFP, pipelineSig(STEPS, '.png'))
+
+#-----------------------------------------------------------------------
+
+class StopAfter:
+    """ Progress queue of runBatch, stopping the run after n files. """
+    def __init__(self, n):
+        self.n = n
+        self.fps = []
+
+    def put(self, item):
+        if len(self.fps) == self.n: raise KeyboardInterrupt
+        self.fps.append(item[3][0])
+
+#-----------------------------------------------------------------------
+
+def test_resume(tmp_path):
+    fileList = makeImgFiles(tmp_path, 6)
+    journalFP = str(tmp_path / "journal.jsonl")
+    kw = dict(imgExt='.bmp', logFile='', journalFP=journalFP, nIOThreads=0)
+    q = StopAfter(2)
+    with pytest.raises(KeyboardInterrupt):
+        runBatch(fileList, STEPS, q=q, **kw)
+    assert len(q.fps) == 2
+    done = readJournal(journalFP, pipelineSig(STEPS, '.bmp'))
+    assert set(q.fps) <= done
+    q = StopAfter(100)
+    summary = runBatch(fileList, STEPS, q=q, flagResume=True, **kw)
+    assert summary["nSkipped"] == len(done)
+    assert summary["nDone"] == 6 - len(done)
+    assert set(q.fps) == set(fileList) - done
+    # resuming again skips all files
+    summary = runBatch(fileList, STEPS, flagResume=True, **kw)
+    assert summary["nSkipped"] == 6
+    # another pipeline does not skip files of this one
+    summary = runBatch(fileList, [('flip', [0])], flagResume=True, **kw)
+    assert summary["nDone"] == 6
+    # without resume, the journal is started anew
+    summary = runBatch(fileList, STEPS, **kw)
+    assert summary["nDone"] == 6
+
+def test_journal(tmp_path):
+    journalFP = str(tmp_path / "journal.jsonl")
+    journal = BatchJournal(journalFP, "sig1")
+    journal.record("a.png", "a.bmp")
+    journal.record("b.png", None, "cannot identify image file")
+    journal.close()
+    with open(journalFP, 'a') as f: f.write('{"src": "c.png", "ou') # crash
+    assert readJournal(journalFP, "sig1") == {"a.png"}
+    journal = BatchJournal(journalFP, "sig2", flagResume=True)
+    assert journal.done == set()
+    journal.record("b.png", "b.bmp")
+    journal.close()
+    assert readJournal(journalFP, "sig1") == {"a.png"}
+    assert readJournal(journalFP, "sig2") == {"b.png"}
+
+def test_stopEvent(tmp_path):
+    fileList = makeImgFiles(tmp_path, 6)
+    journalFP = str(tmp_path / "journal.jsonl")
+    stopEvent = Event()
+    class StopQ:
+        def put(self, item): stopEvent.set() # stop after the first file
+    summary = runBatch(fileList, STEPS, '.bmp', '', journalFP=journalFP,
+                       q=StopQ(), stopEvent=stopEvent)
+    assert summary["stopped"] and summary["nDone"] == 1
+    summary = runBatch(fileList, STEPS, '.bmp', '', journalFP=journalFP,
+                       flagResume=True)
+    assert not summary["stopped"]
+    assert summary["nSkipped"] == 1 and summary["nDone"] == 5
@@ -0,0 +1,23 @@
+# coding: UTF-8
+
+"""
+Tests of benchmark.
+"""
+
+from time import sleep
+
+from benchmark import timeIt, benchSteps
+
+#-----------------------------------------------------------------------
+
+def test_setupNotTimed():
+    r = timeIt(lambda x: x, 3, lambda: sleep(0.05))
+    assert r["median"] < 0.01
+    r = timeIt(lambda: sleep(0.02), 2)
+    assert r["min"] >= 0.02
+
+def test_benchSteps():
+    rslts = benchSteps('op', 'flip', [('flip', [1])], [(64, 48)],
+                       ['RGB', 'L'], 'mask.png', 2)
+    assert len(rslts) == 2
+    assert all(["error" not in r and r["min"] >= 0 for r in rslts])
@@ -0,0 +1,119 @@
+# coding: UTF-8
+
+"""
+Tests of fileIndex.
+"""
+
+import os
+
+import pytest
+
+from fileIndex import DirIndex, PathIndex, listImgFiles
+import fileIndex
+
+#-----------------------------------------------------------------------
+
+def makeFiles(dp, names):
+    for fn in names:
+        fp = dp / fn
+        fp.parent.mkdir(parents=True, exist_ok=True)
+        fp.write_bytes(b"x" * (len(fn) * 1000))
+
+#-----------------------------------------------------------------------
+
+def test_findEqualsWalk(tmp_path):
+    makeFiles(tmp_path, ["b.jpg", "a.png", "c.txt", ".h.png", "s/d.jpg",
+                         "s/t/e.png", ".hidden/f.png"])
+    di = DirIndex(['jpg', 'png'])
+    for pattern in ["*", "*.png", "re:^[ab]", "size>5k", "*.jpg; size<5k"]:
+        for recursive in [False, True]:
+            found = sum(di.find([str(tmp_path)], pattern, recursive), [])
+            assert found == listImgFiles([str(tmp_path)], pattern,
+                                         ['jpg', 'png'], recursive)
+    found = sum(di.find([str(tmp_path)], "*", True), [])
+    assert [os.path.basename(fp) for fp in found] == \
+             ["a.png", "b.jpg", "d.jpg", "e.png"]
+
+class GoneEntry:
+    """ Directory entry of a file removed while scanning. """
+    def __init__(self, e): self.name, self.path = e.name, e.path
+    def is_dir(self): raise FileNotFoundError(self.path)
+
+def test_walkEntryRemoved(tmp_path, monkeypatch):
+    makeFiles(tmp_path, ["a.png", "b.png", "s/c.png"])
+    realScandir = os.scandir
+    def scandir(dp):
+        it = realScandir(dp)
+        entries = [GoneEntry(e) if e.name == "a.png" else e for e in it]
+        it.close()
+        return _EntryIter(entries)
+    monkeypatch.setattr(fileIndex, "scandir", scandir)
+    found = listImgFiles([str(tmp_path)], "*", ['png'], True)
+    assert [os.path.basename(fp) for fp in found] == ["b.png", "c.png"]
+    di = DirIndex(['png'])
+    found = sum(di.find([str(tmp_path)], "*", True), [])
+    assert [os.path.basename(fp) for fp in found] == ["b.png", "c.png"]
+
+class _EntryIter(list):
+    """ List of entries used as the context manager of scandir. """
+    def __enter__(self): return self
+    def __exit__(self, *args): return False
+
+#-----------------------------------------------------------------------
+
+def test_lazyStat(tmp_path, monkeypatch):
+    makeFiles(tmp_path, ["a.png", "bb.png"]) # 5000 and 6000 bytes
+    nStat = []
+    stat = fileIndex.stat
+    def countStat(p):
+        nStat.append(p)
+        return stat(p)
+    monkeypatch.setattr(fileIndex, "stat", countStat)
+    di = DirIndex(['png'])
+    assert len(sum(di.find([str(tmp_path)], "*"), [])) == 2
+    assert nStat == [str(tmp_path)] # only the folder
+    assert len(sum(di.find([str(tmp_path)], "size>1k"), [])) == 2
+    assert len(nStat) == 3 # and the files, once
+    assert len(sum(di.find([str(tmp_path)], "size>5.5k"), [])) == 1
+    assert len(nStat) == 3
+
+def test_checkAndInvalidate(tmp_path, monkeypatch):
+    monkeypatch.setattr(fileIndex, "MTIME_TICK_NS", 0)
+    makeFiles(tmp_path, ["a.png"])
+    di = DirIndex(['png'])
+    assert len(sum(di.find([str(tmp_path)]), [])) == 1
+    makeFiles(tmp_path, ["b.png"])
+    # pushed back, as if the folder changed a while after the scan
+    dp = str(tmp_path)
+    st = os.stat(dp)
+    os.utime(dp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    assert len(sum(di.find([dp]), [])) == 1 # from the index
+    assert len(sum(di.find([dp], flagCheck=True), [])) == 2
+    makeFiles(tmp_path, ["c.png"])
+    di.invalidate([dp])
+    assert len(sum(di.find([dp]), [])) == 3
+
+def test_recentFolderRescanned(tmp_path):
+    dp = str(tmp_path)
+    makeFiles(tmp_path, ["a.png"])
+    di = DirIndex(['png'])
+    assert len(sum(di.find([dp]), [])) == 1
+    # a new file in the same tick of the folder's modification time
+    st = os.stat(dp)
+    makeFiles(tmp_path, ["b.png"])
+    os.utime(dp, ns=(st.st_atime_ns, st.st_mtime_ns))
+    assert len(sum(di.find([dp], flagCheck=True), [])) == 2
+
+def test_pathIndex():
+    fps = ["/a/x.png", "/a/y.png", "/b/z.png", "/a/w.png", "rel/é.jpg",
+           "/b/z2.png"]
+    pi = PathIndex(fps[:2])
+    pi.extend(fps[2:])
+    assert len(pi) == len(fps)
+    assert list(pi) == fps
+    assert [pi[i] for i in range(-len(fps), 0)] == fps
+    assert len(pi.runDirs) == 5 # folders are stored per run of files
+    pc = pi.copy()
+    pi.clear()
+    assert len(pi) == 0 and list(pc) == fps
+    with pytest.raises(IndexError): pc[len(fps)]
@@ -0,0 +1,136 @@
+# coding: UTF-8
+
+"""
+Tests of imgProcEngine; compiled (fused) plans against processing
+  each step on its own, and against the original per-step processing.
+"""
+
+import os
+from os import path
+from queue import Queue
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import ROOT
+from imgProcEngine import compilePlan, procImg, PreviewWorker
+
+MASK_FP = path.join(ROOT, "mask.png")
+
+#-----------------------------------------------------------------------
+
+def makeImg(h=60, w=80, nCh=3):
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 256, (h, w, nCh), dtype=np.uint8)
+
+#-----------------------------------------------------------------------
+
+def procEachStep(img, steps):
+    """ Process each step with its own (unfused) plan. """
+    for step in steps: img = compilePlan([step], MASK_FP).run(img)
+    return img
+
+#-----------------------------------------------------------------------
+
+def refProcImg(img, steps):
+    """ Processing of each step, as in the if/elif chain
+    of ImgProcsFrame.procImg before plans were compiled.
+    """
+    for pn, params in steps:
+        if pn == 'crop':
+            x, y, w, h = params
+            img = img[y:y+h,x:x+w]
+        elif pn == 'crop_ratio':
+            x, y, w, h = params
+            x = int(x * img.shape[1])
+            y = int(y * img.shape[0])
+            w = int(w * img.shape[1])
+            h = int(h * img.shape[0])
+            img = img[y:y+h,x:x+w]
+        elif pn == 'flip':
+            direction = params[0]
+            img = Image.fromarray(img)
+            if direction == 2:
+                img = img.transpose(0)
+                img = img.transpose(1)
+            else:
+                img = img.transpose(direction)
+            img = np.array(img)
+        elif pn in ['brighten', 'darken']:
+            value = min(params[0], 255)
+            if pn == 'darken': value = -value
+            img = np.clip(img.astype(np.int16) + value, 0, 255)
+            img = img.astype(np.uint8)
+        elif pn == 'invert':
+            img = 255 - img
+        elif pn == 'resize':
+            img = np.array(Image.fromarray(img).resize(tuple(params)))
+    return img
+
+#-----------------------------------------------------------------------
+
+@pytest.mark.parametrize("steps", [
+    [('crop', [5, 6, 40, 30]), ('flip', [1]),
+     ('crop_ratio', [0.1, 0.1, 0.5, 0.5]), ('flip', [2])],
+    [('flip', [0]), ('brighten', [30]), ('darken', [50]), ('invert', []),
+     ('brighten', [300])],
+    [('resize', [40, 30]), ('darken', [10]), ('brighten', [4])],
+                                  ])
+def test_planEqualsReference(steps):
+    img = makeImg()
+    plan = compilePlan(steps, MASK_FP)
+    assert len(plan.ops) < len(steps) # some steps were fused
+    assert np.array_equal(plan.run(img.copy()), refProcImg(img, steps))
+
+@pytest.mark.parametrize("steps", [
+    [('crop', [5, 6, 40, 30]), ('flip', [1]),
+     ('crop_ratio', [0.1, 0.1, 0.5, 0.5]), ('flip', [2])],
+    [('brighten', [30]), ('darken', [50]), ('gamma', [1.7]),
+     ('contrast', [1.3]), ('invert', []),
+     ('levels', [10, 200, 0.8, 5, 250]), ('threshold', [100])],
+    [('masking', ['#ff0000']), ('greyscale', [0]), ('brighten', [20])],
+    [('resize', [40, 30]), ('rotate', [30, 1]), ('flip', [0])],
+    [('greyscale', [1]), ('gamma', [0.5]), ('crop', [0, 0, 20, 20])],
+                                  ])
+def test_fusedEqualsEachStep(steps):
+    img = makeImg()
+    fused = procImg(img.copy(), steps, MASK_FP)
+    assert np.array_equal(fused, procEachStep(img.copy(), steps))
+
+def test_fusedRGBA():
+    img = makeImg(nCh=4)
+    steps = [('brighten', [40]), ('invert', []), ('flip', [1])]
+    fused = procImg(img.copy(), steps, MASK_FP)
+    assert np.array_equal(fused, procEachStep(img.copy(), steps))
+    steps.append(('masking', ['#00ff00']))
+    fused = procImg(img.copy(), steps, MASK_FP)
+    assert np.array_equal(fused, procEachStep(img.copy(), steps))
+
+def test_planSteps():
+    steps = [('flip', [0]), ('crop', [0, 0, 10, 10]), ('brighten', [5]),
+             ('darken', [5]), ('text', ['a', 0.0, 0.0, 12, '#000000'])]
+    plan = compilePlan(steps, MASK_FP)
+    assert [type(op).__name__ for op in plan.ops] == \
+             ['ViewOp', 'PointOp', 'TextOp']
+    assert plan.steps == steps
+
+def test_previewMaskEdited(tmp_path):
+    fp = str(tmp_path / "img.png")
+    Image.fromarray(makeImg()).save(fp)
+    maskFP = str(tmp_path / "mask.png")
+    rslts = Queue()
+    pw = PreviewWorker(lambda *args: rslts.put(args))
+    pw.start()
+    try:
+        outs = []
+        for i, val in enumerate([0, 255]):
+            Image.new('L', (40, 30), val).save(maskFP)
+            os.utime(maskFP, (1e9+i, 1e9+i)) # mtime changed on edit
+            pw.submit(fp, [('masking', ['#00ff00'])], (80, 60), maskFP)
+            reqId, rFP, iImg, oImg, err = rslts.get(timeout=10)
+            assert err == ''
+            outs.append(oImg)
+        assert not np.array_equal(outs[0], outs[1])
+    finally:
+        pw.stop()
@@ -0,0 +1,162 @@
+# coding: UTF-8
+
+"""
+Tests of ipServer; a server on a free port of localhost.
+"""
+
+import json, socket
+from io import BytesIO
+from threading import Thread
+from http.client import HTTPConnection
+from urllib.parse import quote
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import ipServer
+from ipServer import ProcService, makeServer
+
+#-----------------------------------------------------------------------
+
+def pngBytes(h=24, w=32):
+    arr = np.arange(h*w*3, dtype=np.uint8).reshape((h, w, 3))
+    buf = BytesIO()
+    Image.fromarray(arr).save(buf, format='PNG')
+    return buf.getvalue(), arr
+
+#-----------------------------------------------------------------------
+
+@pytest.fixture
+def server():
+    service = ProcService(0, maxConcurrent=1, busyWaitSec=0.1)
+    srv = makeServer(service, port=0)
+    th = Thread(target=srv.serve_forever, daemon=True)
+    th.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+    service.close()
+    th.join()
+
+#-----------------------------------------------------------------------
+
+def request(srv, method, url, body=None, headers={}):
+    conn = HTTPConnection("127.0.0.1", srv.server_address[1], timeout=10)
+    conn.request(method, url, body, headers)
+    res = conn.getresponse()
+    data = res.read()
+    conn.close()
+    return res.status, data
+
+#-----------------------------------------------------------------------
+
+def processURL(pipeline, fmt='.png'):
+    return "/process?format=%s&pipeline=%s"%(fmt, quote(json.dumps(pipeline)))
+
+#-----------------------------------------------------------------------
+
+def test_process(server):
+    data, arr = pngBytes()
+    code, oData = request(server, "POST", processURL([["flip", [1]]]), data)
+    assert code == 200
+    oArr = np.asarray(Image.open(BytesIO(oData)))
+    assert np.array_equal(oArr, arr[::-1])
+
+def test_pipelineHeader(server):
+    data, arr = pngBytes()
+    code, oData = request(server, "POST", "/process", data,
+                          {"X-Pipeline": '[["flip", [0]]]'})
+    assert code == 200
+    oArr = np.asarray(Image.open(BytesIO(oData)))
+    assert np.array_equal(oArr, arr[:, ::-1])
+
+@pytest.mark.parametrize("url", [
+                                 "/process?pipeline=%5Bnot-json",
+                                 processURL([["flip", [1], "extra"]]),
+                                 processURL([["no_such_process", []]]),
+                                 "/process",
+                                ])
+def test_badRequest(server, url):
+    data, arr = pngBytes()
+    code, oData = request(server, "POST", url, data)
+    assert code == 400
+    assert "error" in json.loads(oData)
+
+def test_badImage(server):
+    code, oData = request(server, "POST", processURL([["flip", [1]]]),
+                          b"not an image")
+    assert code == 422
+
+def test_badContentLength(server):
+    for url in ["/process", "/unknown"]:
+        with socket.create_connection(server.server_address, 10) as s:
+            s.sendall(("POST %s HTTP/1.1\r\nHost: x\r\n"%(url) +
+                       "Content-Length: abc\r\n\r\n").encode("ascii"))
+            res = s.recv(4096).decode("latin-1")
+        assert res.startswith("HTTP/1.1 400")
+
+def test_unknownPath(server):
+    code, oData = request(server, "POST", "/unknown", b"abc")
+    assert code == 404
+    code, oData = request(server, "GET", "/unknown")
+    assert code == 404
+    for i in range(3):
+        request(server, "POST", "/unknown%i"%(i), b"abc")
+    code, oData = request(server, "GET", "/metrics")
+    eps = json.loads(oData)["endpoints"]
+    assert eps["other"]["n"] >= 4 and eps["other"]["nErr"] == eps["other"]["n"]
+    assert not any([name.startswith("/unknown") for name in eps])
+
+def test_tooLarge(server, monkeypatch):
+    monkeypatch.setattr(ipServer, "MAX_BODY", 100)
+    data, arr = pngBytes()
+    code, oData = request(server, "POST", processURL([["flip", [1]]]), data)
+    assert code == 413
+
+def test_busy(server):
+    assert server.service.acquire() # take the only slot
+    try:
+        data, arr = pngBytes()
+        code, oData = request(server, "POST", processURL([["flip", [1]]]),
+                              data)
+    finally:
+        server.service.release()
+    assert code == 503
+
+def test_batch(server):
+    data, arr = pngBytes()
+    body = json.dumps(dict(pipeline=[["flip", [1]]], format=".png",
+                           images=[ipServer.base64.b64encode(x).decode()
+                                   for x in [data, b"broken"]]))
+    code, oData = request(server, "POST", "/batch", body.encode("utf-8"))
+    assert code == 200
+    rslt = json.loads(oData)
+    assert rslt["errors"][0] == '' and rslt["errors"][1] != ''
+    img = Image.open(BytesIO(ipServer.base64.b64decode(rslt["images"][0])))
+    assert np.array_equal(np.asarray(img), arr[::-1])
+    assert rslt["images"][1] is None
+
+def test_metrics(server):
+    data, arr = pngBytes()
+    for i in range(3):
+        request(server, "POST", processURL([["flip", [1]]]), data)
+    request(server, "POST", "/process", data) # without pipeline
+    code, oData = request(server, "GET", "/metrics")
+    assert code == 200
+    m = json.loads(oData)
+    st = m["endpoints"]["/process"]
+    assert st["n"] == 4 and st["nErr"] == 1
+    assert 0 < st["p50MS"] <= st["p99MS"] <= st["maxMS"]
+    assert m["inFlight"] == 0
+
+def test_workerPool():
+    service = ProcService(1)
+    try:
+        data, arr = pngBytes()
+        oData, fmt, err = service.process(data, [('flip', [1])], '.png')
+        assert err == '' and fmt == 'PNG'
+        oArr = np.asarray(Image.open(BytesIO(oData)))
+        assert np.array_equal(oArr, arr[::-1])
+    finally:
+        service.close()
@@ -0,0 +1,70 @@
+# coding: UTF-8
+
+"""
+Tests of jobScheduler.
+"""
+
+from time import time
+from types import SimpleNamespace
+
+import numpy as np
+from PIL import Image
+
+from jobScheduler import BatchJob, JobScheduler
+
+#-----------------------------------------------------------------------
+
+def chooseJob(jobs, agingSec):
+    """ JobScheduler.nextJob with the given jobs, without a pool. """
+    sched = SimpleNamespace(jobs=dict([(job.jobId, job) for job in jobs]),
+                            agingSec=agingSec)
+    return JobScheduler.nextJob(sched)
+
+#-----------------------------------------------------------------------
+
+def test_priority():
+    low = BatchJob(1, ["a.png"] * 4, [], priority=0)
+    high = BatchJob(2, ["b.png"] * 4, [], priority=5)
+    assert chooseJob([low, high], 30.0) is high
+    high.nInFlight = 3
+    assert chooseJob([low, high], 30.0) is high
+    high.state = 'paused'
+    assert chooseJob([low, high], 30.0) is low
+
+def test_samePriority():
+    job1 = BatchJob(1, ["a.png"] * 4, [])
+    job2 = BatchJob(2, ["b.png"] * 4, [])
+    assert chooseJob([job1, job2], 30.0) is job1
+    job1.nInFlight = 1 # the one with fewer files in processing
+    assert chooseJob([job1, job2], 30.0) is job2
+
+def test_aging():
+    low = BatchJob(1, ["a.png"] * 4, [], priority=0)
+    high = BatchJob(2, ["b.png"] * 4, [], priority=2)
+    now = time()
+    high.tLastDispatch = now # dispatched all the time
+    low.tLastDispatch = now - 61.0 # waited for 61 s
+    assert low.effPriority(now, 30.0) == 2
+    assert chooseJob([low, high], 30.0) is low
+    assert chooseJob([low, high], 0) is high # no aging
+    low.tLastDispatch = now - 59.0
+    assert chooseJob([low, high], 30.0) is high
+
+def test_jobs(tmp_path):
+    fileList = []
+    for i in range(6):
+        fp = str(tmp_path / ("img%i.png"%(i)))
+        Image.fromarray(np.full((8, 10, 3), i*30, np.uint8)).save(fp)
+        fileList.append(fp)
+    sched = JobScheduler(2, logFile='')
+    try:
+        jId1 = sched.submit(fileList[:3], [('flip', [1])], '.bmp')
+        jId2 = sched.submit(fileList[3:], [('flip', [0])], '.bmp',
+                            priority=10)
+        assert sched.wait(timeout=60)
+        for jId in [jId1, jId2]:
+            st = sched.status(jId)
+            assert st["state"] == 'done' and st["nDone"] == 3
+    finally:
+        sched.close()
+    assert (tmp_path / "img0.bmp").exists()
@@ -0,0 +1,73 @@
+# coding: UTF-8
+
+"""
+Tests of procProfiler.
+"""
+
+import tracemalloc
+from threading import Thread, Event
+from time import perf_counter
+
+import numpy as np
+
+from procProfiler import ProcProfiler, profileTable, stopMemTrace
+
+#-----------------------------------------------------------------------
+
+def busy(stopEvent):
+    """ Keep a CPU busy in another thread. """
+    while not stopEvent.is_set(): sum(range(1000))
+
+#-----------------------------------------------------------------------
+
+def test_cpuOfThread():
+    stopEvent = Event()
+    th = Thread(target=busy, args=(stopEvent,))
+    th.start()
+    try:
+        prof = ProcProfiler()
+        t = prof.start()
+        t0 = perf_counter()
+        while perf_counter() - t0 < 0.2: stopEvent.wait(0.01) # idle
+        prof.stop('idle', t)
+    finally:
+        stopEvent.set()
+        th.join()
+        stopMemTrace()
+    r = prof.report()['idle']
+    assert r["totalSec"] >= 0.2
+    assert r["cpuSec"] < 0.1 # the busy thread is not charged
+
+def test_allocArray():
+    prof = ProcProfiler()
+    for i in range(3):
+        t = prof.start()
+        arr = np.zeros((1000, 1000, 3), np.uint8) + 1 # 3 MB, twice
+        del arr
+        prof.stop('alloc', t, 3000000)
+    t = prof.start()
+    prof.stop('none', t)
+    assert tracemalloc.is_tracing()
+    stopMemTrace()
+    assert not tracemalloc.is_tracing()
+    report = prof.report()
+    assert report['alloc']["n"] == 3
+    assert report['alloc']["peakAllocMB"] >= 3.0
+    assert report['alloc']["meanAllocMB"] >= 3.0
+    assert report['none']["peakAllocMB"] < 0.1
+    assert 'alloc' in profileTable(report)
+
+def test_merge():
+    prof1 = ProcProfiler()
+    prof1.add('flip', 0.01, 0.01, 100, 1000)
+    prof2 = ProcProfiler()
+    prof2.add('flip', 0.03, 0.02, 300, 500)
+    prof2.add('(decode)', 0.001, 0.001)
+    prof1.merge(prof2.stats)
+    report = prof1.report()
+    assert report['flip']["n"] == 2
+    assert abs(report['flip']["totalSec"] - 0.04) < 1e-9
+    assert report['flip']["peakAllocMB"] == 0.001
+    assert report['flip']["meanAllocMB"] == 0.00075
+    assert sum(report['flip']["histCounts"]) == 2
+    assert report['(decode)']["n"] == 1
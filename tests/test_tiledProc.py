@@ -0,0 +1,95 @@
+# coding: UTF-8
+
+"""
+Tests of tiledProc; processing in strips against the whole image.
+"""
+
+from os import path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from conftest import ROOT
+from imgProcEngine import compilePlan, procFile
+from tiledProc import isTileable, isLargeImg, procFileTiled
+
+MASK_FP = path.join(ROOT, "mask.png")
+STEPS = [
+         [('greyscale', [0]), ('brighten', [30]), ('flip', [1])],
+         [('crop_ratio', [0.1, 0.2, 0.5, 0.6]), ('gamma', [1.5]),
+          ('flip', [2])],
+         [('masking', ['#ff0000']), ('invert', []), ('crop', [3, 7, 40, 50])],
+         [('greyscale', [1]), ('levels', [10, 200, 1.2, 0, 255])],
+        ]
+
+#-----------------------------------------------------------------------
+
+def makeImgFile(fp, h=90, w=70, mode='RGB'):
+    rng = np.random.default_rng(1)
+    nCh = len(mode)
+    arr = rng.integers(0, 256, (h, w, nCh), dtype=np.uint8)
+    if nCh == 1: arr = arr[..., 0]
+    Image.fromarray(arr, mode).save(fp)
+
+#-----------------------------------------------------------------------
+
+@pytest.mark.parametrize("steps", STEPS)
+@pytest.mark.parametrize("ext", ['.tif', '.bmp', '.png'])
+def test_tiledEqualsWhole(tmp_path, steps, ext):
+    fp = str(tmp_path / ("src" + ext))
+    makeImgFile(fp)
+    plan = compilePlan(steps, MASK_FP)
+    assert isTileable(plan)
+    whole = plan.run(Image.open(fp))
+    oFP = str(tmp_path / ("out" + ext))
+    # strips of a few rows (not a divisor of the height)
+    procFileTiled(fp, oFP, plan, stripBytes=70*3*7)
+    tiled = np.asarray(Image.open(oFP))
+    assert np.array_equal(tiled, whole)
+
+def test_tiledRGBA(tmp_path):
+    fp = str(tmp_path / "src.tif")
+    makeImgFile(fp, mode='RGBA')
+    steps = STEPS[0] + [('masking', ['#00ff00'])]
+    plan = compilePlan(steps, MASK_FP)
+    oFP = str(tmp_path / "out.tif")
+    procFileTiled(fp, oFP, plan, stripBytes=70*4*11)
+    assert np.array_equal(np.asarray(Image.open(oFP)),
+                          plan.run(Image.open(fp)))
+
+def test_tiledInPlace(tmp_path):
+    fp = str(tmp_path / "src.tif")
+    makeImgFile(fp)
+    plan = compilePlan(STEPS[1], MASK_FP)
+    whole = plan.run(Image.open(fp))
+    procFileTiled(fp, fp, plan, stripBytes=1000) # output replaces source
+    assert np.array_equal(np.asarray(Image.open(fp)), whole)
+
+def test_procFileTiles(tmp_path, monkeypatch):
+    import tiledProc
+    monkeypatch.setattr(tiledProc, "TILE_MIN_PIXELS", 1000)
+    fp = str(tmp_path / "src.tif")
+    makeImgFile(fp)
+    assert isLargeImg(fp)
+    plan = compilePlan(STEPS[0], MASK_FP)
+    whole = plan.run(Image.open(fp))
+    oFP = procFile(fp, plan, '.png')
+    assert np.array_equal(np.asarray(Image.open(oFP)), whole)
+
+def test_paletteWhole(tmp_path, monkeypatch):
+    import tiledProc
+    monkeypatch.setattr(tiledProc, "TILE_MIN_PIXELS", 1000)
+    fp = str(tmp_path / "src.png")
+    makeImgFile(fp)
+    Image.open(fp).convert('P').save(fp)
+    assert not isLargeImg(fp) # palette indices aren't processed in strips
+    plan = compilePlan(STEPS[0], MASK_FP)
+    whole = plan.run(Image.open(fp))
+    assert whole.shape == (90, 70, 3)
+    oFP = procFile(fp, plan, '.png')
+    assert np.array_equal(np.asarray(Image.open(oFP)), whole)
+
+def test_notTileable():
+    assert not isTileable(compilePlan([('resize', [10, 10])], MASK_FP))
+    assert not isTileable(compilePlan([('text', ['a'])], MASK_FP))
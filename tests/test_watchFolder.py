@@ -0,0 +1,83 @@
+# coding: UTF-8
+
+"""
+Tests of watchFolder; FolderWatcher by scanning folders (poll mode).
+"""
+
+from time import time, sleep
+
+import pytest
+
+import fileIndex
+import watchFolder
+from watchFolder import FolderWatcher
+
+#-----------------------------------------------------------------------
+
+@pytest.fixture
+def fastPoll(monkeypatch):
+    monkeypatch.setattr(watchFolder, "WATCH_POLL_SEC", 0.05)
+
+#-----------------------------------------------------------------------
+
+def pollFor(watcher, sec=3.0):
+    """ Poll until some files are ready, for up to 'sec' seconds. """
+    t0 = time()
+    while time() - t0 < sec:
+        ready = watcher.poll(0.05)
+        if len(ready) > 0: return ready
+    return []
+
+#-----------------------------------------------------------------------
+
+def test_newFiles(tmp_path, fastPoll):
+    (tmp_path / "old.png").write_bytes(b"x" * 10)
+    (tmp_path / "sub").mkdir()
+    watcher = FolderWatcher([str(tmp_path)], ['png'], True, 0.1, True)
+    try:
+        assert watcher.inotify is None
+        (tmp_path / "sub" / "new.png").write_bytes(b"x" * 10)
+        (tmp_path / "new.txt").write_bytes(b"x" * 10)
+        assert pollFor(watcher) == [str(tmp_path / "sub" / "new.png")]
+        assert pollFor(watcher, 0.5) == [] # not returned again
+    finally:
+        watcher.close()
+
+def test_rescanOnlyChanged(tmp_path, fastPoll, monkeypatch):
+    for i in range(3): (tmp_path / ("d%i"%(i))).mkdir()
+    watcher = FolderWatcher([str(tmp_path)], ['png'], True, 0.1, True)
+    sleep(0.1)
+    # folders were just made; don't read them again for a recent mtime
+    monkeypatch.setattr(fileIndex, "MTIME_TICK_NS", 0)
+    scanned = []
+    scanDir = watcher.dirIndex.scanDir
+    def countScan(dp):
+        scanned.append(dp)
+        return scanDir(dp)
+    watcher.dirIndex.scanDir = countScan
+    try:
+        for i in range(5): watcher.poll(0.05)
+        assert scanned == [] # nothing changed
+        (tmp_path / "d1" / "a.png").write_bytes(b"x" * 10)
+        assert pollFor(watcher) == [str(tmp_path / "d1" / "a.png")]
+        assert set(scanned) == {str(tmp_path / "d1")}
+        # all folders are read again after WATCH_RESCAN_SEC
+        del scanned[:]
+        monkeypatch.setattr(watchFolder, "WATCH_RESCAN_SEC", 0.0)
+        sleep(0.1)
+        watcher.poll(0.05)
+        assert len(set(scanned)) == 4
+    finally:
+        watcher.close()
+
+def test_rewrittenInPlace(tmp_path, fastPoll, monkeypatch):
+    fp = tmp_path / "a.png"
+    fp.write_bytes(b"x" * 10)
+    watcher = FolderWatcher([str(tmp_path)], ['png'], False, 0.1, True)
+    try:
+        sleep(0.1)
+        fp.write_bytes(b"y" * 20) # folder's mtime doesn't change
+        monkeypatch.setattr(watchFolder, "WATCH_RESCAN_SEC", 0.0)
+        assert pollFor(watcher) == [str(fp)]
+    finally:
+        watcher.close()
@@ -0,0 +1,471 @@
+# coding: UTF-8
+
+"""
+tiledProc
+Processing very large images in strips of rows for pyImgProc
+  (without wxPython), so that only a few strips are in memory
+  instead of the whole image.
+Uncompressed images (TIFF, BMP, PPM/PGM) are read strip by strip
+  from the disk, and TIFF is written strip by strip. Other formats
+  are decoded or encoded as a whole, but processing still doesn't
+  copy the whole image.
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import struct
+from os import path, replace, remove
+from threading import Lock
+
+import numpy as np
+from PIL import Image
+
+DEBUG = False
+TILE_MIN_PIXELS = 64 * 1024 * 1024 # images with this many pixels or more
+  # are processed in strips, if all their processes are tile-local
+STRIP_BYTES = 16 * 1024 * 1024 # approx. size of a strip in memory
+TILE_MODES = ['L', 'RGB', 'RGBA'] # image modes processed in strips;
+  # pixels of other modes (e.g.: palette indices) aren't what operators
+  # expect on strips, so they are processed as a whole
+TIFF_EXT = ['.tif', '.tiff']
+_openLock = Lock()
+
+#-----------------------------------------------------------------------
+
+def openLarge(fp):
+    """ Open an image file without the decompression bomb check of PIL,
+    which refuses images larger than about 179 megapixels.
+
+    Args:
+        fp (str): File path of image.
+
+    Returns:
+        img (PIL.Image): Opened (not yet decoded) image.
+    """
+    with _openLock:
+        maxPx = Image.MAX_IMAGE_PIXELS
+        Image.MAX_IMAGE_PIXELS = None
+        try: img = Image.open(fp)
+        finally: Image.MAX_IMAGE_PIXELS = maxPx
+    return img
+
+#-----------------------------------------------------------------------
+
+def isTileable(plan):
+    """ Whether all operators of a plan can be applied to strips.
+
+    Args:
+        plan (ImgProcPlan): Compiled processing plan.
+
+    Returns:
+        (bool)
+    """
+    return len(plan.ops) > 0 and all([op.tileLocal for op in plan.ops])
+
+#-----------------------------------------------------------------------
+
+def isLargeImg(fp, minPixels=None):
+    """ Whether an image file is large enough to be processed in strips,
+    and has one of TILE_MODES. Only the header of the file is read.
+
+    Args:
+        fp (str): File path of image.
+        minPixels (int): Min. number of pixels. None means
+          TILE_MIN_PIXELS.
+
+    Returns:
+        (bool)
+    """
+    if minPixels is None: minPixels = TILE_MIN_PIXELS
+    try: img = openLarge(fp)
+    except Exception: return False # let the normal processing report it
+    w, h = img.size
+    mode = img.mode
+    img.close()
+    return w * h >= minPixels and mode in TILE_MODES
+
+#-----------------------------------------------------------------------
+
+def procFileTiled(fp, oFP, plan, stripBytes=STRIP_BYTES):
+    """ Process an image file in strips and save the result.
+
+    Args:
+        fp (str): File path of image to process, which has one of
+          TILE_MODES (see isLargeImg).
+        oFP (str): File path to save the processed image.
+        plan (ImgProcPlan): Compiled processing plan,
+          whose operators are all tile-local (see isTileable).
+        stripBytes (int): Approx. size of a strip in bytes.
+
+    Returns:
+        None
+
+    Examples:
+        >>> procFileTiled('scan.tif', 'scan_p.tif', plan)
+    """
+    if DEBUG: print("tiledProc.procFileTiled()")
+
+    src = StripSource(fp)
+    tmpFP = oFP + ".tmp" # the source can be the output file
+    out = None
+    try:
+        tPlan = TiledPlan(plan, src.h, src.w)
+        stripH = max(1, stripBytes // max(1, src.w * src.nCh))
+        for y0, strip in tPlan.run(src, stripH):
+            if out is None:
+                sz = (tPlan.w, tPlan.h)
+                if path.splitext(oFP)[1].lower() in TIFF_EXT:
+                    out = StripTiffWriter(tmpFP, sz, strip, stripH)
+                else:
+                    out = ArrayWriter(oFP, sz, strip)
+            out.write(y0, strip)
+        src.close()
+        if isinstance(out, StripTiffWriter):
+            out.close()
+            replace(tmpFP, oFP)
+        else:
+            out.close()
+    except Exception:
+        src.close()
+        if path.isfile(tmpFP): remove(tmpFP)
+        raise
+
+#=======================================================================
+
+class StripSource:
+    """ Rows of an image file.
+    For an uncompressed file, rows are read from the disk through
+      a memory map, when requested. Other files are decoded at once.
+
+    Args:
+        fp (str): File path of image.
+
+    Attributes:
+        w (int): Width.
+        h (int): Height.
+        nCh (int): Number of channels.
+    """
+    def __init__(self, fp):
+        if DEBUG: print("StripSource.__init__()")
+
+        img = openLarge(fp)
+        self.w, self.h = img.size
+        self.nCh = len(img.getbands())
+        self.mm = None # memory map of the file
+        self.arr = None # decoded image
+        raw = self.rawLayout(img)
+        if raw is not None:
+            self.offset, self.stride, self.orientation, self.flagBGR = raw
+            img.close()
+            self.mm = np.memmap(fp, dtype=np.uint8, mode='r')
+        else:
+            self.arr = np.asarray(img) # decode the whole image
+            img.close()
+
+    #-------------------------------------------------------------------
+
+    def rawLayout(self, img):
+        """ Layout of pixels in an uncompressed file.
+
+        Args:
+            img (PIL.Image): Opened image.
+
+        Returns:
+            (tuple): Offset of pixel data, bytes per row, orientation
+              (1: top-down, -1: bottom-up) and whether channels are
+              in BGR order. None if the file can't be read by rows.
+        """
+        if img.mode not in ['RGB', 'RGBA', 'L']: return None
+        if len(img.tile) != 1: return None
+        codec, box, offset, args = img.tile[0][:4]
+        if codec != 'raw' or tuple(box) != (0, 0, self.w, self.h):
+            return None
+        if isinstance(args, str): args = (args, 0, 1)
+        rawMode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if rawMode == img.mode: flagBGR = False
+        elif rawMode == 'BGR' and img.mode == 'RGB': flagBGR = True
+        else: return None
+        if stride == 0: stride = self.w * self.nCh
+        return (offset, stride, orientation, flagBGR)
+
+    #-------------------------------------------------------------------
+
+    def read(self, y0, y1):
+        """ Read rows.
+
+        Args:
+            y0 (int): First row.
+            y1 (int): Row after the last row.
+
+        Returns:
+            (np.ndarray): Writable array of rows.
+        """
+        if self.arr is not None: return self.arr[y0:y1].copy()
+        rowBytes = self.w * self.nCh
+        if self.orientation == 1:
+            s = self.offset + y0 * self.stride
+            rows = self.mm[s:s+(y1-y0)*self.stride]
+            rows = rows.reshape((y1-y0, self.stride))
+        else: # bottom-up
+            s = self.offset + (self.h - y1) * self.stride
+            rows = self.mm[s:s+(y1-y0)*self.stride]
+            rows = rows.reshape((y1-y0, self.stride))[::-1]
+        rows = rows[:,:rowBytes]
+        if self.nCh == 1: rows = rows.reshape((y1-y0, self.w))
+        else: rows = rows.reshape((y1-y0, self.w, self.nCh))
+        if self.flagBGR: rows = rows[:,:,::-1]
+        return np.array(rows) # copy into memory
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Release the file and the decoded image.
+
+        Args: None
+
+        Returns: None
+        """
+        self.mm = None # no view of it is left; unmapped at once
+        self.arr = None
+
+#=======================================================================
+
+class TiledPlan:
+    """ Plan to run tile-local operators of ImgProcPlan on strips.
+    Operators changing the view (crop, flip) are applied to arrays of
+      row and column indices to find, which rows and columns of
+      the previous frame each frame consists of. Then, for each strip
+      of output rows, the source rows are read and passed through
+      all operators.
+
+    Args:
+        plan (ImgProcPlan): Compiled processing plan.
+        h (int): Height of source image.
+        w (int): Width of source image.
+
+    Attributes:
+        h (int): Height of output image.
+        w (int): Width of output image.
+    """
+    def __init__(self, plan, h, w):
+        if DEBUG: print("TiledPlan.__init__()")
+
+        self.stages = [] # (operator, frame size, rows, column slice)
+        for op in plan.ops:
+            if op.view:
+                rIdx = np.broadcast_to(np.arange(h)[:,None], (h, w))
+                cIdx = np.broadcast_to(np.arange(w)[None,:], (h, w))
+                rIdx = op.apply(rIdx)
+                cIdx = op.apply(cIdx)
+                if rIdx.size == 0:
+                    raise ValueError("image is empty after %s"%(
+                                    "/".join([s[0] for s in op.steps])))
+                rows = np.array(rIdx[:,0]) # row in the previous frame
+                cols = self.toSlice(cIdx[0,:])
+                self.stages.append((op, (h, w), rows, cols))
+                h, w = rIdx.shape
+            else:
+                self.stages.append((op, (h, w), None, None))
+        self.h = h
+        self.w = w
+        ### source row of each output row
+        self.srcRows = np.arange(h)
+        for op, sz, rows, cols in reversed(self.stages):
+            if rows is not None: self.srcRows = rows[self.srcRows]
+
+    #-------------------------------------------------------------------
+
+    def toSlice(self, idx):
+        """ Convert consecutive indices (ascending or descending)
+        to a slice.
+
+        Args:
+            idx (np.ndarray): Indices.
+
+        Returns:
+            (slice)
+        """
+        start = int(idx[0])
+        step = 1 if len(idx) == 1 else int(idx[1] - idx[0])
+        stop = start + step * len(idx)
+        if stop < 0: stop = None
+        return slice(start, stop, step)
+
+    #-------------------------------------------------------------------
+
+    def run(self, src, stripH):
+        """ Process the source in strips of output rows.
+
+        Args:
+            src (StripSource): Source image.
+            stripH (int): Number of rows in a strip.
+
+        Yields:
+            y0 (int): First output row of the strip.
+            strip (np.ndarray): Processed rows.
+        """
+        for y0 in range(0, self.h, stripH):
+            srcRows = self.srcRows[y0:y0+stripH]
+            r0 = int(srcRows.min())
+            r1 = int(srcRows.max()) + 1
+            strip = src.read(r0, r1)
+            for op, (h, w), rows, cols in self.stages:
+                if rows is None:
+                    strip = op.applyStrip(strip, r0, h, w)
+                    continue
+                # rows of this frame, which are from rows of the strip
+                j = np.nonzero((rows >= r0) & (rows < r1))[0]
+                j0 = int(j[0])
+                j1 = int(j[-1]) + 1
+                strip = strip[self.toSlice(rows[j0:j1] - r0)][:,cols]
+                r0 = j0
+                r1 = j1
+            yield y0, strip
+
+#=======================================================================
+
+class StripTiffWriter:
+    """ Writer of an uncompressed TIFF file, strip by strip.
+    The strips are written in order, and the directory of the file
+      is written at the end.
+
+    Args:
+        fp (str): File path to write.
+        sz (tuple): Width and height of image.
+        strip (np.ndarray): A strip, to know channels of the image.
+        rowsPerStrip (int): Number of rows in each strip
+          (except the last).
+    """
+    def __init__(self, fp, sz, strip, rowsPerStrip):
+        if DEBUG: print("StripTiffWriter.__init__()")
+
+        self.w, self.h = sz
+        self.nCh = 1 if strip.ndim == 2 else strip.shape[2]
+        if self.w * self.h * self.nCh >= 2**32 - 2**20:
+            raise ValueError("image is too large for TIFF (4 GB)")
+        self.rowsPerStrip = rowsPerStrip
+        self.offsets = []
+        self.counts = []
+        self.nextRow = 0
+        self.f = open(fp, 'wb')
+        self.f.write(b'II*\x00' + struct.pack('<I', 0)) # header
+
+    #-------------------------------------------------------------------
+
+    def write(self, y0, strip):
+        """ Write a strip.
+
+        Args:
+            y0 (int): First row of the strip.
+            strip (np.ndarray): Rows of the image.
+
+        Returns:
+            None
+        """
+        if y0 != self.nextRow: raise ValueError("strips must be in order")
+        data = np.ascontiguousarray(strip, dtype=np.uint8).tobytes()
+        self.offsets.append(self.f.tell())
+        self.counts.append(len(data))
+        self.f.write(data)
+        self.nextRow += strip.shape[0]
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Write the image file directory and close the file.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("StripTiffWriter.close()")
+
+        def writeArr(fmt, values):
+            if self.f.tell() % 2 == 1: self.f.write(b'\x00') # word align
+            pos = self.f.tell()
+            self.f.write(struct.pack('<%i%s'%(len(values), fmt), *values))
+            return pos
+        SHORT, LONG = 3, 4
+        if len(self.offsets) == 1:
+            offsets = (LONG, 1, self.offsets[0])
+            counts = (LONG, 1, self.counts[0])
+        else:
+            offsets = (LONG, len(self.offsets), writeArr('I', self.offsets))
+            counts = (LONG, len(self.counts), writeArr('I', self.counts))
+        if self.nCh <= 2: bps = (SHORT, self.nCh, 8 | (8 << 16))
+        else: bps = (SHORT, self.nCh, writeArr('H', [8]*self.nCh))
+        photometric = 1 if self.nCh <= 2 else 2 # BlackIsZero or RGB
+        tags = [
+                (256, LONG, 1, self.w), # ImageWidth
+                (257, LONG, 1, self.h), # ImageLength
+                (258,) + bps, # BitsPerSample
+                (259, SHORT, 1, 1), # Compression: none
+                (262, SHORT, 1, photometric), # PhotometricInterpretation
+                (273,) + offsets, # StripOffsets
+                (277, SHORT, 1, self.nCh), # SamplesPerPixel
+                (278, LONG, 1, self.rowsPerStrip), # RowsPerStrip
+                (279,) + counts, # StripByteCounts
+                (284, SHORT, 1, 1), # PlanarConfiguration: chunky
+               ]
+        if self.nCh in [2, 4]:
+            tags.append((338, SHORT, 1, 2)) # ExtraSamples: alpha
+        if self.f.tell() % 2 == 1: self.f.write(b'\x00')
+        ifdPos = self.f.tell()
+        self.f.write(struct.pack('<H', len(tags)))
+        for tag, typ, count, value in tags:
+            self.f.write(struct.pack('<HHII', tag, typ, count, value))
+        self.f.write(struct.pack('<I', 0)) # no next directory
+        self.f.seek(4)
+        self.f.write(struct.pack('<I', ifdPos))
+        self.f.close()
+
+#=======================================================================
+
+class ArrayWriter:
+    """ Collects strips into an array and saves it at the end,
+    for formats which are not written strip by strip.
+
+    Args:
+        fp (str): File path to save.
+        sz (tuple): Width and height of image.
+        strip (np.ndarray): A strip, to know channels of the image.
+    """
+    def __init__(self, fp, sz, strip):
+        if DEBUG: print("ArrayWriter.__init__()")
+
+        self.fp = fp
+        self.arr = np.empty((sz[1], sz[0]) + strip.shape[2:], np.uint8)
+
+    #-------------------------------------------------------------------
+
+    def write(self, y0, strip):
+        """ Copy a strip into the array.
+
+        Args:
+            y0 (int): First row of the strip.
+            strip (np.ndarray): Rows of the image.
+
+        Returns:
+            None
+        """
+        self.arr[y0:y0+strip.shape[0]] = strip
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Save the image.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("ArrayWriter.close()")
+
+        Image.fromarray(self.arr).save(self.fp)
+        self.arr = None
+
+#=======================================================================
+
+if __name__ == '__main__':
+    pass
@@ -0,0 +1,467 @@
+# coding: UTF-8
+
+"""
+watchFolder
+Watching folders and processing image files as they arrive
+  in pyImgProc (without wxPython).
+New files are noticed with inotify (Linux), or by comparing snapshots
+  of folders (os.scandir) on other systems and on network folders.
+A file is processed when its size and modification time stopped
+  changing for a while (i.e.: it's completely written).
+
+Usage:
+    python imgProcEngine.py pipeline.json --watch -f .png ./incoming
+
+Jinook Oh, Cognitive Biology department, University of Vienna
+October 2019.
+"""
+
+import sys, ctypes, ctypes.util, struct, signal
+from os import path, read, close, fsencode, fsdecode, stat
+from select import select
+from time import time, sleep, perf_counter
+from multiprocessing import Pool
+
+from fileIndex import DirIndex
+from batchStore import LogSink
+
+DEBUG = False
+WATCH_POLL_SEC = 1.0 # interval of scanning folders without inotify
+WATCH_RESCAN_SEC = 60.0 # interval of reading all folders again
+  # without inotify (e.g.: files rewritten in place)
+WATCH_SETTLE_SEC = 2.0 # seconds a file has to stay unchanged
+  # before processing
+### inotify constants (linux/inotify.h)
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+IN_EVENT = struct.Struct("iIII") # wd, mask, cookie, len (of name)
+
+#-----------------------------------------------------------------------
+
+def loadInotify():
+    """ Load inotify functions of the C library.
+
+    Args: None
+
+    Returns:
+        libc (ctypes.CDLL): C library with inotify functions.
+          None if inotify is not available.
+    """
+    if not sys.platform.startswith("linux"): return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                           ctypes.c_uint32]
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+#-----------------------------------------------------------------------
+
+def watchFolders(folders, steps, imgExt='', logFile='', maskFP=None,
+                 nWorkers=1, recursive=False, q=None, stopEvent=None,
+                 settleSec=WATCH_SETTLE_SEC, flagPoll=False):
+    """ Watch folders and process image files as they arrive,
+    until 'stopEvent' is set (or KeyboardInterrupt).
+    Files, which exist when watching starts, are not processed.
+    Output files written into the watched folders are not processed.
+
+    Args:
+        folders (list): Folder paths to watch.
+        steps (list): List of (process name, parameter list) tuples.
+        imgExt (str): Image file extension for saving.
+        logFile (str): File path of log file (batchStore.LogSink).
+          Empty string for no logging.
+        maskFP (str): File path of masking image.
+          None means imgProcEngine.MASK_FP.
+        nWorkers (int): Number of worker processes.
+          1 means processing in the calling process.
+        recursive (bool): Whether to watch sub-folders.
+        q (Queue, optional): Queue to report progress. After each file,
+          ('progress', number of finished files, number of arrived
+          files, result tuple) is put into the queue.
+        stopEvent (threading.Event, optional): Set to stop watching.
+        settleSec (float): Seconds a file has to stay unchanged
+          before processing.
+        flagPoll (bool): Whether to scan folders, even if inotify
+          is available (e.g.: for network folders).
+
+    Returns:
+        summary (dict): As runBatch; 'nFiles' is number of arrived files.
+
+    Examples:
+        >>> stopEvent = Event()
+        >>> Thread(target=watchFolders, args=(['./incoming'], steps, '.png'),
+        ...        kwargs=dict(stopEvent=stopEvent)).start()
+    """
+    if DEBUG: print("watchFolder.watchFolders()")
+
+    # imported here, as imgProcEngine imports this module for its CLI
+    from imgProcEngine import EXT_LIST, MASK_FP, MAX_ERRS
+    from imgProcEngine import compilePlan, logRecord, getOutputFP
+    from imgProcEngine import _procFileSafe
+
+    t0 = perf_counter()
+    if maskFP is None: maskFP = MASK_FP
+    plan = compilePlan(steps, maskFP) # compile once for all files
+    watcher = FolderWatcher(folders, EXT_LIST, recursive, settleSec,
+                            flagPoll)
+    pool = None
+    if nWorkers > 1: pool = Pool(nWorkers, _initWatchWorker, (plan, imgExt))
+    inFlight = [] # results of files in worker processes
+    summary = dict(nFiles=0, nDone=0, nErr=0, nSkipped=0, sec=0.0,
+                   outBytes=0, errs=[])
+    log = None
+    if logFile != '': log = LogSink(logFile)
+
+    def onResult(rslt):
+        fp, oFP, err, sec, nBytes = rslt[:5]
+        watcher.release(getOutputFP(fp, imgExt))
+        if err == '':
+            summary["nDone"] += 1
+            summary["outBytes"] += nBytes
+            watcher.ignore(oFP) # don't process the output as a new file
+        else:
+            summary["nErr"] += 1
+            if len(summary["errs"]) < MAX_ERRS:
+                summary["errs"].append((fp, err))
+        if log is not None: log.write(logRecord(rslt, steps))
+        if q is not None:
+            q.put(('progress', summary["nDone"]+summary["nErr"],
+                   summary["nFiles"], rslt))
+
+    try:
+        while stopEvent is None or not stopEvent.is_set():
+            for fp in watcher.poll(0.5):
+                summary["nFiles"] += 1
+                if pool is None:
+                    onResult(_procFileSafe(fp, plan, imgExt, False))
+                else:
+                    # output, which will appear, is not a new file
+                    watcher.hold(getOutputFP(fp, imgExt))
+                    inFlight.append(pool.apply_async(_procFileSafe, (fp,)))
+            ### collect finished files
+            remaining = []
+            for r in inFlight:
+                if r.ready(): onResult(r.get())
+                else: remaining.append(r)
+            inFlight = remaining
+            if log is not None and len(inFlight) == 0: log.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if pool is not None:
+            pool.close() # finish files, which arrived already
+            for r in inFlight: onResult(r.get())
+            pool.join()
+        watcher.close()
+        if log is not None: log.close()
+    summary["sec"] = perf_counter() - t0
+    return summary
+
+#-----------------------------------------------------------------------
+
+def _initWatchWorker(plan, imgExt):
+    """ Initialize a worker process of watchFolders.
+    Ctrl+C is left to the main process, which lets workers finish
+      files, which arrived already.
+
+    Args:
+        plan (ImgProcPlan): Compiled processing plan.
+        imgExt (str): Image file extension for saving.
+
+    Returns:
+        None
+    """
+    from imgProcEngine import _initWorker
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _initWorker(plan, imgExt)
+
+#=======================================================================
+
+class FolderWatcher:
+    """ Finds image files, which were added or changed in folders,
+    after they stopped changing for 'settleSec' seconds.
+    With inotify, files are noticed by events of the kernel; otherwise
+      folders are checked every WATCH_POLL_SEC seconds, and only
+      folders with changed (or recent) modification time are read
+      again (fileIndex.DirIndex). As a file rewritten in place doesn't
+      change the modification time of its folder, all folders are read
+      again every WATCH_RESCAN_SEC seconds.
+
+    Args:
+        folders (list): Folder paths to watch.
+        extList (list): File extensions (case-insensitive) to watch.
+        recursive (bool): Whether to watch sub-folders.
+        settleSec (float): Seconds a file has to stay unchanged.
+        flagPoll (bool): Whether to scan folders, even if inotify
+          is available.
+
+    Examples:
+        >>> watcher = FolderWatcher(['./incoming'], ['jpg', 'png'])
+        >>> while True:
+        ...     for fp in watcher.poll(1.0): print(fp)
+    """
+    def __init__(self, folders, extList=[], recursive=False,
+                 settleSec=WATCH_SETTLE_SEC, flagPoll=False):
+        if DEBUG: print("FolderWatcher.__init__()")
+
+        self.folders = [path.abspath(dp) for dp in folders]
+        self.extSet = set([ext.lower() for ext in extList])
+        self.recursive = recursive
+        self.settleSec = settleSec
+        self.dirIndex = DirIndex(extList)
+        self.known = self.snapshot() # signature of each known file
+        self.pending = {} # [signature, time it was last changed]
+          # of each file, which is not settled yet
+        self.held = set() # files not to return yet (e.g.: being written)
+        self.lastScan = time()
+        self.lastFullScan = self.lastScan
+        self.inotify = None
+        if not flagPoll: self.inotify = self.startInotify()
+
+    #-------------------------------------------------------------------
+
+    def snapshot(self, flagScan=False):
+        """ Signatures of all image files in the folders.
+
+        Args:
+            flagScan (bool): Whether to read all folders again.
+              Otherwise only folders, whose modification time changed
+              (or was close to the last scan), are read again.
+
+        Returns:
+            snap (dict): Size and modification time of each file.
+        """
+        if flagScan: self.dirIndex.invalidate(self.folders)
+        snap = {}
+        for dp, rec in self.dirIndex.walk(self.folders, self.recursive,
+                                          flagCheck=True):
+            names, sizes, mtimes = self.dirIndex.statRec(dp, rec)[1:4]
+            for i, fn in enumerate(names):
+                if fn.startswith("."): continue # e.g.: temporary file
+                snap[path.join(dp, fn)] = (sizes[i], mtimes[i])
+        return snap
+
+    #-------------------------------------------------------------------
+
+    def startInotify(self):
+        """ Start watching the folders with inotify.
+
+        Args: None
+
+        Returns:
+            (dict): File descriptor ('fd'), C library ('libc') and
+              folder path of each watch descriptor ('wds').
+              None if inotify is not available.
+        """
+        libc = loadInotify()
+        if libc is None: return None
+        fd = libc.inotify_init1(IN_NONBLOCK|IN_CLOEXEC)
+        if fd < 0: return None
+        self.inotify = dict(fd=fd, libc=libc, wds={})
+        for dp, rec in self.dirIndex.walk(self.folders, self.recursive):
+            if not self.addWatch(dp):
+                close(fd)
+                return None
+        return self.inotify
+
+    #-------------------------------------------------------------------
+
+    def addWatch(self, dp):
+        """ Add an inotify watch of a folder.
+
+        Args:
+            dp (str): Folder path.
+
+        Returns:
+            (bool): Whether it succeeded (e.g.: limit of watches).
+        """
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+        wd = self.inotify["libc"].inotify_add_watch(self.inotify["fd"],
+                                                    fsencode(dp), mask)
+        if wd < 0: return False
+        self.inotify["wds"][wd] = dp
+        return True
+
+    #-------------------------------------------------------------------
+
+    def readInotify(self, timeout):
+        """ Read inotify events, waiting for them up to 'timeout'.
+
+        Args:
+            timeout (float): Max. seconds to wait.
+
+        Returns:
+            fps (list): Paths of created or written files.
+        """
+        fd = self.inotify["fd"]
+        if len(select([fd], [], [], timeout)[0]) == 0: return []
+        try: data = read(fd, 65536)
+        except BlockingIOError: return []
+        fps = []
+        i = 0
+        while i + IN_EVENT.size <= len(data):
+            wd, mask, cookie, nameLen = IN_EVENT.unpack_from(data, i)
+            i += IN_EVENT.size
+            name = fsdecode(data[i:i+nameLen].rstrip(b"\0"))
+            i += nameLen
+            if mask & IN_Q_OVERFLOW:
+            # events were lost; compare with a new snapshot
+                self.dirIndex.invalidate()
+                fps += self.changedFiles(self.snapshot())
+                continue
+            if mask & IN_IGNORED:
+                self.inotify["wds"].pop(wd, None) # folder was removed
+                continue
+            dp = self.inotify["wds"].get(wd)
+            if dp is None or name == "": continue
+            fp = path.join(dp, name)
+            if mask & IN_ISDIR:
+                if self.recursive and not name.startswith(".") and \
+                  mask & (IN_CREATE|IN_MOVED_TO):
+                # new sub-folder; watch it, and take files already in it
+                    self.addWatch(fp)
+                    self.dirIndex.invalidate([fp])
+                    for sdp, rec in self.dirIndex.walk([fp], True):
+                        if sdp != fp: self.addWatch(sdp)
+                        fps += [path.join(sdp, fn) for fn in rec[1]]
+                continue
+            fps.append(fp)
+        return fps
+
+    #-------------------------------------------------------------------
+
+    def changedFiles(self, snap):
+        """ Files added or changed in a snapshot since the known state,
+        forgetting files which don't exist anymore.
+
+        Args:
+            snap (dict): Snapshot made by 'snapshot'.
+
+        Returns:
+            fps (list): Paths of added or changed files.
+        """
+        fps = [fp for fp, sig in snap.items() if self.known.get(fp) != sig]
+        for fp in list(self.known.keys()):
+            if fp not in snap and fp not in self.pending: del self.known[fp]
+        return fps
+
+    #-------------------------------------------------------------------
+
+    def poll(self, timeout=1.0):
+        """ Wait for changes up to 'timeout' seconds, and return files,
+        which were settled.
+
+        Args:
+            timeout (float): Max. seconds to wait.
+
+        Returns:
+            ready (list): Paths of files to process.
+        """
+        if self.inotify is not None:
+            fps = self.readInotify(timeout)
+        else:
+            sleep(max(0.0, min(timeout,
+                               self.lastScan + WATCH_POLL_SEC - time())))
+            fps = []
+            if time() - self.lastScan >= WATCH_POLL_SEC:
+                self.lastScan = time()
+                flagScan = self.lastScan - self.lastFullScan >= \
+                             WATCH_RESCAN_SEC
+                if flagScan: self.lastFullScan = self.lastScan
+                fps = self.changedFiles(self.snapshot(flagScan))
+        now = time()
+        for fp in fps:
+            if fp in self.pending: continue
+            fn = path.basename(fp)
+            if fn.startswith("."): continue
+            if len(self.extSet) > 0 and \
+              fn.rpartition(".")[2].lower() not in self.extSet:
+                continue
+            self.pending[fp] = [None, now]
+        ### files, which stopped changing
+        ready = []
+        for fp, p in list(self.pending.items()):
+            try: st = stat(fp)
+            except OSError:
+                del self.pending[fp] # removed (or renamed)
+                continue
+            sig = (st.st_size, st.st_mtime)
+            if sig != p[0]:
+                p[0] = sig
+                p[1] = now
+            elif now - p[1] >= self.settleSec and st.st_size > 0 and \
+              fp not in self.held:
+                del self.pending[fp]
+                # the folder's record may have an older size of the file
+                self.dirIndex.invalidate([path.dirname(fp)], False)
+                if self.known.get(fp) == sig: continue # e.g.: own output
+                self.known[fp] = sig
+                ready.append(fp)
+        return ready
+
+    #-------------------------------------------------------------------
+
+    def ignore(self, fp):
+        """ Record a file (e.g.: an output file) as known,
+        so that it's not returned as a new file.
+
+        Args:
+            fp (str): File path.
+
+        Returns:
+            None
+        """
+        try: st = stat(fp)
+        except OSError: return
+        self.known[path.abspath(fp)] = (st.st_size, st.st_mtime)
+
+    #-------------------------------------------------------------------
+
+    def hold(self, fp):
+        """ Keep a file pending until it's released (e.g.: an output file,
+        which a worker process is writing).
+
+        Args:
+            fp (str): File path.
+
+        Returns:
+            None
+        """
+        self.held.add(path.abspath(fp))
+
+    #-------------------------------------------------------------------
+
+    def release(self, fp):
+        """ Release a file held by 'hold'.
+
+        Args:
+            fp (str): File path.
+
+        Returns:
+            None
+        """
+        self.held.discard(path.abspath(fp))
+
+    #-------------------------------------------------------------------
+
+    def close(self):
+        """ Stop watching.
+
+        Args: None
+
+        Returns: None
+        """
+        if DEBUG: print("FolderWatcher.close()")
+
+        if self.inotify is not None:
+            close(self.inotify["fd"])
+            self.inotify = None